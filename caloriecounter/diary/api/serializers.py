@@ -2,16 +2,57 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SerializerMethodField
 
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 
-from caloriecounter.diary.models import DiaryEntry
-from caloriecounter.food.api.serializers import NutritionalInformationSerializer
+from caloriecounter.diary.models import DiaryEntry, delete_entries
+from caloriecounter.diary.nutrition import attach_nutritional_information
+from caloriecounter.diary.totals import update_daily_totals
+from caloriecounter.food.api.mixins import DynamicFieldsSerializerMixin, FastReadSerializerMixin, \
+    NutrientQuantityMapField, RequestCachedPrimaryKeyRelatedField
+from caloriecounter.food.api.serializers import NutritionalInformationSerializer, FoodProductSerializer, \
+    NutrientSerializer, UnitSerializer
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.models import FoodProduct, Unit
+from caloriecounter.food.request_cache import request_cache
 
 
-class DiaryEntrySerializer(serializers.ModelSerializer):
+class DiaryEntryListSerializer(serializers.ListSerializer):
+    """
+    Computes the nutritional information of all listed entries at once, instead of entry by entry.
+    """
+    def to_representation(self, data):
+        entries = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'nutritional_information' in self.child.fields:
+            attach_nutritional_information(entries)
+
+        return super().to_representation(entries)
+
+
+class DiaryEntrySerializer(DynamicFieldsSerializerMixin, FastReadSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DiaryEntry
         fields = ['pk', 'date', 'time', 'product', 'quantity', 'unit', 'nutritional_information']
+        list_serializer_class = DiaryEntryListSerializer
+
+        expandable_fields = {
+            'product': (FoodProductSerializer, ['product__common_names',
+                                                'product__foodproductnutrient_set',
+                                                'product__foodproductnutrient_set__nutrient',
+                                                'product__foodproductunit_set']),
+            'unit': (UnitSerializer, []),
+        }
+        compact_fields = {
+            'nutritional_information': NutrientQuantityMapField,
+        }
+        prefetch_fields = {
+            'nutritional_information': ['product__foodproductnutrient_set',
+                                        'product__foodproductnutrient_set__nutrient'],
+        }
+
+    # Products and units are resolved through the request cache, so validating, saving and rendering
+    # an entry all use the same instances.
+    serializer_related_field = RequestCachedPrimaryKeyRelatedField
 
     nutritional_information = NutritionalInformationSerializer(many=True, read_only=True)
 
@@ -54,3 +95,171 @@ class DiaryEntrySerializer(serializers.ModelSerializer):
             })
 
         return list
+
+
+class DiaryEntryBulkSerializer(serializers.Serializer):
+    """
+    Creates, updates and deletes a number of diary entries of the logged in user at once.
+
+    The products, units and entries of all items are loaded up front, with one query each,
+    so validating the items does not query them again (see request_cache.py).
+    If any item is invalid, nothing is written, and the errors are returned per item.
+    Otherwise all changes are written in a single transaction, with bulk_create and bulk_update.
+    """
+
+    # The maximum number of items of each operation.
+    max_items = 500
+
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list,
+                                   max_length=max_items)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list,
+                                   max_length=max_items)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list,
+                                   max_length=max_items)
+
+    UPDATE_FIELDS = ['date', 'time', 'product', 'quantity', 'unit', 'quantity_in_default_unit']
+
+    def get_user(self):
+        return self.context['request'].user
+
+    def prefetch(self, data):
+        """
+        Load the products, units and existing entries of all items, and add them to the request cache.
+        Returns the existing entries of the user, by primary key.
+        """
+        items = data['create'] + data['update']
+        product_ids = {item['product'] for item in items if isinstance(item.get('product'), int)}
+        unit_ids = {item['unit'] for item in items if isinstance(item.get('unit'), int)}
+        entry_ids = {item['pk'] for item in data['update'] if isinstance(item.get('pk'), int)} | set(data['delete'])
+
+        entries = DiaryEntry.objects.filter(user=self.get_user(), pk__in=entry_ids).in_bulk() if entry_ids else {}
+        for entry in entries.values():
+            request_cache.add(entry.product, entry.unit, entry.portion)
+
+        products = list(FoodProduct.objects.filter(pk__in=product_ids)
+                        .prefetch_related('foodproductnutrient_set', 'foodproductnutrient_set__nutrient')) \
+            if product_ids else []
+        request_cache.add(*products)
+        if unit_ids:
+            request_cache.add(*Unit.objects.filter(pk__in=unit_ids))
+
+        conversion_tables.get_many(products + [entry.product for entry in entries.values()])
+
+        return entries
+
+    def validate(self, data):
+        entries = self.prefetch(data)
+        errors = {}
+
+        self.create_serializers = []
+        create_errors = []
+        for item in data['create']:
+            serializer = DiaryEntrySerializer(data=item, context=self.context)
+            create_errors.append({} if serializer.is_valid() else serializer.errors)
+            self.create_serializers.append(serializer)
+
+        self.update_serializers = []
+        update_errors = []
+        updated = set()
+        for item in data['update']:
+            entry = entries.get(item.get('pk'))
+            if entry is None or entry.pk in updated:
+                update_errors.append({'pk': [_('Unknown or duplicate diary entry.')]})
+                continue
+
+            updated.add(entry.pk)
+            serializer = DiaryEntrySerializer(entry, data=item, partial=True, context=self.context)
+            update_errors.append({} if serializer.is_valid() else serializer.errors)
+            self.update_serializers.append(serializer)
+
+        self.deleted_entries = []
+        delete_errors = []
+        for pk in data['delete']:
+            entry = entries.get(pk)
+            if entry is None or pk in updated:
+                delete_errors.append([_('Unknown, duplicate or updated diary entry.')])
+                continue
+
+            updated.add(pk)
+            delete_errors.append([])
+            self.deleted_entries.append(entry)
+
+        for name, item_errors in (('create', create_errors), ('update', update_errors), ('delete', delete_errors)):
+            if any(item_errors):
+                errors[name] = item_errors
+
+        if errors:
+            raise ValidationError(errors)
+
+        return data
+
+    def save(self, **kwargs):
+        user = self.get_user()
+
+        created = [DiaryEntry(user=user, **serializer.validated_data) for serializer in self.create_serializers]
+        updated = []
+        for serializer in self.update_serializers:
+            entry = serializer.instance
+            for name, value in serializer.validated_data.items():
+                setattr(entry, name, value)
+            updated.append(entry)
+
+        for entry in created + updated:
+            entry.quantity_in_default_unit = entry.compute_quantity_in_default_unit()
+        deleted = [entry.pk for entry in self.deleted_entries]
+
+        with transaction.atomic():
+            # The stored rows are locked before they are changed, see DiaryEntry.get_saved_entries.
+            removed = DiaryEntry.get_saved_entries(updated + self.deleted_entries)
+
+            DiaryEntry.objects.bulk_create(created)
+            DiaryEntry.objects.bulk_update(updated, self.UPDATE_FIELDS)
+            delete_entries(self.deleted_entries)
+
+            # Entries that were deleted meanwhile are not added back to the totals.
+            update_daily_totals(removed=removed,
+                                added=created + [entry for entry, saved in zip(updated, removed) if saved is not None])
+
+        for entry in created + updated:
+            entry.store_saved_state()
+
+        self.instance = {'create': created, 'update': updated, 'delete': deleted}
+        return self.instance
+
+    def to_representation(self, instance):
+        return {
+            'create': DiaryEntrySerializer(instance['create'], many=True, context=self.context).data,
+            'update': DiaryEntrySerializer(instance['update'], many=True, context=self.context).data,
+            'delete': instance['delete'],
+        }
+
+
+class DiarySummarySerializer(DynamicFieldsSerializerMixin, serializers.Serializer):
+    """
+    The total nutritional information of a day, read from the DailyNutrientTotals.
+    """
+    class Meta:
+        compact_fields = {
+            'nutritional_information': NutrientQuantityMapField,
+        }
+
+    date = serializers.DateField(read_only=True)
+    nutritional_information = NutritionalInformationSerializer(many=True, read_only=True)
+
+
+class DiaryTrendNutrientSerializer(serializers.Serializer):
+    nutrient = NutrientSerializer(read_only=True)
+    totals = serializers.ListField(child=serializers.FloatField(), read_only=True)
+    daily_average = serializers.ListField(child=serializers.FloatField(), read_only=True)
+    moving_average = serializers.ListField(child=serializers.FloatField(), read_only=True)
+
+
+class DiaryTrendSerializer(serializers.Serializer):
+    """
+    The nutrients of a user per week, month or year, with a value per period for every nutrient.
+    """
+    granularity = serializers.CharField(read_only=True)
+    window = serializers.IntegerField(read_only=True)
+    periods = serializers.ListField(child=serializers.DateField(), read_only=True)
+    days = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    nutrients = DiaryTrendNutrientSerializer(many=True, read_only=True)
@@ -5,6 +5,8 @@ from caloriecounter.diary.api import views
 
 router = routers.DefaultRouter()
 router.register(r'diary_entry', views.DiaryEntryViewSet, basename='diary_entry')
+router.register(r'diary_summary', views.DiarySummaryViewSet, basename='diary_summary')
+router.register(r'diary_trends', views.DiaryTrendViewSet, basename='diary_trends')
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
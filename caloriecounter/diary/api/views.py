@@ -1,15 +1,32 @@
+from datetime import date, timedelta
+
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, CreateModelMixin, UpdateModelMixin, DestroyModelMixin
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.schemas.openapi import AutoSchema
 
-from caloriecounter.diary.api.serializers import DiaryEntrySerializer
-from caloriecounter.diary.models import DiaryEntry
+from caloriecounter.diary.api.serializers import DiaryEntryBulkSerializer, DiaryEntrySerializer, \
+    DiarySummarySerializer, DiaryTrendSerializer
+from caloriecounter.diary.models import DiaryEntry, DailyNutrientTotals
+from caloriecounter.diary.nutrition import NutritionalInformation
+from caloriecounter.diary.trends import GRANULARITIES, compute_trends, trend_cache
+from caloriecounter.food.api.mixins import DynamicFieldsViewSetMixin
+from caloriecounter.food.api.pagination import KeysetPagination
+from caloriecounter.food.request_cache import request_cache
 
 from django_filters.rest_framework import DjangoFilterBackend
 
 
-class DiaryEntryViewSet(viewsets.GenericViewSet,
+class DiaryEntryPagination(KeysetPagination):
+    ordering = ('-date', 'time', 'pk')
+
+
+class DiaryEntryViewSet(DynamicFieldsViewSetMixin,
+                        viewsets.GenericViewSet,
                         ListModelMixin,
                         RetrieveModelMixin,
                         CreateModelMixin,
@@ -17,9 +34,11 @@ class DiaryEntryViewSet(viewsets.GenericViewSet,
                         DestroyModelMixin):
     """
     API endpoint that allows DiaryEntries to be viewed, and created.
+    The fields of the returned entries can be selected with ?fields=, ?omit=, ?expand= and ?compact=.
     """
     permission_classes = [IsAuthenticated]
     serializer_class = DiaryEntrySerializer
+    pagination_class = DiaryEntryPagination
     filterset_fields = ('date',)
 
     # schema = AutoSchema()
@@ -32,5 +51,152 @@ class DiaryEntryViewSet(viewsets.GenericViewSet,
 
         return DiaryEntry.objects.filter(user=user)
 
+    # The related objects of an entry that is updated are loaded with it,
+    # so the serializer can use them instead of loading them again (see request_cache.py).
+    def get_object(self):
+        entry = super().get_object()
+        request_cache.add(entry.product, entry.unit, entry.portion)
+        return entry
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
\ No newline at end of file
+        serializer.save(user=self.request.user)
+
+    @action(detail=False, methods=['post'], serializer_class=DiaryEntryBulkSerializer)
+    def bulk(self, request):
+        """
+        Creates, updates and deletes a number of entries in a single transaction:
+        {"create": [entries], "update": [entries with their pk], "delete": [primary keys]}
+
+        Returns the created and updated entries, and the primary keys of the deleted entries,
+        or the errors per item, in which case nothing is changed.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data)
+
+
+class DateRangeMixin:
+    """
+    Reads a range of dates, from ?from= up to and including ?to=, of at most max_days days.
+    """
+
+    # The maximum number of days in a range.
+    max_days = 366
+
+    def get_date(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+
+        if parsed is None:
+            raise ValidationError({name: 'Enter a valid date (YYYY-MM-DD).'})
+
+        return parsed
+
+    # Returns the range for missing dates. By default, both dates default to the other date, or today.
+    def get_default_date_range(self, start, end):
+        start = start or end or date.today()
+        return start, end or start
+
+    def get_date_range(self):
+        start, end = self.get_default_date_range(self.get_date('from'), self.get_date('to'))
+
+        if end < start:
+            raise ValidationError({'to': 'The end of the range can not be before its start.'})
+        if (end - start).days >= self.max_days:
+            raise ValidationError({'to': 'A range can not cover more than {0} days.'.format(self.max_days)})
+
+        return start, end
+
+
+class DiarySummaryViewSet(DateRangeMixin, viewsets.GenericViewSet):
+    """
+    API endpoint that returns the total nutritional information of the logged in user per day,
+    for every day from ?from= up to and including ?to= (both default to today).
+    The totals are read from the DailyNutrientTotals, with a single query, regardless of the number of entries.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = DiarySummarySerializer
+
+    def list(self, request, *args, **kwargs):
+        start, end = self.get_date_range()
+
+        days = {start + timedelta(days=offset): [] for offset in range((end - start).days + 1)}
+        for totals in DailyNutrientTotals.objects.filter(user=request.user, date__range=(start, end)) \
+                .select_related('nutrient').order_by('date', '-nutrient__rank', 'nutrient_id'):
+            days[totals.date].append(NutritionalInformation(totals.quantity, totals.nutrient))
+
+        serializer = self.get_serializer([{'date': day, 'nutritional_information': nutritional_information}
+                                          for day, nutritional_information in days.items()], many=True)
+        return Response(serializer.data)
+
+
+class DiaryTrendViewSet(DateRangeMixin, viewsets.GenericViewSet):
+    """
+    API endpoint that returns the nutrients of the logged in user per ?granularity= (week, month or year),
+    from ?from= (defaults to a year before ?to=) up to and including ?to= (defaults to today).
+
+    For every nutrient, the totals, the average per day and the moving average of the totals over
+    ?window= periods are returned, in the order of the periods. Responses are cached until an entry within
+    the range changes.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = DiaryTrendSerializer
+
+    max_days = 3660
+    max_window = 52
+    default_window = 4
+
+    def get_default_date_range(self, start, end):
+        end = end or date.today()
+        return start or end - timedelta(days=365), end
+
+    def get_granularity(self):
+        granularity = self.request.query_params.get('granularity', 'week')
+        if granularity not in GRANULARITIES:
+            raise ValidationError({'granularity': 'Choose one of: {0}.'.format(', '.join(GRANULARITIES))})
+
+        return granularity
+
+    def get_window(self):
+        try:
+            window = int(self.request.query_params.get('window', self.default_window))
+        except ValueError:
+            window = 0
+
+        if not 1 <= window <= self.max_window:
+            raise ValidationError({'window': 'Enter a number from 1 to {0}.'.format(self.max_window)})
+
+        return window
+
+    def get_trends(self, granularity, start, end, window):
+        trends = compute_trends(self.request.user, granularity, start, end, window)
+
+        serializer = self.get_serializer({
+            'granularity': granularity,
+            'window': window,
+            'periods': trends['periods'],
+            'days': trends['days'].tolist(),
+            'nutrients': [{'nutrient': nutrient,
+                           'totals': trends['totals'][index].tolist(),
+                           'daily_average': trends['daily_average'][index].tolist(),
+                           'moving_average': trends['moving_average'][index].tolist()}
+                          for index, nutrient in enumerate(trends['nutrients'])],
+        })
+        return serializer.data
+
+    def list(self, request, *args, **kwargs):
+        granularity = self.get_granularity()
+        window = self.get_window()
+        start, end = self.get_date_range()
+
+        data = trend_cache.get_or_compute(request.user.pk, granularity, start, end, window,
+                                          lambda: self.get_trends(granularity, start, end, window))
+        return Response(data)
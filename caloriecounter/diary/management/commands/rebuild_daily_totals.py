@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from caloriecounter.diary.totals import rebuild_daily_totals
+from caloriecounter.user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily nutrient totals from the diary entries, ' \
+           'i.e. after entries were changed in bulk, or after the nutrients of products were corrected.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only rebuild the totals of this user. Can be repeated.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='The number of entries that are processed at once.')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['users']:
+            users = list(User.objects.filter(username__in=options['users']))
+            missing = set(options['users']) - {user.username for user in users}
+            if missing:
+                raise CommandError('Unknown user(s): {0}'.format(', '.join(sorted(missing))))
+
+        count = rebuild_daily_totals(users, chunk_size=options['chunk_size'])
+
+        self.stdout.write(self.style.SUCCESS('Rebuilt the daily totals of {0} diary entries.'.format(count)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from caloriecounter.diary.totals import update_pending_quantities, update_pending_totals
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the quantities in default unit of the diary entries, and the daily nutrient totals, ' \
+           'after the conversions or nutrients of their products or units changed. ' \
+           'Run it periodically, i.e. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='The number of entries that are processed at once.')
+
+    def handle(self, *args, **options):
+        count = update_pending_quantities(chunk_size=options['chunk_size'])
+        days = update_pending_totals()
+
+        self.stdout.write(self.style.SUCCESS('Updated the quantities of {0} diary entries, and the totals of {1} days.'
+                                             .format(count, days)))
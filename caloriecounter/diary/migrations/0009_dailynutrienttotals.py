@@ -0,0 +1,33 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0028_catalog_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('diary', '0008_auto_20200608_2204'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyNutrientTotals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('quantity', models.FloatField(default=0, verbose_name='quantity')),
+                ('nutrient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='food.Nutrient', verbose_name='nutrient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'daily nutrient totals',
+                'verbose_name_plural': 'daily nutrient totals',
+                'ordering': ['date', '-nutrient__rank'],
+                'unique_together': {('user', 'date', 'nutrient')},
+            },
+        ),
+    ]
@@ -0,0 +1,141 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+def get_unit_conversions(Unit):
+    """
+    Return every unit, and the (numerator, denominator) conversion between every pair of units
+    that share a base unit, like the UnitGraph of the food app at the time of this migration.
+    """
+    units = {row['id']: row for row in Unit.objects.order_by()
+             .values('id', 'name', 'is_base', 'is_constant', 'parent_id', 'base_unit_multiplier')}
+
+    base_units = {}
+    to_base = {}
+    for unit_id, unit in units.items():
+        multiplier = 1
+        visited = {unit_id}
+        current = unit
+        while not current['is_base'] and current['parent_id'] in units and current['parent_id'] not in visited:
+            multiplier = multiplier * current['base_unit_multiplier']
+            visited.add(current['parent_id'])
+            current = units[current['parent_id']]
+
+        base_units[unit_id] = current['id']
+        to_base[unit_id] = multiplier
+
+    families = {}
+    for unit_id, base_unit_id in base_units.items():
+        families.setdefault(base_unit_id, []).append(unit_id)
+
+    conversions = {}
+    for members in families.values():
+        for from_unit_id in members:
+            for to_unit_id in members:
+                conversions[(from_unit_id, to_unit_id)] = (1, 1) if from_unit_id == to_unit_id \
+                    else (to_base[from_unit_id], to_base[to_unit_id])
+
+    return units, base_units, families, conversions
+
+
+def compile_conversions(product, product_units, units, base_units, families, conversions):
+    """
+    Return the (numerator, denominator, multiplier) conversion of every unit of a product to its default unit,
+    with the rules of the ProductConversionTable of the food app at the time of this migration.
+    """
+    default_unit_id = product.default_unit_id
+    table = {}
+
+    def add_family(base_unit_id, get_conversion):
+        for unit_id in families.get(base_units.get(base_unit_id), ()):
+            if unit_id not in table and base_units[unit_id] == base_unit_id:
+                table[unit_id] = get_conversion(unit_id)
+
+    # 1. Explicitly defined units
+    for product_unit in product_units:
+        if product_unit.unit_id is not None and product_unit.unit_id not in table:
+            table[product_unit.unit_id] = (product_unit.multiplier, 1, 1)
+
+    # 2. The default unit, and its children
+    if default_unit_id in units:
+        add_family(default_unit_id, lambda unit_id: conversions[(unit_id, default_unit_id)] + (1,))
+
+    # 3. Volumes, for products with a known number of grams per ml
+    if product.grams_per_ml != 0 and default_unit_id in units and units[default_unit_id]['name'] == 'gram':
+        for milliliter_id in [unit_id for unit_id, unit in units.items() if unit['name'] == 'milliliter']:
+            add_family(milliliter_id,
+                       lambda unit_id: (conversions[(unit_id, milliliter_id)][0], 1, product.grams_per_ml))
+
+    # 4. Units that share their base unit with a constant, explicitly defined unit
+    shared_base_units = {}
+    for product_unit in product_units:
+        unit = units.get(product_unit.unit_id)
+        if unit is None or not unit['is_constant']:
+            continue
+
+        for base_unit_id in (unit['parent_id'], unit['id']):
+            if base_unit_id in units:
+                shared_base_units.setdefault(base_unit_id, product_unit)
+
+    for base_unit_id, product_unit in shared_base_units.items():
+        divisor = units[product_unit.unit_id]['base_unit_multiplier']
+        add_family(base_unit_id,
+                   lambda unit_id: (units[unit_id]['base_unit_multiplier'], divisor, product_unit.multiplier))
+
+    return table
+
+
+def backfill_quantity_in_default_unit(apps, schema_editor):
+    """
+    Store the quantity in default unit of all existing entries, converted like
+    DiaryEntry.compute_quantity_in_default_unit, from the historical models.
+    """
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+    FoodProductUnit = apps.get_model('food', 'FoodProductUnit')
+    Unit = apps.get_model('food', 'Unit')
+
+    unit_conversions = get_unit_conversions(Unit)
+    portion_units = dict(FoodProductUnit.objects.values_list('pk', 'unit_id'))
+    tables = {}
+
+    entries = DiaryEntry.objects.select_related('product').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(entries.filter(pk__gt=last_pk)[:2000])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+
+        missing = {entry.product_id: entry.product for entry in chunk if entry.product_id not in tables}
+        product_units = {product_id: [] for product_id in missing}
+        for product_unit in FoodProductUnit.objects.filter(product_id__in=list(missing)).order_by('pk'):
+            product_units[product_unit.product_id].append(product_unit)
+        for product_id, product in missing.items():
+            tables[product_id] = compile_conversions(product, product_units[product_id], *unit_conversions)
+
+        for entry in chunk:
+            unit_id = portion_units.get(entry.portion_id) if entry.portion_id else entry.unit_id
+            if unit_id is None:
+                entry.quantity_in_default_unit = entry.quantity * entry.product.default_quantity
+            elif unit_id in tables[entry.product_id]:
+                numerator, denominator, multiplier = tables[entry.product_id][unit_id]
+                entry.quantity_in_default_unit = entry.quantity * numerator / denominator * multiplier
+
+        DiaryEntry.objects.bulk_update(chunk, ['quantity_in_default_unit'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0009_dailynutrienttotals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diaryentry',
+            name='quantity_in_default_unit',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='quantity in default unit'),
+        ),
+        migrations.RunPython(backfill_quantity_in_default_unit, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0010_diaryentry_quantity_in_default_unit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diaryentry',
+            index=models.Index(fields=['user', '-date', 'time', 'id'], name='diary_diary_user_id_a32091_idx'),
+        ),
+    ]
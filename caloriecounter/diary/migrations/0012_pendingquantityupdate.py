@@ -0,0 +1,27 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0011_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingQuantityUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.IntegerField(blank=True, null=True, verbose_name='product')),
+                ('unit_id', models.IntegerField(blank=True, null=True, verbose_name='unit')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+            ],
+            options={
+                'verbose_name': 'pending quantity update',
+                'verbose_name_plural': 'pending quantity updates',
+                'ordering': ['created_on'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('diary', '0012_pendingquantityupdate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyTotalsVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='month')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='version')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'monthly totals version',
+                'verbose_name_plural': 'monthly totals versions',
+                'unique_together': {('user', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:58
+
+from itertools import islice
+
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def backfill_daily_totals(apps, schema_editor):
+    """
+    Sum the DailyNutrientTotals of all existing entries, like DiaryEntryQuerySet.with_nutrient_totals,
+    from the historical models. The stored quantities in default unit were backfilled by 0010.
+    """
+    DailyNutrientTotals = apps.get_model('diary', 'DailyNutrientTotals')
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+
+    DailyNutrientTotals.objects.all().delete()
+
+    rows = DiaryEntry.objects.filter(quantity_in_default_unit__isnull=False,
+                                     product__foodproductnutrient__isnull=False) \
+        .order_by() \
+        .values('user', 'date', nutrient=F('product__foodproductnutrient__nutrient')) \
+        .annotate(total=Sum(F('quantity_in_default_unit') * F('product__foodproductnutrient__quantity') / 100)) \
+        .iterator()
+    while True:
+        chunk = [DailyNutrientTotals(user_id=row['user'], date=row['date'], nutrient_id=row['nutrient'],
+                                     quantity=row['total']) for row in islice(rows, 2000)]
+        if not chunk:
+            break
+
+        DailyNutrientTotals.objects.bulk_create(chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0013_monthlytotalsversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_totals, migrations.RunPython.noop),
+    ]
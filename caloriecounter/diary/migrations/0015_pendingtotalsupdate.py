@@ -0,0 +1,26 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0014_backfill_dailynutrienttotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTotalsUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.IntegerField(verbose_name='product')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+            ],
+            options={
+                'verbose_name': 'pending totals update',
+                'verbose_name_plural': 'pending totals updates',
+                'ordering': ['created_on'],
+            },
+        ),
+    ]
@@ -2,14 +2,39 @@ from datetime import datetime
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
-from caloriecounter.food.models import FoodProduct, Unit, FoodProductNutrient, Nutrient, FoodProductUnit
+from caloriecounter.diary.nutrition import compute_nutrition
+from caloriecounter.diary.totals import TOTALS_FIELDS, update_daily_totals
+from caloriecounter.food.catalog_import import rows_imported
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.models import FoodProduct, Unit, FoodProductNutrient, Nutrient, FoodProductUnit, unit_graph
+from caloriecounter.food.request_cache import request_cache
 from caloriecounter.user.models import User
 
 
-class DiaryEntryManager(models.Manager):
+class DiaryEntryQuerySet(models.QuerySet):
+    def with_nutrient_totals(self, *fields):
+        """
+        Return the total quantity of each nutrient in these entries, optionally grouped by fields (i.e. 'date'),
+        as {field: value, 'nutrient': nutrient id, 'total': quantity} rows.
+
+        The totals are summed from the stored quantity_in_default_unit in a single SQL aggregate,
+        without loading any entry. Entries that can not be converted do not count towards the totals.
+        """
+        return self.filter(quantity_in_default_unit__isnull=False,
+                           product__foodproductnutrient__isnull=False) \
+            .select_related(None).prefetch_related(None).order_by() \
+            .values(*fields, nutrient=F('product__foodproductnutrient__nutrient')) \
+            .annotate(total=Sum(F('quantity_in_default_unit') * F('product__foodproductnutrient__quantity') / 100))
+
+
+class DiaryEntryManager(models.Manager.from_queryset(DiaryEntryQuerySet)):
     """
     Since we're often performing calculations on DiaryEntries (Nutritional information, etc.),
     this manager adds a prefetch for products, nutrients and units, to reduce overhead.
@@ -18,26 +43,20 @@ class DiaryEntryManager(models.Manager):
         return super().get_queryset()\
             .select_related('product',
                             'unit',
+                            'portion',
                             'product__default_unit')\
             .prefetch_related('product__foodproductnutrient_set',
                               'product__foodproductnutrient_set__nutrient')
 
 
-class NutritionalInformation:
-    quantity: float
-    nutrient: Nutrient
-
-    def __init__(self, quantity: float, nutrient: Nutrient):
-        self.quantity = quantity
-        self.nutrient = nutrient
-
-    def __str__(self):
-        return '{0} {1}'.format(self.quantity, self.nutrient)
-
-
+# DiaryEntries are not validated on save (see validation.py), since they are validated by their serializer.
 class DiaryEntry(models.Model):
     class Meta:
         ordering = ['-date', 'time']
+        indexes = [
+            # Covers the keyset pagination of a user's entries, see DiaryEntryPagination.
+            models.Index(fields=['user', '-date', 'time', 'id']),
+        ]
         verbose_name = _('diary entry')
         verbose_name_plural = ('diary entries')
 
@@ -58,38 +77,20 @@ class DiaryEntry(models.Model):
     unit = models.ForeignKey(verbose_name=_('unit'), to=Unit, on_delete=models.SET_NULL, null=True, blank=True)
     portion = models.ForeignKey(verbose_name=_('portion'), to=FoodProductUnit, on_delete=models.SET_NULL, null=True, blank=True)
 
-    # Return a list of tuples containing the unit, and the quantity of each Nutrient for this diary entry.
+    # The quantity in the default unit of the product, stored on save (see compute_quantity_in_default_unit),
+    # so nutrients can be summed in SQL. None when the unit can not be converted.
+    quantity_in_default_unit = models.FloatField(verbose_name=_('quantity in default unit'),
+                                                 null=True, blank=True, editable=False)
+
+    # Return a list of NutritionalInformation containing the quantity of each Nutrient for this diary entry.
+    # When listing entries, the information is computed for all entries at once (see nutrition.py),
+    # and stored on each entry.
     @property
     def nutritional_information(self):
-        try:
-            self.product
-        except FoodProduct.DoesNotExist:
-            return []
-
-        quantity = self.quantity
-
-        if self.portion:
-            unit = self.portion.unit
-        else:
-            unit = self.unit
-
-        list_of_nutrients = []
-        if unit:
-            try:
-                quantity = self.product.get_quantity_in_default_unit(self.quantity, unit)
-            except ValueError:
-                quantity = 0
-        else:
-            quantity = self.quantity * self.product.default_quantity
+        if hasattr(self, '_nutritional_information'):
+            return self._nutritional_information
 
-        for product_nutrient in self.product.foodproductnutrient_set.all():
-            if quantity == 0:
-                list_of_nutrients.append(NutritionalInformation(None, product_nutrient.nutrient))
-            else:
-                list_of_nutrients.append(NutritionalInformation(quantity * (product_nutrient.quantity / 100),
-                                                                product_nutrient.nutrient))
-
-        return list_of_nutrients
+        return compute_nutrition([self]).for_entry(0)
 
     def clean(self):
         if self.portion and self.unit:
@@ -100,12 +101,19 @@ class DiaryEntry(models.Model):
 
     def clean_fields(self, exclude=None):
         super().clean_fields(exclude)
+        self.clean_relations(exclude)
 
+    # Validates the fields of this entry against its product (see also validation.validate_many).
+    def clean_relations(self, exclude=None):
         if exclude is None:
             exclude = []
 
         errors = {}
 
+        # The related objects are resolved once per request, see request_cache.py.
+        for field_name in ('product', 'unit', 'portion'):
+            request_cache.get_related(self, field_name)
+
         # Check if the DiaryEntry's unit is valid for this product.
         if 'unit' not in exclude:
             try:
@@ -126,12 +134,89 @@ class DiaryEntry(models.Model):
                         unit = self.product.default_unit),
                     code='can_not_convert_quantity_of_product_to_unit')
 
-        if self.portion and self.portion.product != self.product:
+        if self.portion and self.portion.product_id != self.product_id:
             errors['portion'] = ValidationError(_('Unknown portion for product .'.format(self.product)))
 
         if errors:
             raise ValidationError(errors)
 
+    # Compiles the conversion tables of all products at once, before validating a batch of entries.
+    @classmethod
+    def prepare_validation(cls, instances):
+        conversion_tables.get_many([instance.product for instance in instances if instance.product_id])
+
+    # Keeps the fields that determine the DailyNutrientTotals of entries loaded from the database,
+    # so entries that did not change can use their stored quantity_in_default_unit (see is_unchanged).
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.store_saved_state()
+        return instance
+
+    def store_saved_state(self):
+        deferred = self.get_deferred_fields()
+        if any(name in deferred for name in TOTALS_FIELDS):
+            self.__dict__.pop('_saved_state', None)
+        else:
+            self._saved_state = {name: getattr(self, name) for name in TOTALS_FIELDS}
+
+    # Whether this entry has not been changed since it was loaded or saved,
+    # in which case its stored quantity_in_default_unit is up to date.
+    def is_unchanged(self):
+        state = getattr(self, '_saved_state', None)
+        return state is not None and all(getattr(self, name) == value for name, value in state.items())
+
+    # Converts the quantity to the default unit of the product, the same way compute_nutrition does.
+    def compute_quantity_in_default_unit(self):
+        product = request_cache.get_related(self, 'product')
+        if product is None:
+            return None
+
+        portion = request_cache.get_related(self, 'portion')
+        unit_id = portion.unit_id if portion else self.unit_id
+        if unit_id is None:
+            return self.quantity * product.default_quantity
+
+        table = conversion_tables.get(product)
+        if unit_id not in table:
+            return None
+
+        return table.conversion(unit_id).apply(self.quantity)
+
+    # Returns an (unsaved) copy of this entry as it is stored in the database, see get_saved_entries.
+    def get_saved_entry(self):
+        return DiaryEntry.get_saved_entries([self])[0]
+
+    # Returns (unsaved) copies of entries as they are stored in the database, or None for entries that are new
+    # or were deleted meanwhile. Must be called within a transaction: the rows are locked until it ends,
+    # so concurrent updates and deletes of an entry each subtract what is stored at that moment from the totals.
+    @classmethod
+    def get_saved_entries(cls, entries):
+        entries = list(entries)
+        pks = [entry.pk for entry in entries if not entry._state.adding and entry.pk is not None]
+
+        # The rows are locked in order of their pk, so concurrent transactions do not deadlock.
+        states = {}
+        if pks:
+            for values in DiaryEntry.objects.select_for_update(of=('self',)).filter(pk__in=pks).order_by('pk') \
+                    .values('pk', *TOTALS_FIELDS):
+                states[values.pop('pk')] = values
+
+        return [entry.copy_saved_state(states[entry.pk]) if entry.pk in states and not entry._state.adding else None
+                for entry in entries]
+
+    def copy_saved_state(self, state):
+        entry = DiaryEntry(pk=self.pk, **state)
+        entry._saved_state = dict(state)
+
+        # Relations that did not change are shared with this entry.
+        for name in ('product', 'unit', 'portion'):
+            field = self._meta.get_field(name)
+            if state[field.attname] == getattr(self, field.attname) and field.is_cached(self):
+                field.set_cached_value(entry, field.get_cached_value(self))
+
+        return entry
+
     def save(self, *args, **kwargs):
         if not self.unit:
             if self.product.default_quantity == 0:
@@ -142,7 +227,19 @@ class DiaryEntry(models.Model):
                                               unit = self.product.default_unit),
                                     code='can_not_convert_quantity_of_product_to_unit')
 
-        super().save(*args, **kwargs)
+        self.__dict__.pop('_nutritional_information', None)
+
+        self.quantity_in_default_unit = self.compute_quantity_in_default_unit()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'quantity_in_default_unit'}
+
+        # The daily totals are updated in the same transaction as the entry.
+        with transaction.atomic():
+            saved_entry = self.get_saved_entry()
+            super().save(*args, **kwargs)
+            update_daily_totals(removed=[saved_entry], added=[self])
+
+        self.store_saved_state()
 
     def __str__(self):
         if self.unit:
@@ -155,3 +252,262 @@ class DiaryEntry(models.Model):
                              product=self.product,
                              time=self.time,
                              date=self.date)
+
+
+class DailyNutrientTotals(models.Model):
+    """
+    The total quantity of a nutrient in all diary entries of a user on a day.
+
+    The totals are updated incrementally, in the same transaction, whenever a DiaryEntry is saved or deleted.
+    Changes that bypass DiaryEntry.save (i.e. queryset updates) are not reflected until the totals are rebuilt
+    with the rebuild_daily_totals command. Changes to the conversions or the nutrients of products are reflected
+    once the update_entry_quantities command has run.
+    """
+    class Meta:
+        unique_together = [['user', 'date', 'nutrient']]
+        ordering = ['date', '-nutrient__rank']
+        verbose_name = _('daily nutrient totals')
+        verbose_name_plural = _('daily nutrient totals')
+
+    user = models.ForeignKey(to=User, verbose_name=_('user'), on_delete=models.CASCADE)
+    date = models.DateField(_('date'))
+    nutrient = models.ForeignKey(to=Nutrient, verbose_name=_('nutrient'), on_delete=models.CASCADE)
+    quantity = models.FloatField(verbose_name=_('quantity'), default=0)
+
+    def __str__(self):
+        return '{0}: {1} {2}'.format(self.date, self.quantity, self.nutrient)
+
+
+class MonthlyTotalsVersion(models.Model):
+    """
+    A counter per user and month, that is incremented in the same transaction as the DailyNutrientTotals
+    of that user within that month change, so rolled up trends can be keyed on it (see trends.TrendCache).
+    """
+    class Meta:
+        unique_together = [['user', 'month']]
+        verbose_name = _('monthly totals version')
+        verbose_name_plural = _('monthly totals versions')
+
+    user = models.ForeignKey(to=User, verbose_name=_('user'), on_delete=models.CASCADE)
+    month = models.DateField(_('month'))
+    version = models.PositiveIntegerField(verbose_name=_('version'), default=0)
+
+    def __str__(self):
+        return '{0:%Y-%m} ({1})'.format(self.month, self.version)
+
+
+class PendingQuantityUpdate(models.Model):
+    """
+    A change to the conversions of a product or a unit, after which the stored quantity_in_default_unit
+    of the diary entries that use it (and so the daily totals) still have to be recomputed.
+
+    Changes are recorded on save, and applied by the update_entry_quantities command
+    (see totals.update_pending_quantities), so they do not slow down the request that made them.
+    The products and units are not referenced by foreign key, since they may have been deleted meanwhile.
+    """
+    class Meta:
+        ordering = ['created_on']
+        verbose_name = _('pending quantity update')
+        verbose_name_plural = _('pending quantity updates')
+
+    product_id = models.IntegerField(_('product'), null=True, blank=True)
+    unit_id = models.IntegerField(_('unit'), null=True, blank=True)
+
+    created_on = models.DateTimeField(verbose_name=_('created on'), auto_now_add=True)
+
+    def __str__(self):
+        return 'product {0}'.format(self.product_id) if self.product_id else 'unit {0}'.format(self.unit_id)
+
+
+class PendingTotalsUpdate(models.Model):
+    """
+    A change to the nutrients of a product, after which the daily totals of the days with entries of that product
+    still have to be recomputed.
+
+    Like PendingQuantityUpdate, changes are recorded on save and applied by the update_entry_quantities command
+    (see totals.update_pending_totals).
+    """
+    class Meta:
+        ordering = ['created_on']
+        verbose_name = _('pending totals update')
+        verbose_name_plural = _('pending totals updates')
+
+    product_id = models.IntegerField(_('product'))
+
+    created_on = models.DateTimeField(verbose_name=_('created on'), auto_now_add=True)
+
+    def __str__(self):
+        return 'product {0}'.format(self.product_id)
+
+
+def delete_entries(entries):
+    """
+    Delete a list of entries, without updating the daily totals entry by entry,
+    since the caller updates them for all entries at once.
+    """
+    for entry in entries:
+        entry._skip_daily_totals = True
+
+    collector = Collector(using=router.db_for_write(DiaryEntry))
+    collector.collect(entries)
+    collector.delete()
+
+
+# Deleted entries are subtracted from the daily totals before they are deleted (while their products still exist),
+# within the transaction of the deletion.
+@receiver(pre_delete, sender=DiaryEntry)
+def diary_entry_pre_delete(sender, instance, **kwargs):
+    if getattr(instance, '_skip_daily_totals', False):
+        return
+
+    update_daily_totals(removed=[instance.get_saved_entry()])
+
+
+# The stored quantities in default unit of entries are recomputed when the conversions of their product change.
+# This is deferred to the update_entry_quantities command (see PendingQuantityUpdate), so a change in the admin
+# does not rescan the diary entries within its request.
+# Models keep the fields their conversions depend on, so other changes do not recompute anything.
+PRODUCT_CONVERSION_FIELDS = ('default_unit_id', 'grams_per_ml', 'default_quantity')
+PRODUCT_UNIT_CONVERSION_FIELDS = ('product_id', 'unit_id', 'multiplier')
+# The name and is_constant determine which units convert by volume, or through a product unit, see conversions.py.
+UNIT_CONVERSION_FIELDS = ('parent_id', 'base_unit_multiplier', 'is_base', 'is_constant', 'name')
+# The daily totals of the entries of a product are recomputed when its nutrients change, see PendingTotalsUpdate.
+PRODUCT_NUTRIENT_FIELDS = ('product_id', 'nutrient_id', 'quantity')
+
+
+def store_conversion_fields(instance, fields):
+    instance._previous_conversion_fields = type(instance).objects.filter(pk=instance.pk) \
+        .values_list(*fields).first()
+
+
+def conversion_fields_changed(instance, fields):
+    previous = instance.__dict__.pop('_previous_conversion_fields', None)
+    return previous != tuple(getattr(instance, name) for name in fields)
+
+
+@receiver(pre_save, sender=FoodProduct)
+def store_product_conversion_fields(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+
+    store_conversion_fields(instance, PRODUCT_CONVERSION_FIELDS)
+
+
+@receiver(post_save, sender=FoodProduct)
+def update_product_entry_quantities(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+
+    if conversion_fields_changed(instance, PRODUCT_CONVERSION_FIELDS):
+        PendingQuantityUpdate.objects.create(product_id=instance.pk)
+
+
+@receiver(pre_save, sender=FoodProductUnit)
+def store_product_unit_conversion_fields(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+
+    store_conversion_fields(instance, PRODUCT_UNIT_CONVERSION_FIELDS)
+
+
+@receiver(post_save, sender=FoodProductUnit)
+def update_product_unit_entry_quantities(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = instance.__dict__.get('_previous_conversion_fields')
+    if created or conversion_fields_changed(instance, PRODUCT_UNIT_CONVERSION_FIELDS):
+        # A product unit that moved to another product changes the conversions of both products.
+        product_ids = {instance.product_id, previous[0] if previous else None} - {None}
+        PendingQuantityUpdate.objects.bulk_create([PendingQuantityUpdate(product_id=product_id)
+                                                   for product_id in sorted(product_ids)])
+
+
+@receiver(post_delete, sender=FoodProductUnit)
+def update_deleted_product_unit_entry_quantities(sender, instance, **kwargs):
+    PendingQuantityUpdate.objects.create(product_id=instance.product_id)
+
+
+@receiver(pre_save, sender=FoodProductNutrient)
+def store_product_nutrient_fields(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+
+    store_conversion_fields(instance, PRODUCT_NUTRIENT_FIELDS)
+
+
+@receiver(post_save, sender=FoodProductNutrient)
+def update_product_nutrient_totals(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = instance.__dict__.get('_previous_conversion_fields')
+    if created or conversion_fields_changed(instance, PRODUCT_NUTRIENT_FIELDS):
+        # A nutrient that moved to another product changes the totals of both products.
+        product_ids = {instance.product_id, previous[0] if previous else None} - {None}
+        PendingTotalsUpdate.objects.bulk_create([PendingTotalsUpdate(product_id=product_id)
+                                                 for product_id in sorted(product_ids)])
+
+
+@receiver(post_delete, sender=FoodProductNutrient)
+def update_deleted_product_nutrient_totals(sender, instance, **kwargs):
+    PendingTotalsUpdate.objects.create(product_id=instance.product_id)
+
+
+# A catalog import writes its rows without sending post_save, so the changes are queued from rows_imported instead.
+# Only products with entries are queued, so an initial import does not queue the whole catalog.
+@receiver(rows_imported)
+def update_imported_entry_quantities(sender, instances, updated, **kwargs):
+    if sender is Unit:
+        PendingQuantityUpdate.objects.bulk_create([PendingQuantityUpdate(unit_id=unit_id)
+                                                   for unit_id in sorted(updated)])
+        return
+
+    if sender is FoodProduct:
+        product_ids = updated
+    elif sender in (FoodProductUnit, FoodProductNutrient):
+        product_ids = {instance.product_id for instance in instances}
+    else:
+        return
+
+    product_ids = DiaryEntry.objects.filter(product_id__in=product_ids).order_by('product_id') \
+        .values_list('product_id', flat=True).distinct()
+    if sender is FoodProductNutrient:
+        PendingTotalsUpdate.objects.bulk_create([PendingTotalsUpdate(product_id=product_id)
+                                                 for product_id in product_ids])
+    else:
+        PendingQuantityUpdate.objects.bulk_create([PendingQuantityUpdate(product_id=product_id)
+                                                   for product_id in product_ids])
+
+
+# Changing a unit changes the conversions of the unit and all its (transitive) children, and of the other units
+# with the same base unit, so the entries in any unit of its family are updated.
+def get_unit_entries(unit_ids):
+    unit_ids = set(unit_ids).union(*(unit_graph.family(unit_id) for unit_id in unit_ids))
+    return DiaryEntry.objects.filter(Q(unit_id__in=unit_ids) | Q(portion__unit_id__in=unit_ids))
+
+
+@receiver(pre_save, sender=Unit)
+def store_unit_conversion_fields(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+
+    store_conversion_fields(instance, UNIT_CONVERSION_FIELDS)
+
+
+@receiver(post_save, sender=Unit)
+def update_unit_entry_quantities(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+
+    if conversion_fields_changed(instance, UNIT_CONVERSION_FIELDS):
+        PendingQuantityUpdate.objects.create(unit_id=instance.pk)
+
+
+# The units of entries are set to null when their unit is deleted, so their products are looked up beforehand.
+@receiver(pre_delete, sender=Unit)
+def update_deleted_unit_entry_quantities(sender, instance, **kwargs):
+    product_ids = get_unit_entries([instance.pk]).order_by('product_id').values_list('product_id', flat=True) \
+        .distinct()
+    PendingQuantityUpdate.objects.bulk_create([PendingQuantityUpdate(product_id=product_id)
+                                               for product_id in product_ids])
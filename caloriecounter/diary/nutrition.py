@@ -0,0 +1,190 @@
+import numpy as np
+from django.db.models import prefetch_related_objects
+
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.models import FoodProduct, Nutrient
+from caloriecounter.food.request_cache import request_cache
+
+
+class NutritionalInformation:
+    quantity: float
+    nutrient: Nutrient
+
+    def __init__(self, quantity: float, nutrient: Nutrient):
+        self.quantity = quantity
+        self.nutrient = nutrient
+
+    # NutritionalInformation can also be used as a (quantity, nutrient) tuple.
+    def __iter__(self):
+        return iter((self.quantity, self.nutrient))
+
+    def __getitem__(self, index):
+        return (self.quantity, self.nutrient)[index]
+
+    def __str__(self):
+        return '{0} {1}'.format(self.quantity, self.nutrient)
+
+
+class NutritionTotals:
+    """
+    The nutrients of a list of diary entries, as computed by compute_nutrition.
+
+    nutrients:  The nutrients (columns) in the result.
+    quantities: The quantity in default units of each entry, 0 for an entry that can not be converted.
+    per_entry:  An (entries x nutrients) matrix with the quantity of each nutrient for each entry.
+    totals:     The summed quantity of each nutrient over all entries.
+    """
+
+    def __init__(self, entries, nutrients, product_nutrients, quantities, per_entry, totals):
+        self.entries = entries
+        self.nutrients = nutrients
+        self.product_nutrients = product_nutrients
+        self.quantities = quantities
+        self.per_entry = per_entry
+        self.totals = totals
+
+    def for_entry(self, index):
+        """
+        Return the nutritional information for a single entry, in the order of its product's nutrients.
+        """
+        columns = self.product_nutrients[index]
+        if columns is None:
+            return []
+
+        if self.quantities[index] == 0:
+            return [NutritionalInformation(None, self.nutrients[column]) for column in columns]
+
+        row = self.per_entry[index]
+        return [NutritionalInformation(float(row[column]), self.nutrients[column]) for column in columns]
+
+    def summary(self):
+        """
+        Return the total nutritional information of all entries.
+        """
+        return [NutritionalInformation(float(quantity), nutrient)
+                for quantity, nutrient in zip(self.totals, self.nutrients)]
+
+
+def get_product(entry):
+    try:
+        return entry.product
+    except FoodProduct.DoesNotExist:
+        return None
+
+
+def get_stored_quantity(entry):
+    if getattr(entry, 'quantity_in_default_unit', None) is None or not entry.is_unchanged():
+        return None
+
+    return entry.quantity_in_default_unit
+
+
+def compute_nutrition(entries) -> NutritionTotals:
+    """
+    Compute the nutrients of a list of diary entries as array operations.
+
+    The per 100 (default unit) quantities of the nutrients of all products are gathered into
+    a (products x nutrients) matrix, and the quantities of all entries are converted into a vector in one step.
+    The nutrients of each entry are the row of its product, gathered from the matrix by index and scaled
+    elementwise by the entry's quantity, and the totals are the sum of those rows.
+    """
+    entries = list(entries)
+
+    products = {}
+    for entry in entries:
+        product = get_product(entry)
+        if product is not None:
+            products.setdefault(product.pk, product)
+
+    # Products that were not loaded with their nutrients (i.e. a newly created entry) get them in two queries.
+    missing = [product for product in products.values()
+               if 'foodproductnutrient_set' not in getattr(product, '_prefetched_objects_cache', {})]
+    if missing:
+        prefetch_related_objects(missing, 'foodproductnutrient_set__nutrient')
+
+    # Conversion tables are only needed for entries without a stored quantity in default unit.
+    converted_products = {}
+    for entry in entries:
+        product = get_product(entry)
+        if product is not None and get_stored_quantity(entry) is None:
+            converted_products.setdefault(product.pk, product)
+
+    tables = conversion_tables.get_many(list(converted_products.values()))
+
+    # Gather the nutrients of all products into a matrix.
+    product_index = {product_id: index for index, product_id in enumerate(products.keys())}
+    nutrient_index = {}
+    nutrients = []
+    product_columns = []
+    values = []
+
+    for product in products.values():
+        columns = []
+        for product_nutrient in product.foodproductnutrient_set.all():
+            if product_nutrient.nutrient_id not in nutrient_index:
+                nutrient_index[product_nutrient.nutrient_id] = len(nutrients)
+                nutrients.append(product_nutrient.nutrient)
+
+            columns.append(nutrient_index[product_nutrient.nutrient_id])
+            values.append((product_index[product.pk], columns[-1], product_nutrient.quantity))
+        product_columns.append(columns)
+
+    nutrient_matrix = np.zeros((len(products), len(nutrients)))
+    for row, column, quantity in values:
+        nutrient_matrix[row, column] = quantity / 100
+
+    # Convert the quantities of all entries to the default unit of their product.
+    count = len(entries)
+    quantity = np.zeros(count)
+    numerator = np.ones(count)
+    denominator = np.ones(count)
+    multiplier = np.zeros(count)
+    rows = np.zeros(count, dtype=int)
+    entry_columns = []
+
+    for index, entry in enumerate(entries):
+        product = get_product(entry)
+        if product is None:
+            entry_columns.append(None)
+            continue
+
+        rows[index] = product_index[product.pk]
+        entry_columns.append(product_columns[rows[index]])
+        quantity[index] = entry.quantity
+
+        # Entries that did not change since they were saved have their quantity in default unit stored.
+        stored_quantity = get_stored_quantity(entry)
+        if stored_quantity is not None:
+            quantity[index] = stored_quantity
+            multiplier[index] = 1
+            continue
+
+        unit_id = request_cache.get_related(entry, 'portion').unit_id if entry.portion_id else entry.unit_id
+        if unit_id is None:
+            multiplier[index] = product.default_quantity
+        elif unit_id in tables[product.pk]:
+            numerator[index], denominator[index], multiplier[index] = tables[product.pk].conversion(unit_id)
+
+    quantities = quantity * numerator / denominator * multiplier
+
+    # The nutrients of every entry are the row of its product, scaled by its quantity.
+    per_entry = np.zeros((count, nutrient_matrix.shape[1]))
+    with_product = np.array([columns is not None for columns in entry_columns], dtype=bool)
+    per_entry[with_product] = nutrient_matrix[rows[with_product]] * quantities[with_product, None]
+    totals = per_entry.sum(axis=0)
+
+    return NutritionTotals(entries, nutrients, entry_columns, quantities, per_entry, totals)
+
+
+def attach_nutritional_information(entries):
+    """
+    Compute the nutritional information of a list of diary entries at once,
+    and store it on each entry, to be returned by DiaryEntry.nutritional_information.
+    """
+    entries = list(entries)
+    result = compute_nutrition(entries)
+
+    for index, entry in enumerate(entries):
+        entry._nutritional_information = result.for_entry(index)
+
+    return result
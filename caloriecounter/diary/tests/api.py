@@ -1,7 +1,19 @@
-from rest_framework.reverse import reverse
-from rest_framework.test import APIClient
+import datetime
+from unittest import mock
 
-from caloriecounter.diary.models import DiaryEntry
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+
+from caloriecounter.diary.api.serializers import DiaryEntrySerializer
+from caloriecounter.diary.api.views import DiaryEntryPagination
+from caloriecounter.diary.models import DiaryEntry, DailyNutrientTotals
+from caloriecounter.diary.nutrition import attach_nutritional_information
+from caloriecounter.diary.totals import rebuild_daily_totals
+from caloriecounter.diary.trends import trend_cache
 from caloriecounter.diary.tests import DiaryEntryBaseTest
 
 
@@ -106,12 +118,76 @@ class DiaryEntryViewSetTestCase(DiaryEntryBaseTest):
         response = self.user_client.get(url)
 
         # Assert 1.
-        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
 
         # Assert 2.
         self.assertEqual(response.data['results'][0]['pk'], self.diary_entry.pk)
         self.assertEqual(response.data['results'][1]['pk'], self.diary_entry_2.pk)
 
+    def test_diary_entry_list_pagination(self):
+        """
+        Assert:
+        1. Entries are paginated by date (newest first), time and pk, including entries at the same moment.
+        2. The previous cursor of the last page returns to the page before.
+        """
+        for _ in range(3):
+            DiaryEntry.objects.create(user=self.user, product=self.product, date=datetime.date(2018, 3, 3),
+                                      time=datetime.time(hour=8), quantity=1, unit=self.g)
+        expected = list(DiaryEntry.objects.filter(user=self.user).order_by('-date', 'time', 'pk')
+                        .values_list('pk', flat=True))
+
+        # Assert 1.
+        pages = []
+        next_url = reverse("diary_entry-list")
+        with mock.patch.object(DiaryEntryPagination, 'page_size', 2):
+            while next_url:
+                response = self.user_client.get(next_url)
+                pages.append([result['pk'] for result in response.data['results']])
+                next_url = response.data['next']
+
+            self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:]])
+
+            # Assert 2.
+            response = self.user_client.get(response.data['previous'])
+            self.assertEqual([result['pk'] for result in response.data['results']], expected[2:4])
+
+    def test_diary_entry_list_fields(self):
+        """
+        Assert:
+        1. ?fields= and ?compact= return only the selected fields, with nutrients as a map of nutrient ids to quantities.
+        2. ?expand= returns the products of the DiaryEntries in full.
+        """
+        url = reverse("diary_entry-list")
+
+        # Assert 1.
+        response = self.user_client.get(url, {'fields': 'pk,nutritional_information', 'compact': 'true'})
+        result = response.data['results'][0]
+        self.assertEqual(set(result.keys()), {'pk', 'nutritional_information'})
+        self.assertEqual(result['nutritional_information'],
+                         {str(information.nutrient.pk): information.quantity
+                          for information in self.diary_entry.nutritional_information})
+
+        # Assert 2.
+        response = self.user_client.get(url, {'fields': 'pk,product', 'expand': 'product'})
+        self.assertEqual(response.data['results'][0]['product']['pk'], self.diary_entry.product.pk)
+
+    def test_diary_entry_read_serializer(self):
+        """
+        Assert:
+        1. The compiled representation of listed entries equals the one of DRF's generic field machinery.
+        """
+        request = Request(APIRequestFactory().get('/', {'expand': 'product,unit'}))
+        entries = list(DiaryEntry.objects.filter(user=self.user))
+        attach_nutritional_information(entries)
+
+        # Assert 1.
+        serializer = DiaryEntrySerializer(entries[0], context={'request': request})
+        self.assertEqual(serializer.data, serializers.Serializer.to_representation(serializer, entries[0]))
+
+        serializer = DiaryEntrySerializer(entries, many=True)
+        self.assertEqual(serializer.data, [serializers.Serializer.to_representation(serializer.child, entry)
+                                           for entry in entries])
+
     def test_diary_entry_item(self):
         """
         Assert:
@@ -175,6 +251,37 @@ class DiaryEntryViewSetTestCase(DiaryEntryBaseTest):
         self.assertEqual(response.status_code, 201)
         DiaryEntry.objects.get(pk = response.data['pk'])
 
+    def test_diary_entry_create_queries(self):
+        """
+        Assert:
+        1. Creating a DiaryEntry resolves its product, unit and conversion only once,
+        so the number of queries per request is bounded.
+        2. Updating a DiaryEntry uses the product and unit loaded with the entry, instead of loading them again.
+        """
+        url = reverse("diary_entry-list")
+
+        # Assert 1.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.post(url,
+            {
+                'date': '2019-03-03',
+                'time': '08:00',
+                'product': self.product.pk,
+                'quantity': 0.02,
+                'unit': self.kg.pk
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(len(queries), 10)
+
+        # Assert 2.
+        url = reverse("diary_entry-detail", kwargs={'pk': response.data['pk']})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.patch(url, {'product': self.product.pk, 'quantity': 0.03}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "food_foodproduct"."id"')])
+
     def test_diary_entry_create_missing_data(self):
         """
         Assert:
@@ -267,3 +374,242 @@ class DiaryEntryViewSetTestCase(DiaryEntryBaseTest):
         # Assert 2.
         with self.assertRaises(DiaryEntry.DoesNotExist):
             diary_entry = DiaryEntry.objects.get(pk=pk)
+
+
+class DiaryEntryBulkTestCase(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on the bulk action of the DiaryEntryViewSet.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user_client = APIClient()
+        self.user_client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+
+    def get_item(self, **kwargs):
+        item = {'date': '2019-03-03', 'time': '08:00', 'product': self.product.pk, 'quantity': 20, 'unit': self.g.pk}
+        item.update(kwargs)
+        return item
+
+    def test_diary_entry_bulk(self):
+        """
+        Assert:
+        1. Entries are created, updated and deleted at once, and the created and updated entries are returned.
+        2. The daily totals reflect all changes.
+        3. Entries of other users can not be updated or deleted.
+        4. Nothing is changed when any item is invalid, and the errors are returned per item.
+        """
+        url = reverse("diary_entry-bulk")
+
+        # Assert 1.
+        response = self.user_client.post(url, {
+            'create': [self.get_item(), self.get_item(quantity=40)],
+            'update': [{'pk': self.diary_entry.pk, 'quantity': 10}],
+            'delete': [self.diary_entry_2.pk],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['create']), 2)
+        self.assertEqual(response.data['create'][1]['nutritional_information'][0]['quantity'], 1.6)
+        self.assertEqual(response.data['update'][0]['quantity'], 10)
+        self.assertEqual(response.data['delete'], [self.diary_entry_2.pk])
+        self.assertEqual(DiaryEntry.objects.get(pk=self.diary_entry.pk).quantity, 10)
+        self.assertFalse(DiaryEntry.objects.filter(pk=self.diary_entry_2.pk).exists())
+        self.assertEqual(DiaryEntry.objects.filter(user=self.user, date=datetime.date(2019, 3, 3)).count(), 2)
+
+        # Assert 2.
+        totals = {totals.date: round(totals.quantity, 6)
+                  for totals in DailyNutrientTotals.objects.filter(user=self.user, nutrient=self.fat)}
+        self.assertEqual(totals, {datetime.date(2018, 3, 2): 0, datetime.date(2018, 3, 3): 0.4,
+                                  datetime.date(2019, 3, 3): 2.4})
+
+        # Assert 3.
+        response = self.user_client.post(url, {
+            'update': [{'pk': self.diary_entry_user_2.pk, 'quantity': 10}],
+            'delete': [self.diary_entry_user_2.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pk', response.data['update'][0])
+        self.assertEqual(len(response.data['delete'][0]), 1)
+
+        # Assert 4.
+        response = self.user_client.post(url, {
+            'create': [self.get_item(), self.get_item(unit=self.handful.pk)],
+            'delete': [self.diary_entry.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['create'][0], {})
+        self.assertIn('unit', response.data['create'][1])
+        self.assertNotIn('delete', response.data)
+        self.assertTrue(DiaryEntry.objects.filter(pk=self.diary_entry.pk).exists())
+        self.assertEqual(DiaryEntry.objects.filter(user=self.user, date=datetime.date(2019, 3, 3)).count(), 2)
+
+    def test_diary_entry_bulk_queries(self):
+        """
+        Assert:
+        1. The number of queries does not depend on the number of items.
+        """
+        url = reverse("diary_entry-bulk")
+        entries = list(DiaryEntry.objects.filter(user=self.user))
+
+        def count_queries(count):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.user_client.post(url, {
+                    'create': [self.get_item(quantity=index + 1) for index in range(count)],
+                    'update': [{'pk': entry.pk, 'quantity': count} for entry in entries],
+                }, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        # Assert 1.
+        self.assertEqual(count_queries(1), count_queries(8))
+
+
+class DiarySummaryViewSetTestCase(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on the DiarySummaryViewSet in the api package of the diary app.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        self.user_client = APIClient()
+        self.user_client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+
+    def test_diary_summary(self):
+        """
+        Assert:
+        1. The diary_summary view returns 401 (Not authenticated) when no authentication is provided.
+        2. The summary contains every day of the range, with the totals of the logged in user only.
+        3. The summary is read with a constant number of queries, regardless of the number of entries.
+        4. The compact summary contains a {nutrient id: quantity} map per day.
+        5. A 400 error (Bad request) is returned for an invalid range.
+        """
+        url = reverse("diary_summary-list")
+
+        # Assert 1.
+        response = self.client.get(url, {'from': '2018-03-01', 'to': '2018-03-03'})
+        self.assertEqual(response.status_code, 401)
+
+        # Assert 2.
+        response = self.user_client.get(url, {'from': '2018-03-01', 'to': '2018-03-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([day['date'] for day in response.data], ['2018-03-01', '2018-03-02', '2018-03-03'])
+        self.assertEqual(response.data[0]['nutritional_information'], [])
+        self.assertEqual({item['nutrient']['pk']: round(item['quantity'], 6)
+                          for item in response.data[2]['nutritional_information']},
+                         {self.fat.pk: 0.8, self.protein.pk: 1.2})
+
+        # Assert 3.
+        for index in range(5):
+            DiaryEntry.objects.create(user=self.user, product=self.product, date=datetime.date(2018, 3, 3),
+                                      quantity=20, unit=self.g)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.get(url, {'from': '2018-03-01', 'to': '2018-03-03'})
+        self.assertEqual(len(queries), 2)
+        self.assertEqual({item['nutrient']['pk']: round(item['quantity'], 6)
+                          for item in response.data[2]['nutritional_information']},
+                         {self.fat.pk: 4.8, self.protein.pk: 7.2})
+
+        # Assert 4.
+        response = self.user_client.get(url, {'from': '2018-03-02', 'compact': 'true'})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual({key: round(value, 6) for key, value in response.data[0]['nutritional_information'].items()},
+                         {str(self.fat.pk): 0.8, str(self.protein.pk): 1.2})
+
+        # Assert 5.
+        self.assertEqual(self.user_client.get(url, {'from': '2018-03-03', 'to': '2018-03-01'}).status_code, 400)
+        self.assertEqual(self.user_client.get(url, {'from': '2018-03-xx'}).status_code, 400)
+        self.assertEqual(self.user_client.get(url, {'from': '2017-01-01', 'to': '2019-01-01'}).status_code, 400)
+
+
+class DiaryTrendViewSetTestCase(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on the DiaryTrendViewSet in the api package of the diary app.
+    """
+
+    def setUp(self):
+        super().setUp()
+        trend_cache.get_cache().clear()
+
+        self.user_client = APIClient()
+        self.user_client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+
+    def get_nutrient(self, response, nutrient):
+        return next(item for item in response.data['nutrients'] if item['nutrient']['pk'] == nutrient.pk)
+
+    def test_diary_trends(self):
+        """
+        Assert:
+        1. The weekly trends contain every week of the range, with the totals, averages per day and moving averages.
+        2. The monthly trends count the days of partial months within the range.
+        3. A 400 error (Bad request) is returned for an unknown granularity or window.
+        """
+        url = reverse("diary_trends-list")
+
+        # Assert 1.
+        response = self.user_client.get(url, {'granularity': 'week', 'from': '2018-02-19', 'to': '2018-03-11',
+                                              'window': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['periods'], ['2018-02-19', '2018-02-26', '2018-03-05'])
+        self.assertEqual(response.data['days'], [7, 7, 7])
+
+        fat = self.get_nutrient(response, self.fat)
+        self.assertEqual([round(value, 6) for value in fat['totals']], [0, 1.6, 0])
+        self.assertEqual([round(value, 6) for value in fat['daily_average']], [0, round(1.6 / 7, 6), 0])
+        self.assertEqual([round(value, 6) for value in fat['moving_average']], [0, 0.8, 0.8])
+
+        # Assert 2.
+        response = self.user_client.get(url, {'granularity': 'month', 'from': '2018-02-15', 'to': '2018-03-10'})
+        self.assertEqual(response.data['periods'], ['2018-02-01', '2018-03-01'])
+        self.assertEqual(response.data['days'], [14, 10])
+        self.assertEqual([round(value, 6) for value in self.get_nutrient(response, self.protein)['totals']],
+                         [0, 2.4])
+
+        # Assert 3.
+        self.assertEqual(self.user_client.get(url, {'granularity': 'day'}).status_code, 400)
+        self.assertEqual(self.user_client.get(url, {'window': 0}).status_code, 400)
+
+    def test_diary_trends_cache(self):
+        """
+        Assert:
+        1. Trends are cached, so an equal request does not roll up the totals again.
+        2. Changing an entry within the range invalidates the cached trends.
+        3. Changing an entry outside of the range does not invalidate the cached trends.
+        4. Rebuilding the totals invalidates the cached trends, including those of months that lost all their totals.
+        """
+        url = reverse("diary_trends-list")
+        params = {'granularity': 'month', 'from': '2018-03-01', 'to': '2018-03-31'}
+        self.user_client.get(url, params)
+
+        # Assert 1.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.get(url, params)
+        self.assertFalse([query for query in queries if 'diary_dailynutrienttotals' in query['sql']])
+        self.assertEqual(round(self.get_nutrient(response, self.fat)['totals'][0], 6), 1.6)
+
+        # Assert 2.
+        DiaryEntry.objects.create(user=self.user, product=self.product, date=datetime.date(2018, 3, 20),
+                                  quantity=20, unit=self.g)
+        response = self.user_client.get(url, params)
+        self.assertEqual(round(self.get_nutrient(response, self.fat)['totals'][0], 6), 2.4)
+
+        # Assert 3.
+        DiaryEntry.objects.create(user=self.user, product=self.product, date=datetime.date(2018, 4, 20),
+                                  quantity=20, unit=self.g)
+        with CaptureQueriesContext(connection) as queries:
+            self.user_client.get(url, params)
+        self.assertFalse([query for query in queries if 'diary_dailynutrienttotals' in query['sql']])
+
+        # Assert 4.
+        DiaryEntry.objects.filter(user=self.user, date__month=3).update(quantity=40)
+        rebuild_daily_totals([self.user])
+        response = self.user_client.get(url, params)
+        self.assertEqual(round(self.get_nutrient(response, self.fat)['totals'][0], 6), 4.8)
+
+        DiaryEntry.objects.filter(user=self.user, date__month=3).delete()
+        rebuild_daily_totals([self.user])
+        response = self.user_client.get(url, params)
+        self.assertEqual(response.data['nutrients'], [])
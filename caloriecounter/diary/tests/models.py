@@ -1,8 +1,13 @@
 import datetime
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.authtoken.models import Token
 
-from caloriecounter.diary.models import DiaryEntry
+from caloriecounter.diary.models import DiaryEntry, DailyNutrientTotals, PendingQuantityUpdate, PendingTotalsUpdate
+from caloriecounter.diary.nutrition import compute_nutrition
+from caloriecounter.diary.totals import rebuild_daily_totals, update_pending_quantities, update_pending_totals
+from caloriecounter.food.catalog_import import CatalogImporter
 from caloriecounter.food.tests import BaseTest, ValidationError, TestCase
 from caloriecounter.user.models import User
 
@@ -203,3 +208,246 @@ class DiaryEntryTest(DiaryEntryBaseTest):
         # Assert 1.
         self.assertEqual(len(entry.nutritional_information), 0)
 
+
+class NutritionEngineTest(DiaryEntryBaseTest):
+
+    # Assert:
+    # 1. The nutrients of all entries are computed in one pass, with one column per nutrient.
+    # 2. The nutrients for each entry are the same as when computed for that entry by itself.
+    # 3. The totals are the sum of the nutrients of all entries.
+    # 4. Entries that can not be converted have no quantities, and do not count towards the totals.
+    def test_compute_nutrition(self):
+        entry_kg = DiaryEntry(user=self.user, product=self.product, quantity=0.5, unit=self.kg)
+        entry_no_unit = DiaryEntry(user=self.user, product=self.product, quantity=2)
+        entry_handful = DiaryEntry(user=self.user, product=self.product, quantity=3, unit=self.handful)
+        entries = [self.diary_entry, entry_kg, entry_no_unit, entry_handful]
+
+        result = compute_nutrition(entries)
+
+        # Assert 1.
+        self.assertEqual(result.per_entry.shape, (4, 2))
+
+        # Assert 2.
+        for index, entry in enumerate(entries[:3]):
+            quantities = {item.nutrient: item.quantity for item in result.for_entry(index)}
+            for item in entry.nutritional_information:
+                self.assertEqual(quantities[item.nutrient], item.quantity)
+
+        # Assert 3.
+        self.assertEqual({item.nutrient: round(item.quantity, 6) for item in result.summary()},
+                         {self.fat: 0.04 * 550, self.protein: 0.06 * 550})
+
+        # Assert 4.
+        self.assertIsNone(result.for_entry(3)[0].quantity)
+
+
+class QuantityInDefaultUnitTest(DiaryEntryBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.bowl_entry = DiaryEntry.objects.create(user=self.user, product=self.product,
+                                                    date=datetime.date(2018, 3, 4), quantity=2, unit=self.bowl)
+        self.handful_entry = DiaryEntry.objects.create(user=self.user, product=self.product,
+                                                       date=datetime.date(2018, 3, 4), quantity=2, unit=self.handful)
+
+    # Assert:
+    # 1. The quantity in default unit is stored on save, or None if the unit can not be converted.
+    # 2. The nutrients of entries are summed in a single query, per nutrient and optionally per date.
+    def test_stored_quantity(self):
+        # Assert 1.
+        self.assertEqual(DiaryEntry.objects.get(pk=self.diary_entry.pk).quantity_in_default_unit, 20)
+        self.assertEqual(DiaryEntry.objects.get(pk=self.bowl_entry.pk).quantity_in_default_unit, 400)
+        self.assertIsNone(DiaryEntry.objects.get(pk=self.handful_entry.pk).quantity_in_default_unit)
+
+        # Assert 2.
+        entries = DiaryEntry.objects.filter(user=self.user)
+        with self.assertNumQueries(1):
+            totals = {row['nutrient']: round(row['total'], 6) for row in entries.with_nutrient_totals()}
+        self.assertEqual(totals, {self.fat.pk: 17.6, self.protein.pk: 26.4})
+
+        totals = {(row['date'], row['nutrient']): round(row['total'], 6)
+                  for row in entries.with_nutrient_totals('date')}
+        self.assertEqual(totals[(datetime.date(2018, 3, 4), self.fat.pk)], 16)
+
+    # Assert:
+    # 1. Changing the conversion of a product unit updates the stored quantities of its entries, and the daily totals,
+    #    once the pending updates are applied, and not within the save.
+    # 2. Changing the default quantity of a product updates the stored quantities of its entries without a unit.
+    # 3. Changing other fields of a product does not update its entries.
+    # 4. Changing the conversion of a unit updates the stored quantities of its entries, other fields do not.
+    # 5. Changing the conversion of a unit updates the entries in other units with the same base unit.
+    def test_conversion_changes(self):
+        day = datetime.date(2018, 3, 4)
+
+        # Assert 1.
+        self.food_product_unit_bowl.multiplier = 100
+        with CaptureQueriesContext(connection) as queries:
+            self.food_product_unit_bowl.save()
+        self.assertFalse([query for query in queries if 'diary_diaryentry' in query['sql']])
+        self.assertEqual(DiaryEntry.objects.get(pk=self.bowl_entry.pk).quantity_in_default_unit, 400)
+
+        self.assertEqual(update_pending_quantities(), 1)
+        self.assertFalse(PendingQuantityUpdate.objects.exists())
+        self.assertEqual(DiaryEntry.objects.get(pk=self.bowl_entry.pk).quantity_in_default_unit, 200)
+        self.assertEqual(round(DailyNutrientTotals.objects.get(user=self.user, date=day, nutrient=self.fat).quantity,
+                               6), 8)
+
+        # Assert 2.
+        entry = DiaryEntry.objects.create(user=self.user, product=self.product, date=day, quantity=2)
+        self.assertEqual(entry.quantity_in_default_unit, 30)
+
+        self.product.default_quantity = 10
+        self.product.save()
+        update_pending_quantities()
+        self.assertEqual(DiaryEntry.objects.get(pk=entry.pk).quantity_in_default_unit, 20)
+        self.assertEqual(round(DailyNutrientTotals.objects.get(user=self.user, date=day, nutrient=self.fat).quantity,
+                               6), 8.8)
+
+        # Assert 3.
+        self.product.display_name = 'Mushrooms'
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+        self.assertFalse([query for query in queries if 'diary_diaryentry' in query['sql']])
+        self.assertFalse(PendingQuantityUpdate.objects.exists())
+
+        # Assert 4.
+        self.kg.short_name = 'kg'
+        self.kg.save()
+        self.assertFalse(PendingQuantityUpdate.objects.exists())
+
+        self.kg.base_unit_multiplier = 100
+        self.kg.save()
+        self.assertEqual(list(PendingQuantityUpdate.objects.values_list('unit_id', flat=True)), [self.kg.pk])
+
+        # Assert 5.
+        update_pending_quantities()
+        entry = DiaryEntry.objects.create(user=self.user, product=self.product_with_cup, date=day, quantity=3,
+                                          unit=self.l)
+        self.assertEqual(entry.quantity_in_default_unit, 6000)
+
+        self.cup.base_unit_multiplier = 100
+        self.cup.save()
+        update_pending_quantities()
+        self.assertEqual(DiaryEntry.objects.get(pk=entry.pk).quantity_in_default_unit, 4500)
+
+
+    # Assert:
+    # 1. Product units that are changed by a catalog import update the stored quantities of their entries,
+    #    once the pending updates are applied.
+    # 2. Product nutrients that are changed by a catalog import update the daily totals of their entries.
+    # 3. Rows of products without entries are not queued.
+    def test_imported_changes(self):
+        day = datetime.date(2018, 3, 4)
+        importer = CatalogImporter()
+
+        # Assert 1.
+        importer.import_batch([{'model': 'food.foodproductunit', 'pk': self.food_product_unit_bowl.pk,
+                                'fields': {'product': self.product.pk, 'unit': self.bowl.pk, 'multiplier': 100}}])
+        self.assertEqual(update_pending_quantities(), 1)
+        self.assertEqual(DiaryEntry.objects.get(pk=self.bowl_entry.pk).quantity_in_default_unit, 200)
+
+        # Assert 2.
+        importer.import_batch([{'model': 'food.foodproductnutrient', 'pk': self.food_product_nutrient_fat.pk,
+                                'fields': {'product': self.product.pk, 'nutrient': self.fat.pk, 'quantity': 5}}])
+        update_pending_totals()
+        self.assertEqual(round(DailyNutrientTotals.objects.get(user=self.user, date=day, nutrient=self.fat).quantity,
+                               6), 10)
+
+        # Assert 3.
+        importer.import_batch([{'model': 'food.foodproductunit', 'pk': self.food_product_unit_cup.pk,
+                                'fields': {'product': self.product_with_cup.pk, 'unit': self.cup.pk,
+                                           'multiplier': 100}}])
+        self.assertFalse(PendingQuantityUpdate.objects.exists())
+
+
+class DailyNutrientTotalsTest(DiaryEntryBaseTest):
+
+    def get_totals(self, user, date):
+        return {totals.nutrient: round(totals.quantity, 6)
+                for totals in DailyNutrientTotals.objects.filter(user=user, date=date)}
+
+    # Assert:
+    # 1. Creating entries adds their nutrients to the totals of their user and date.
+    # 2. Updating an entry applies the difference to the totals.
+    # 3. Moving an entry to another date moves its nutrients to the totals of that date.
+    # 4. Deleting an entry subtracts its nutrients from the totals.
+    def test_incremental_totals(self):
+        day = datetime.date(2018, 3, 3)
+        previous_day = datetime.date(2018, 3, 2)
+
+        # Assert 1.
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0.8, self.protein: 1.2})
+        self.assertEqual(self.get_totals(self.user_2, day), {self.fat: 0.8, self.protein: 1.2})
+
+        # Assert 2.
+        self.diary_entry.quantity = 40
+        self.diary_entry.save()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 1.6, self.protein: 2.4})
+
+        # Assert 3.
+        entry = DiaryEntry.objects.get(pk=self.diary_entry.pk)
+        entry.date = previous_day
+        entry.save()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0, self.protein: 0})
+        self.assertEqual(self.get_totals(self.user, previous_day), {self.fat: 2.4, self.protein: 3.6})
+
+        # Assert 4.
+        entry.delete()
+        self.assertEqual(self.get_totals(self.user, previous_day), {self.fat: 0.8, self.protein: 1.2})
+
+    # Assert:
+    # 1. Saving an entry that was changed elsewhere since it was loaded subtracts what is stored, not what was loaded.
+    # 2. Deleting an entry that was deleted elsewhere subtracts nothing.
+    def test_stale_entries(self):
+        day = datetime.date(2018, 3, 3)
+        entry = DiaryEntry.objects.get(pk=self.diary_entry.pk)
+        stale_entry = DiaryEntry.objects.get(pk=self.diary_entry.pk)
+
+        # Assert 1.
+        entry.quantity = 40
+        entry.save()
+        stale_entry.quantity = 10
+        stale_entry.save()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0.4, self.protein: 0.6})
+
+        # Assert 2.
+        entry.delete()
+        stale_entry.delete()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0, self.protein: 0})
+
+    # Assert:
+    # 1. Entries that were changed without saving them (i.e. in bulk) are reflected in the totals after a rebuild.
+    # 2. Only the totals of the given users are rebuilt.
+    def test_rebuild_totals(self):
+        day = datetime.date(2018, 3, 3)
+        DiaryEntry.objects.filter(user=self.user).update(quantity=10)
+        DiaryEntry.objects.filter(user=self.user_2).update(quantity=10)
+
+        # Assert 1.
+        self.assertEqual(rebuild_daily_totals([self.user]), 2)
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0.4, self.protein: 0.6})
+
+        # Assert 2.
+        self.assertEqual(self.get_totals(self.user_2, day), {self.fat: 0.8, self.protein: 1.2})
+
+    # Assert:
+    # 1. Changing the nutrients of a product updates the totals of the days with its entries,
+    #    once the pending updates are applied, and not within the save.
+    # 2. Deleting a nutrient of a product removes it from the totals.
+    def test_nutrient_changes(self):
+        day = datetime.date(2018, 3, 3)
+
+        # Assert 1.
+        self.food_product_nutrient_fat.quantity = 5
+        self.food_product_nutrient_fat.save()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 0.8, self.protein: 1.2})
+
+        self.assertEqual(update_pending_totals(), 3)
+        self.assertFalse(PendingTotalsUpdate.objects.exists())
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 1, self.protein: 1.2})
+        self.assertEqual(self.get_totals(self.user_2, day), {self.fat: 1, self.protein: 1.2})
+
+        # Assert 2.
+        self.food_product_nutrient_protein.delete()
+        update_pending_totals()
+        self.assertEqual(self.get_totals(self.user, day), {self.fat: 1})
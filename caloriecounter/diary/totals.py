@@ -0,0 +1,241 @@
+from collections import defaultdict
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from caloriecounter.diary.nutrition import compute_nutrition
+from caloriecounter.diary.trends import trend_cache
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.unit_graph import unit_graph
+
+
+# The fields of a DiaryEntry that determine its contribution to the DailyNutrientTotals.
+TOTALS_FIELDS = ('user_id', 'date', 'product_id', 'unit_id', 'portion_id', 'quantity', 'quantity_in_default_unit')
+
+
+def get_entry_date(entry):
+    # Unsaved entries can have a datetime (the field's default) or a string as their date.
+    return entry._meta.get_field('date').to_python(entry.date)
+
+
+def get_nutrient_totals(entries):
+    """
+    Return the nutrients of a list of diary entries, summed per (user id, date, nutrient id).
+    """
+    entries = [entry for entry in entries if entry is not None]
+    totals = defaultdict(float)
+    if not entries:
+        return totals
+
+    result = compute_nutrition(entries)
+    for index, entry in enumerate(entries):
+        if result.product_nutrients[index] is None:
+            continue
+
+        key = (entry.user_id, get_entry_date(entry))
+        for column in result.product_nutrients[index]:
+            totals[key + (result.nutrients[column].pk,)] += float(result.per_entry[index, column])
+
+    return totals
+
+
+def apply_nutrient_deltas(deltas):
+    """
+    Add the given {(user id, date, nutrient id): quantity} deltas to the DailyNutrientTotals, in a single query.
+    The rows are written in order of their key, so concurrent transactions lock them in the same order.
+    """
+    rows = [(user_id, date, nutrient_id, quantity) for (user_id, date, nutrient_id), quantity
+            in sorted(deltas.items()) if quantity != 0]
+    if not rows:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO diary_dailynutrienttotals (user_id, date, nutrient_id, quantity)
+            VALUES {0}
+            ON CONFLICT (user_id, date, nutrient_id)
+            DO UPDATE SET quantity = diary_dailynutrienttotals.quantity + EXCLUDED.quantity
+        """.format(', '.join(['(%s, %s, %s, %s)'] * len(rows))), [value for row in rows for value in row])
+
+
+def update_daily_totals(removed=(), added=()):
+    """
+    Subtract the nutrients of the removed entries from the DailyNutrientTotals, and add those of the added entries.
+    Removed entries are entries as they were saved, see DiaryEntry.get_saved_entry.
+    """
+    deltas = defaultdict(float)
+    for key, quantity in get_nutrient_totals(removed).items():
+        deltas[key] -= quantity
+    for key, quantity in get_nutrient_totals(added).items():
+        deltas[key] += quantity
+
+    apply_nutrient_deltas(deltas)
+
+    # Rolled up trends that cover the changed days are invalidated.
+    trend_cache.invalidate({(entry.user_id, get_entry_date(entry))
+                            for entry in list(removed) + list(added) if entry is not None})
+
+
+def update_quantities_in_default_unit(entries, chunk_size=2000):
+    """
+    Recompute the stored quantity_in_default_unit of diary entries (a queryset), i.e. after the conversions
+    of their products changed, and apply the differences to the daily totals.
+    Returns the number of entries whose quantity changed.
+    """
+    from caloriecounter.diary.models import DiaryEntry
+
+    count = 0
+    entries = entries.order_by('pk')
+
+    with transaction.atomic():
+        last_pk = 0
+        while True:
+            chunk = list(entries.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            conversion_tables.get_many({entry.product_id: entry.product for entry in chunk}.values())
+
+            changed = []
+            deltas = defaultdict(float)
+            for entry in chunk:
+                previous = entry.quantity_in_default_unit
+                entry.quantity_in_default_unit = entry.compute_quantity_in_default_unit()
+                if entry.quantity_in_default_unit == previous:
+                    continue
+
+                changed.append(entry)
+                difference = (entry.quantity_in_default_unit or 0) - (previous or 0)
+                for product_nutrient in entry.product.foodproductnutrient_set.all():
+                    deltas[(entry.user_id, get_entry_date(entry), product_nutrient.nutrient_id)] += \
+                        difference * product_nutrient.quantity / 100
+
+            DiaryEntry.objects.bulk_update(changed, ['quantity_in_default_unit'])
+            apply_nutrient_deltas(deltas)
+            trend_cache.invalidate({(entry.user_id, get_entry_date(entry)) for entry in changed})
+
+            for entry in changed:
+                entry.store_saved_state()
+            count += len(changed)
+
+    return count
+
+
+def update_pending_quantities(chunk_size=2000):
+    """
+    Recompute the stored quantity_in_default_unit of the diary entries whose conversions changed
+    (see PendingQuantityUpdate), and apply the differences to the daily totals.
+    Updates that are being applied by another process are skipped. Returns the number of entries that changed.
+    """
+    from caloriecounter.diary.models import DiaryEntry, PendingQuantityUpdate, get_unit_entries
+
+    with transaction.atomic():
+        updates = list(PendingQuantityUpdate.objects.select_for_update(skip_locked=True).order_by('pk'))
+        if not updates:
+            return 0
+
+        product_ids = {update.product_id for update in updates if update.product_id is not None}
+        unit_ids = {update.unit_id for update in updates if update.unit_id is not None}
+
+        # The conversions of the products and units are read from the database, not from the caches of this process.
+        unit_graph.invalidate()
+        conversion_tables.clear()
+
+        entries = DiaryEntry.objects.filter(product_id__in=product_ids) | get_unit_entries(unit_ids)
+        count = update_quantities_in_default_unit(entries, chunk_size=chunk_size)
+
+        PendingQuantityUpdate.objects.filter(pk__in=[update.pk for update in updates]).delete()
+
+    return count
+
+
+def recompute_daily_totals(days, chunk_size=500):
+    """
+    Recompute the DailyNutrientTotals of the given (user id, date) days from their diary entries,
+    i.e. after the nutrients of the products of those entries changed.
+    """
+    from caloriecounter.diary.models import DailyNutrientTotals, DiaryEntry
+
+    days = sorted(days)
+    with transaction.atomic():
+        for start in range(0, len(days), chunk_size):
+            condition = reduce(or_, (Q(user_id=user_id, date=date)
+                                     for user_id, date in days[start:start + chunk_size]))
+            DailyNutrientTotals.objects.filter(condition).delete()
+            DailyNutrientTotals.objects.bulk_create([
+                DailyNutrientTotals(user_id=row['user'], date=row['date'], nutrient_id=row['nutrient'],
+                                    quantity=row['total'])
+                for row in DiaryEntry.objects.filter(condition).with_nutrient_totals('user', 'date')])
+
+        trend_cache.invalidate(days)
+
+
+def update_pending_totals(chunk_size=500):
+    """
+    Recompute the daily totals of the days with entries of the products whose nutrients changed
+    (see PendingTotalsUpdate). Updates that are being applied by another process are skipped.
+    Returns the number of days that were recomputed.
+    """
+    from caloriecounter.diary.models import DiaryEntry, PendingTotalsUpdate
+
+    with transaction.atomic():
+        updates = list(PendingTotalsUpdate.objects.select_for_update(skip_locked=True).order_by('pk'))
+        if not updates:
+            return 0
+
+        days = set(DiaryEntry.objects.filter(product_id__in={update.product_id for update in updates})
+                   .order_by().values_list('user_id', 'date').distinct())
+        recompute_daily_totals(days, chunk_size=chunk_size)
+
+        PendingTotalsUpdate.objects.filter(pk__in=[update.pk for update in updates]).delete()
+
+    return len(days)
+
+
+def rebuild_daily_totals(users=None, chunk_size=2000):
+    """
+    Rebuild the DailyNutrientTotals (of the given users, or of everyone) from their diary entries,
+    i.e. after entries were changed in bulk, or after the nutrients of products were corrected.
+
+    The stored quantities in default unit are brought up to date first,
+    after which the totals are summed in SQL (see DiaryEntryQuerySet.with_nutrient_totals).
+    Returns the number of entries that were processed.
+    """
+    from caloriecounter.diary.models import DailyNutrientTotals, DiaryEntry, PendingQuantityUpdate, PendingTotalsUpdate
+
+    totals = DailyNutrientTotals.objects.all()
+    entries = DiaryEntry.objects.all()
+    if users is not None:
+        totals = totals.filter(user__in=users)
+        entries = entries.filter(user__in=users)
+
+    with transaction.atomic():
+        # Rebuilding everything applies all pending conversion and nutrient changes.
+        if users is None:
+            PendingQuantityUpdate.objects.all().delete()
+            PendingTotalsUpdate.objects.all().delete()
+
+        update_quantities_in_default_unit(entries, chunk_size=chunk_size)
+
+        # The trends of the months with totals are invalidated both before and after the rebuild,
+        # which covers the months that no longer have any totals as well.
+        changes = [(None, None)] if users is None else [(user.pk, None) for user in users]
+        trend_cache.invalidate(changes)
+        totals.delete()
+
+        rows = entries.with_nutrient_totals('user', 'date').iterator()
+        while True:
+            chunk = [DailyNutrientTotals(user_id=row['user'], date=row['date'], nutrient_id=row['nutrient'],
+                                         quantity=row['total']) for row in islice(rows, chunk_size)]
+            if not chunk:
+                break
+
+            DailyNutrientTotals.objects.bulk_create(chunk)
+
+        trend_cache.invalidate(changes)
+
+    return entries.count()
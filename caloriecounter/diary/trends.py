@@ -0,0 +1,202 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+
+
+GRANULARITIES = ('week', 'month', 'year')
+
+
+def truncate_date(value, granularity):
+    """
+    Return the first day of the week (Monday), month or year of a date, like Postgres' date_trunc.
+    """
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())
+    if granularity == 'month':
+        return value.replace(day=1)
+    if granularity == 'year':
+        return value.replace(month=1, day=1)
+
+    raise ValueError('Unknown granularity "{0}"'.format(granularity))
+
+
+def next_period(value, granularity):
+    if granularity == 'week':
+        return value + timedelta(days=7)
+    if granularity == 'month':
+        return value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+    if granularity == 'year':
+        return value.replace(year=value.year + 1)
+
+    raise ValueError('Unknown granularity "{0}"'.format(granularity))
+
+
+def get_periods(start, end, granularity):
+    """
+    Return the first day of every period that overlaps the range from start up to and including end.
+    """
+    periods = []
+    period = truncate_date(start, granularity)
+    while period <= end:
+        periods.append(period)
+        period = next_period(period, granularity)
+
+    return periods
+
+
+def moving_average(values, window):
+    """
+    Return the trailing moving average over the last axis of a matrix.
+    The first values are averaged over the periods that are available, instead of being left out.
+    """
+    count = values.shape[-1]
+    if count == 0:
+        return values.copy()
+
+    sums = np.cumsum(values, axis=-1)
+    sums[..., window:] = sums[..., window:] - sums[..., :-window]
+
+    return sums / np.minimum(np.arange(1, count + 1), window)
+
+
+def compute_trends(user, granularity, start, end, window):
+    """
+    Roll the DailyNutrientTotals of a user up into weeks, months or years, with a single grouped query.
+
+    Returns the periods, the number of days of each period within the range, the nutrients,
+    and (nutrients x periods) matrices with the totals, the average per day and the moving average of the totals.
+    """
+    from caloriecounter.diary.models import DailyNutrientTotals
+    from caloriecounter.food.models import Nutrient
+
+    periods = get_periods(start, end, granularity)
+    period_index = {period: index for index, period in enumerate(periods)}
+
+    rows = DailyNutrientTotals.objects.filter(user=user, date__range=(start, end)) \
+        .annotate(period=Trunc('date', granularity, output_field=DateField())) \
+        .values_list('period', 'nutrient_id') \
+        .annotate(total=Sum('quantity')) \
+        .order_by()
+    rows = list(rows)
+
+    nutrients = list(Nutrient.objects.filter(pk__in={nutrient_id for _, nutrient_id, _ in rows})
+                     .order_by('-rank', 'pk'))
+    nutrient_index = {nutrient.pk: index for index, nutrient in enumerate(nutrients)}
+
+    totals = np.zeros((len(nutrients), len(periods)))
+    for period, nutrient_id, total in rows:
+        totals[nutrient_index[nutrient_id], period_index[period]] = total
+
+    # The number of days of each period that fall within the range, i.e. for a partial first or last month.
+    days = np.array([(min(next_period(period, granularity), end + timedelta(days=1)) - max(period, start)).days
+                     for period in periods], dtype=float)
+
+    return {
+        'periods': periods,
+        'days': days,
+        'nutrients': nutrients,
+        'totals': totals,
+        'daily_average': totals / days if len(periods) else totals,
+        'moving_average': moving_average(totals, window),
+    }
+
+
+class TrendCache:
+    """
+    A cache of rolled up trends, per (user, granularity, range, window), in the Django cache named by the
+    DIARY_TRENDS_CACHE setting.
+
+    Keys include the versions of the months of the range (see MonthlyTotalsVersion), which are incremented
+    in the same transaction as the daily totals within that month change, so a change only invalidates the trends
+    that cover it. Since the versions are kept in the database, every process notices a change right away,
+    whether or not the cache is shared between processes.
+    """
+
+    def get_cache(self):
+        return caches[getattr(settings, 'DIARY_TRENDS_CACHE', 'default')]
+
+    def get_timeout(self):
+        return getattr(settings, 'DIARY_TRENDS_CACHE_TIMEOUT', 24 * 60 * 60)
+
+    def get_version(self, user_id, start, end) -> int:
+        """
+        Return the sum of the versions of the months of a range, which only ever increases when one of them changes.
+        """
+        from caloriecounter.diary.models import MonthlyTotalsVersion
+
+        return MonthlyTotalsVersion.objects.filter(user_id=user_id, month__range=(truncate_date(start, 'month'), end)) \
+            .aggregate(version=Sum('version'))['version'] or 0
+
+    def make_key(self, user_id, granularity, start, end, window):
+        return 'diary_trends:{0}:{1}:{2}:{3}:{4}:{5}'.format(
+            user_id, granularity, start.isoformat(), end.isoformat(), window, self.get_version(user_id, start, end))
+
+    def get_or_compute(self, user_id, granularity, start, end, window, compute):
+        # The version is read before the trends are computed, so trends that were computed from a newer state
+        # can end up under an older key, but never the other way around.
+        key = self.make_key(user_id, granularity, start, end, window)
+        cache = self.get_cache()
+
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, self.get_timeout())
+
+        return value
+
+    def invalidate(self, changes):
+        """
+        Invalidate the cached trends that cover any of the given (user id, date) changes, within the current
+        transaction. A date of None invalidates the trends of every month a user has totals in,
+        and a user id of None those of everyone.
+        """
+        months = set()
+        users = set()
+        for user_id, day in changes:
+            if user_id is None:
+                return self.invalidate_users(None)
+            if day is None:
+                users.add(user_id)
+            else:
+                months.add((user_id, truncate_date(day, 'month')))
+
+        if users:
+            self.invalidate_users(users)
+
+        # The rows are written in order, so concurrent transactions lock them in the same order.
+        rows = sorted((user_id, month) for user_id, month in months if user_id not in users)
+        if not rows:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO diary_monthlytotalsversion (user_id, month, version)
+                VALUES {0}
+                ON CONFLICT (user_id, month)
+                DO UPDATE SET version = diary_monthlytotalsversion.version + 1
+            """.format(', '.join(['(%s, %s, 1)'] * len(rows))), [value for row in rows for value in row])
+
+    def invalidate_users(self, users):
+        """
+        Increment the versions of every month that the given users (or everyone) have daily totals in.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO diary_monthlytotalsversion (user_id, month, version)
+                SELECT DISTINCT user_id, date_trunc('month', date)::date, 1
+                FROM diary_dailynutrienttotals
+                {0}
+                ORDER BY 1, 2
+                ON CONFLICT (user_id, month)
+                DO UPDATE SET version = diary_monthlytotalsversion.version + 1
+            """.format('' if users is None else 'WHERE user_id = ANY(%s)'),
+                [] if users is None else [sorted(users)])
+
+
+# The process-wide trend cache.
+trend_cache = TrendCache()
@@ -0,0 +1,375 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db import models
+from django.http import HttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import serializers, status
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from caloriecounter.food.request_cache import request_cache
+
+
+# The query parameters of DynamicFieldsSerializerMixin.
+DYNAMIC_FIELDS_PARAMS = ('fields', 'omit', 'expand', 'compact')
+
+
+def get_query_param_list(request, name):
+    """
+    Return the comma separated values of a query parameter, i.e. ?fields=pk,full_name
+    """
+    values = request.query_params.get(name, '')
+    return [value.strip() for value in values.split(',') if value.strip()]
+
+
+def is_compact(request):
+    return request.query_params.get('compact', 'false').lower() not in ('0', 'false', 'no')
+
+
+class NutrientQuantityMapField(serializers.Field):
+    """
+    A compact representation of a list of nutrients, as a {nutrient id: quantity} map.
+    Accepts both FoodProductNutrients and NutritionalInformation.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if hasattr(value, 'all'):
+            value = value.all()
+
+        return {str(getattr(item, 'nutrient_id', None) or item.nutrient.pk): item.quantity for item in value}
+
+
+class RequestCachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    A PrimaryKeyRelatedField that looks up related objects through the request cache (see request_cache.py),
+    so an object that is referred to more than once within a request is only loaded once.
+    """
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+
+        queryset = self.get_queryset()
+        try:
+            return request_cache.get_instance(queryset, data)
+        except queryset.model.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class DynamicFieldsSerializerMixin:
+    """
+    Lets the client choose the fields of a (GET) response, through query parameters:
+
+    ?fields=pk,full_name    Only return these fields.
+    ?omit=units             Do not return these fields.
+    ?expand=default_unit    Return these related objects in full, instead of their primary key.
+    ?compact=true           Return the compact representation of fields that have one.
+
+    Serializers declare the options of their fields in their Meta:
+
+    expandable_fields:          {field name: (serializer class, related lookups)}
+    compact_fields:             {field name: field class}
+    prefetch_fields:            {field name: related lookups needed to serialize the field}
+    compact_prefetch_fields:    {field name: related lookups needed to serialize the compact field}
+
+    The query parameters are only applied to the top-level serializer of a request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.expanded_fields = set()
+        self.compact = False
+
+        request = self._context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        meta = getattr(self, 'Meta')
+        expandable_fields = getattr(meta, 'expandable_fields', {})
+        compact_fields = getattr(meta, 'compact_fields', {})
+
+        fields = get_query_param_list(request, 'fields')
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+        for name in get_query_param_list(request, 'omit'):
+            self.fields.pop(name, None)
+
+        for name in get_query_param_list(request, 'expand'):
+            if name in self.fields and name in expandable_fields:
+                serializer_class, _ = expandable_fields[name]
+                self.fields[name] = serializer_class(read_only=True)
+                self.expanded_fields.add(name)
+
+        if is_compact(request):
+            self.compact = True
+            for name, field_class in compact_fields.items():
+                if name in self.fields:
+                    source = self.fields[name].source
+                    self.fields[name] = field_class(source=source) if source != name else field_class()
+
+    def get_prefetch_lookups(self):
+        """
+        Return the related lookups that are needed to serialize the selected fields.
+        """
+        meta = getattr(self, 'Meta')
+        expandable_fields = getattr(meta, 'expandable_fields', {})
+        prefetch_fields = getattr(meta, 'prefetch_fields', {})
+        compact_prefetch_fields = getattr(meta, 'compact_prefetch_fields', {})
+
+        lookups = []
+        for name in self.fields:
+            if name in self.expanded_fields:
+                lookups.extend(expandable_fields[name][1])
+            elif self.compact and name in compact_prefetch_fields:
+                lookups.extend(compact_prefetch_fields[name])
+            else:
+                lookups.extend(prefetch_fields.get(name, ()))
+
+        return list(dict.fromkeys(lookups))
+
+    def prefetch_queryset(self, queryset):
+        """
+        Replace the prefetches of a queryset by those needed to serialize the selected fields.
+        """
+        return queryset.prefetch_related(None).prefetch_related(*self.get_prefetch_lookups())
+
+
+# Returned by a field reader for a field that is left out of a representation.
+SKIP = object()
+
+
+def compile_generic_reader(field):
+    """
+    Return a reader that represents a field the way Serializer.to_representation does.
+    """
+    def read(instance):
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            return SKIP
+
+        value = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        return None if value is None else field.to_representation(attribute)
+
+    return read
+
+
+def compile_field_reader(field):
+    """
+    Return a function that reads the representation of a bound serializer field from an instance,
+    specialized to the type of the field:
+
+    - primary key related fields read the foreign key column (i.e. product_id), without loading the object.
+    - nested serializers use the readers of their own fields.
+    - method fields call their method.
+    - other fields with a plain attribute as source call their to_representation directly.
+
+    Anything else, and any instance that lacks the attribute (i.e. a dict), is read by the generic reader.
+    """
+    if isinstance(field, serializers.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+
+    generic = compile_generic_reader(field)
+    if len(field.source_attrs) != 1:
+        return generic
+
+    attr = field.source_attrs[0]
+
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        model = getattr(getattr(field.parent, 'Meta', None), 'model', None)
+        try:
+            model_field = model._meta.get_field(attr)
+        except (AttributeError, FieldDoesNotExist):
+            return generic
+        if not model_field.many_to_one or not model_field.target_field.primary_key:
+            return generic
+        attr = model_field.attname
+        convert = None
+    elif isinstance(field, serializers.ListSerializer) \
+            and has_default_representation(field, serializers.ListSerializer):
+        read_child = get_representation_reader(field.child)
+
+        def convert(value):
+            if isinstance(value, models.Manager):
+                value = value.all()
+            return [read_child(item) for item in value]
+    elif isinstance(field, serializers.BaseSerializer):
+        convert = get_representation_reader(field)
+    else:
+        convert = field.to_representation
+
+    def read(instance):
+        try:
+            value = getattr(instance, attr)
+        except (AttributeError, ObjectDoesNotExist):
+            return generic(instance)
+
+        if value is None:
+            return None
+        if callable(value) and not isinstance(value, models.Manager):
+            return generic(instance)
+
+        return value if convert is None else convert(value)
+
+    return read
+
+
+def compile_representation(serializer):
+    """
+    Return a function that builds the representation of an instance, with a compiled reader per readable field.
+    """
+    readers = [(field.field_name, compile_field_reader(field)) for field in serializer._readable_fields]
+
+    def represent(instance):
+        representation = {}
+        for name, read in readers:
+            value = read(instance)
+            if value is not SKIP:
+                representation[name] = value
+
+        return representation
+
+    return represent
+
+
+def has_default_representation(serializer, base=serializers.Serializer):
+    return type(serializer).to_representation in (base.to_representation, FastReadSerializerMixin.to_representation)
+
+
+def get_representation_reader(serializer):
+    """
+    Return the compiled representation of a nested serializer, unless it represents instances its own way.
+    """
+    if isinstance(serializer, FastReadSerializerMixin) or not has_default_representation(serializer):
+        return serializer.to_representation
+
+    return compile_representation(serializer)
+
+
+class FastReadSerializerMixin:
+    """
+    Builds representations with readers that are compiled once per serializer (see compile_field_reader),
+    for the fields that remain after DynamicFieldsSerializerMixin applied a request's options,
+    instead of resolving every field of every instance through DRF's generic field machinery.
+
+    The representation itself does not change, so the API schema stays the same.
+    """
+
+    def to_representation(self, instance):
+        represent = self.__dict__.get('_represent')
+        if represent is None:
+            represent = self._represent = compile_representation(self)
+
+        return represent(instance)
+
+
+class DynamicFieldsViewSetMixin:
+    """
+    Only prefetches the relations needed for the fields selected by a request (see DynamicFieldsSerializerMixin).
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        serializer = self.get_serializer()
+        if isinstance(serializer, DynamicFieldsSerializerMixin):
+            queryset = serializer.prefetch_queryset(queryset)
+
+        return queryset
+
+
+class CatalogVersionMixin:
+    """
+    Adds conditional GET support to the catalog_actions of a viewset, based on the CatalogVersions of catalog_names.
+
+    Responses get a strong ETag, that changes with the versions of the catalogs, and a Last-Modified header.
+    Requests with a matching If-None-Match (or If-Modified-Since) header are answered with 304 Not Modified,
+    and rendered JSON responses are cached (in the FOOD_RESPONSE_CACHE cache) until any of the catalogs changes.
+    """
+    catalog_names = []
+    catalog_actions = ('list', 'retrieve')
+
+    def get_response_cache(self):
+        return caches[getattr(settings, 'FOOD_RESPONSE_CACHE', 'default')]
+
+    def get_catalog_etag(self, request):
+        """
+        Return the ETag and last modification date of the response to a request.
+        """
+        from caloriecounter.food.models import CatalogVersion
+
+        versions = CatalogVersion.get_versions(self.catalog_names)
+        last_modified = max((updated_on for version, updated_on in versions.values() if updated_on), default=None)
+
+        # The ETag differs per representation, so it includes the path, query parameters and format.
+        key = '\n'.join(['{0}:{1}:{2}'.format(name, version, updated_on.timestamp() if updated_on else '')
+                         for name, (version, updated_on) in sorted(versions.items())] +
+                        [request.get_full_path(), request.accepted_renderer.format])
+
+        return '"{0}"'.format(hashlib.md5(key.encode('utf-8')).hexdigest()), last_modified
+
+    def is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return etag in etags or '*' in etags
+
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and last_modified is not None \
+            and int(last_modified.timestamp()) <= if_modified_since
+
+    def get_catalog_response(self, request, get_response, *args, **kwargs):
+        if self.action not in self.catalog_actions:
+            return get_response(request, *args, **kwargs)
+
+        etag, last_modified = self.get_catalog_etag(request)
+        cache_key = 'catalog_response:{0}'.format(etag)
+        cached = self.get_response_cache().get(cache_key) if request.accepted_renderer.format == 'json' else None
+
+        if self.is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        elif cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = get_response(request, *args, **kwargs)
+            response.catalog_cache_key = cache_key
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_catalog_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_catalog_response(request, super().retrieve, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        # Rendered JSON is cached under its ETag, so equal requests can be answered without serializing again.
+        cache_key = getattr(response, 'catalog_cache_key', None)
+        if cache_key and response.status_code == status.HTTP_200_OK and request.accepted_renderer.format == 'json':
+            response.render()
+            self.get_response_cache().set(cache_key, (response.content, response['Content-Type']),
+                                          getattr(settings, 'FOOD_RESPONSE_CACHE_TIMEOUT', 24 * 60 * 60))
+
+        return response
@@ -0,0 +1,154 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.utils.encoding import force_str
+from django.utils.translation import gettext_lazy as _
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from caloriecounter.food.keyset import get_keyset_page, get_position
+
+
+def encode_value(value):
+    # Dates and times are encoded in full, so a position is exact (unlike DjangoJSONEncoder, which drops microseconds).
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Paginates a listing by keyset (see keyset.py): a page starts right after the last row of the previous page,
+    so every page is a single indexed range query, without counting the rows or skipping an offset.
+
+    Pages are linked by opaque next and previous cursors, which hold the position of the first or last row.
+    The ordering should be covered by an index, and end with a unique field.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    ordering = ('pk',)
+
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_page_size(self, request):
+        return self.page_size
+
+    def decode_cursor(self, request):
+        """
+        Return the (position, reverse) of the ?cursor= of a request, or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = cursor['p'], bool(cursor.get('r', False))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return self.clean_position(position), reverse
+
+    def clean_position(self, position):
+        """
+        Check the values of a decoded position, and raise a NotFound for a position that does not fit the ordering.
+        Positions are otherwise checked when they are filtered on, see get_rows.
+        """
+        return position
+
+    def encode_cursor(self, position, reverse=False):
+        cursor = {'p': [encode_value(value) for value in position]}
+        if reverse:
+            cursor['r'] = True
+
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_rows(self, queryset, cursor, page_size):
+        position, reverse = cursor or (None, False)
+        try:
+            return get_keyset_page(queryset, self.ordering, position, reverse, page_size)
+        except (ValidationError, TypeError, ValueError):
+            # A position that does not fit the ordering fields, i.e. an invalid date.
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_rows(self, rows, request, cursor, page_size):
+        """
+        Return a page of the rows of get_rows (or get_keyset_page), and set up the next and previous links.
+        """
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        reverse = cursor is not None and cursor[1]
+
+        has_more = len(rows) > page_size
+        page = rows[:page_size]
+        if reverse:
+            page.reverse()
+
+        # A page that was reached by a cursor always has a page on the side it was reached from.
+        self.has_next = reverse or has_more
+        self.has_previous = has_more if reverse else cursor is not None
+
+        self.next_position = get_position(page[-1], self.ordering) if page and self.has_next else None
+        self.previous_position = get_position(page[0], self.ordering) if page and self.has_previous else None
+
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        return self.paginate_rows(self.get_rows(queryset, cursor, page_size), request, cursor, page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': force_str(_('The pagination cursor value.')),
+                'schema': {
+                    'type': 'string',
+                },
+            },
+        ]
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 
+from caloriecounter.food.api.mixins import DynamicFieldsSerializerMixin, FastReadSerializerMixin, \
+    NutrientQuantityMapField
 from caloriecounter.food.models import FoodProduct, FoodGroup, Unit, Nutrient, FoodProductNutrient, FoodProductUnit, \
     FoodProductCommonName
 
@@ -28,7 +30,7 @@ class FoodProductNutrientSerializer(serializers.ModelSerializer):
         fields = ['quantity', 'nutrient']
 
 
-class NutritionalInformationSerializer(serializers.Serializer):
+class NutritionalInformationSerializer(FastReadSerializerMixin, serializers.Serializer):
     def create(self, validated_data):
         pass
 
@@ -51,12 +53,29 @@ class FoodProductCommonNameSerializer(serializers.ModelSerializer):
         fields = ('id', 'text', 'text_plural')
 
 
-class FoodProductSerializer(serializers.ModelSerializer):
+class FoodProductSerializer(DynamicFieldsSerializerMixin, FastReadSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = FoodProduct
         fields = ['pk', 'full_name', 'common_name', 'food_source', 'default_unit', 'default_quantity', 'food_group',
                   'nutritional_information', 'units', 'common_names']
 
+        expandable_fields = {
+            'default_unit': (UnitSerializer, ['default_unit']),
+            'food_group': (FoodGroupSerializer, ['food_group']),
+        }
+        compact_fields = {
+            'nutritional_information': NutrientQuantityMapField,
+        }
+        prefetch_fields = {
+            'common_name': ['common_names'],
+            'common_names': ['common_names'],
+            'nutritional_information': ['foodproductnutrient_set', 'foodproductnutrient_set__nutrient'],
+            'units': ['foodproductunit_set'],
+        }
+        compact_prefetch_fields = {
+            'nutritional_information': ['foodproductnutrient_set'],
+        }
+
     def get_common_name(self, instance) -> FoodProductCommonName:
         if hasattr(instance, 'common_name') and instance.common_name is not None:
             common_name = next((x for x in instance.common_names.all() if x.pk == instance.common_name), None)
@@ -69,3 +88,15 @@ class FoodProductSerializer(serializers.ModelSerializer):
     common_name = serializers.SerializerMethodField('get_common_name')
     nutritional_information = NutritionalInformationSerializer(source='foodproductnutrient_set', many=True)
     units = FoodProductUnitSerializer(source='foodproductunit_set', many=True)
+
+
+class FoodProductAutocompleteSerializer(serializers.Serializer):
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
+
+    pk = serializers.IntegerField()
+    display_name = serializers.CharField()
+    matched_name = serializers.CharField()
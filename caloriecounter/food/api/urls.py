@@ -4,6 +4,7 @@ from rest_framework import routers
 from caloriecounter.food.api import views
 
 router = routers.DefaultRouter()
+router.register(r'catalog', views.CatalogViewSet, basename='catalog')
 router.register(r'food_group', views.FoodGroupViewSet)
 router.register(r'food_product', views.FoodProductViewSet)
 router.register(r'nutrient', views.NutrientViewSet)
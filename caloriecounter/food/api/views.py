@@ -1,18 +1,36 @@
-from django.contrib.postgres.search import TrigramDistance
-from django.db.models import Q, F
+import math
+import os
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import viewsets, pagination
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import SearchFilter, BaseFilterBackend
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
+from rest_framework.renderers import JSONRenderer
 from rest_framework.schemas.openapi import AutoSchema
 from rest_framework.compat import coreapi, coreschema
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from caloriecounter.food.api.mixins import DynamicFieldsViewSetMixin, CatalogVersionMixin, DYNAMIC_FIELDS_PARAMS
+from caloriecounter.food.api.pagination import KeysetPagination
+from caloriecounter.food.api.renderers import FragmentResponse, ORJSONRenderer, render_page
 from caloriecounter.food.api.serializers import FoodProductSerializer, NutrientSerializer, FoodGroupSerializer, \
-    UnitSerializer, FoodProductCommonNameSerializer
-from caloriecounter.food.models import FoodProduct, Nutrient, Unit, FoodGroup, FoodProductCommonName
+    UnitSerializer, FoodProductCommonNameSerializer, FoodProductAutocompleteSerializer
+from caloriecounter.food.autocomplete import autocomplete_index
+from caloriecounter.food.fragments import product_fragments
+from caloriecounter.food.models import FoodProduct, Nutrient, Unit, FoodGroup, FoodProductCommonName, \
+    FOOD_PRODUCT_CATALOG, FOOD_GROUP_CATALOG, NUTRIENT_CATALOG, UNIT_CATALOG
+from caloriecounter.food.search import SEARCH_ORDERING, search_food_products
+from caloriecounter.food.search_cache import get_search_results, search_query_log
+from caloriecounter.food.snapshot import get_catalog_changes, get_latest_snapshot_path
 
 
 class TrigramSearchFilterBackend(BaseFilterBackend):
@@ -30,13 +48,7 @@ class TrigramSearchFilterBackend(BaseFilterBackend):
         if not search_terms:
             return queryset
 
-        queryset = queryset.annotate(common_name_distance = TrigramDistance('common_names__text', ' '.join(self.get_search_terms(request))))
-        queryset = queryset.annotate(common_name=F('common_names'))
-        queryset = queryset.annotate(distance=TrigramDistance('full_name', ' '.join(self.get_search_terms(request))))
-        queryset = queryset.filter(Q(distance__lte=0.7) | Q(common_name_distance__lte=0.7))
-        queryset = queryset.order_by('common_name_distance', 'distance')
-
-        return queryset
+        return search_food_products(queryset, search_terms)
 
     def get_schema_fields(self, view):
         assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
@@ -79,7 +91,24 @@ class LargePagination(pagination.PageNumberPagination):
     page_size = 1000
 
 
-class FoodGroupViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
+class FoodProductPagination(KeysetPagination):
+    ordering = ('full_name', 'pk')
+
+
+class FoodSearchPagination(KeysetPagination):
+    ordering = SEARCH_ORDERING
+
+    # The position is checked up front, since search results are not paginated with get_rows.
+    def clean_position(self, position):
+        distance, pk = position
+        if isinstance(distance, bool) or not isinstance(distance, (int, float)) or not math.isfinite(distance) \
+                or isinstance(pk, bool) or not isinstance(pk, int):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position
+
+
+class FoodGroupViewSet(CatalogVersionMixin, viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
     """
     API endpoint that allows FoodGroups to be viewed.
     """
@@ -87,24 +116,138 @@ class FoodGroupViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMix
     queryset = FoodGroup.objects.all()
     serializer_class = FoodGroupSerializer
     pagination_class = LargePagination
+    catalog_names = [FOOD_GROUP_CATALOG]
 
 
-class FoodProductViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
+class FoodProductViewSet(CatalogVersionMixin, DynamicFieldsViewSetMixin, viewsets.GenericViewSet,
+                         ListModelMixin, RetrieveModelMixin):
     """
     API endpoint that allows FoodProducts to be viewed.
+    The fields of the returned products can be selected with ?fields=, ?omit=, ?expand= and ?compact=.
     """
     # schema = AutoSchema()
-    queryset = FoodProduct.objects\
-        .prefetch_related('nutrients')\
-        .prefetch_related('units')\
-        .prefetch_related('common_names')
+    queryset = FoodProduct.objects.all()
+
+    # Products contain their nutrients, and (when expanded) their default unit and food group.
+    catalog_names = [FOOD_PRODUCT_CATALOG, FOOD_GROUP_CATALOG, NUTRIENT_CATALOG, UNIT_CATALOG]
+    catalog_actions = ('retrieve',)
 
     filter_backends = [TrigramSearchFilterBackend]
 
     serializer_class = FoodProductSerializer
+    pagination_class = FoodProductPagination
+
+    def use_fragments(self, request):
+        """
+        Whether a response can be assembled from the cached fragments of its products (see fragments.py),
+        which hold the default representation, rendered as compact JSON.
+        """
+        renderer = request.accepted_renderer
+        return isinstance(renderer, JSONRenderer) and not renderer.get_indent(request.accepted_media_type, {}) \
+            and not any(name in request.query_params for name in DYNAMIC_FIELDS_PARAMS)
+
+    def render_rows(self, rows):
+        """
+        Return the rendered products of a page of {pk, common_name} rows, from their cached fragments.
+        Products with a (searched) common name are rendered as a whole, since fragments do not have one.
+        """
+        fragments = product_fragments.get_many([row['pk'] for row in rows if row.get('common_name') is None])
+        named = self.get_queryset().in_bulk([row['pk'] for row in rows if row.get('common_name') is not None])
+
+        renderer = ORJSONRenderer()
+        results = []
+        for row in rows:
+            if row['pk'] in named:
+                named[row['pk']].common_name = row['common_name']
+                results.append(renderer.render(self.get_serializer(named[row['pk']]).data))
+            elif row['pk'] in fragments:
+                results.append(fragments[row['pk']])
+
+        return results
+
+    def list(self, request, *args, **kwargs):
+        """
+        Searches are served from the search result cache, which holds the product ids of each page of results,
+        paginated by distance (see FoodSearchPagination). Only the products on the requested page are then loaded.
+
+        Pages in the default representation are assembled from the cached fragments of their products.
+        """
+        search_terms = TrigramSearchFilterBackend().get_search_terms(request)
+        use_fragments = self.use_fragments(request)
+        if self.paginator is None or (not search_terms and not use_fragments):
+            return super().list(request, *args, **kwargs)
+
+        if search_terms:
+            search_query_log.record(search_terms)
+
+            paginator = FoodSearchPagination()
+            page_size = paginator.get_page_size(request)
+            cursor = paginator.decode_cursor(request)
+            rows = get_search_results(search_terms, cursor, page_size)
+
+            rows = paginator.paginate_rows(rows, request, cursor, page_size)
+        else:
+            paginator = self.paginator
+            rows = paginator.paginate_queryset(self.filter_queryset(FoodProduct.objects.values('pk', 'full_name')),
+                                               request, view=self)
+
+        if use_fragments:
+            return FragmentResponse(render_page(paginator.get_next_link(), paginator.get_previous_link(),
+                                                self.render_rows(rows)))
+
+        products = self.get_queryset().in_bulk([row['pk'] for row in rows])
+        page = []
+        for row in rows:
+            if row['pk'] in products:
+                products[row['pk']].common_name = row['common_name']
+                page.append(products[row['pk']])
+
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_catalog_response(request, self.retrieve_product, *args, **kwargs)
 
-class NutrientViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
+    def retrieve_product(self, request, *args, **kwargs):
+        """
+        A product in the default representation is served from its cached fragment.
+        """
+        if not self.use_fragments(request):
+            return super(CatalogVersionMixin, self).retrieve(request, *args, **kwargs)
+
+        try:
+            pk = FoodProduct._meta.pk.to_python(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except DjangoValidationError:
+            raise Http404
+
+        fragments = product_fragments.get_many([pk])
+        if pk not in fragments:
+            raise Http404
+
+        return FragmentResponse(fragments[pk])
+
+    @action(detail=False, methods=['get'], filter_backends=[], pagination_class=None,
+            serializer_class=FoodProductAutocompleteSerializer)
+    def autocomplete(self, request):
+        """
+        Returns the names of products matching the (partially typed) search term, for type-ahead.
+        These are served from an in-memory index, without querying the database.
+        """
+        search_terms = TrigramSearchFilterBackend().get_search_terms(request)
+
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+
+        results = autocomplete_index.query(' '.join(search_terms), limit=limit)
+
+        serializer = self.get_serializer([{'pk': pk, 'display_name': display_name, 'matched_name': matched_name}
+                                          for pk, display_name, matched_name in results], many=True)
+        return Response(serializer.data)
+
+
+class NutrientViewSet(CatalogVersionMixin, viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
     """
     API endpoint that allows Nutrients to be viewed.
     """
@@ -112,9 +255,10 @@ class NutrientViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixi
     queryset = Nutrient.objects.all()
     serializer_class = NutrientSerializer
     pagination_class = LargePagination
+    catalog_names = [NUTRIENT_CATALOG]
 
 
-class UnitViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
+class UnitViewSet(CatalogVersionMixin, viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
     """
     API endpoint that allows Units to be viewed.
     """
@@ -122,3 +266,40 @@ class UnitViewSet(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin):
     queryset = Unit.objects.all()
     serializer_class = UnitSerializer
     pagination_class = LargePagination
+    catalog_names = [UNIT_CATALOG]
+
+
+class CatalogViewSet(viewsets.ViewSet):
+    """
+    API endpoint that allows the full food catalog to be downloaded, and synchronized, for offline use.
+    """
+
+    @action(detail=False, methods=['get'])
+    def snapshot(self, request):
+        """
+        Returns the latest snapshot of the catalog, as gzipped JSON.
+        """
+        path = get_latest_snapshot_path()
+        if path is None:
+            raise NotFound(_('No catalog snapshot has been built.'))
+
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path),
+                            content_type='application/gzip')
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Returns the rows that changed since ?since=, the synced_on datetime of a snapshot or previous changes.
+        """
+        try:
+            since = parse_datetime(request.query_params.get('since', ''))
+        except ValueError:
+            # A well formed, but invalid datetime, i.e. with a 13th month.
+            since = None
+
+        if since is None:
+            raise ValidationError({'since': _('A valid datetime is required.')})
+        if timezone.is_naive(since):
+            raise ValidationError({'since': _('A datetime with a time zone is required.')})
+
+        return Response(get_catalog_changes(since))
@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-from .signals import pre_save_handler
 
 
 class FoodConfig(AppConfig):
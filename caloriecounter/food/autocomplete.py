@@ -0,0 +1,355 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+
+from django.utils import timezone
+
+from caloriecounter.food.catalog_versions import FOOD_PRODUCT_CATALOG, catalog_versions
+from caloriecounter.food.snapshot import get_sync_margin
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """
+    Split a text into lowercase words.
+    """
+    return [word for word in re.split(r'[^\w]+', (text or '').lower()) if word]
+
+
+def get_trigrams(word):
+    padded = '  {0} '.format(word)
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class AutocompleteIndex:
+    """
+    An in-memory prefix and trigram index over the names of all FoodProducts,
+    i.e. their full name, display name and common names.
+
+    Every word of every name is kept in a sorted vocabulary, so all words starting with a typed prefix
+    are found with a binary search. When no word matches a prefix (i.e. because of a typo),
+    words are matched on their trigrams instead.
+
+    The index is built when a worker starts (see gunicorn.conf.py), or else on first use, and is updated per product
+    on changes. Products that change while the index is being built are queued, and reindexed once it is built.
+    Products that are changed by another process are noticed through the version of the FOOD_PRODUCT_CATALOG
+    (see catalog_versions.py), after which the products changed since the index was last synchronized are reindexed
+    in the background, from their updated_on and tombstones, like the catalog changes of clients (see snapshot.py).
+    Versions that were produced by the changes of this process itself are skipped, since those are already indexed.
+    """
+
+    # The minimum trigram similarity of a word to a misspelled search word.
+    SIMILARITY_THRESHOLD = 0.3
+
+    def __init__(self, versions=None):
+        self._lock = threading.RLock()
+        # Only one build runs at a time. The lock of the index is only held to swap in the new index.
+        self._build_lock = threading.Lock()
+        self._generation = 0
+        self._pending = None
+        self._refreshing = False
+        self.versions = versions
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # A build that is running is not swapped in.
+            self._generation += 1
+            self.is_built = False
+            self.catalog_version = None
+            self.synced_on = None
+            self._products = {}
+            self._words = {}
+            self._vocabulary = []
+            self._trigrams = {}
+
+    def get_catalog_version(self):
+        return self.versions.get(FOOD_PRODUCT_CATALOG) if self.versions is not None else None
+
+    def _load(self, since=None):
+        """
+        Return the display name and all names of every product, or of the products updated since the given datetime,
+        by product id.
+        """
+        from caloriecounter.food.models import FoodProduct, FoodProductCommonName
+
+        products = FoodProduct.objects.order_by()
+        common_names = FoodProductCommonName.objects.order_by('pk')
+        if since is not None:
+            # Changes to common names touch the updated_on of their product.
+            products = products.filter(updated_on__gte=since)
+            common_names = common_names.filter(food_product__updated_on__gte=since)
+
+        names = {}
+        for product_id, full_name, display_name in products.values_list('pk', 'full_name', 'display_name').iterator():
+            names[product_id] = (display_name or full_name, [full_name, display_name])
+
+        for product_id, text in common_names.values_list('food_product_id', 'text').iterator():
+            if product_id in names:
+                names[product_id][1].append(text)
+
+        return names
+
+    def _load_deleted(self, since):
+        from caloriecounter.food.models import CatalogTombstone
+
+        return list(CatalogTombstone.objects.filter(table='foodproduct', deleted_on__gte=since)
+                    .values_list('object_id', flat=True))
+
+    def _build(self, since=None):
+        """
+        Build the index, or only reindex the products that changed since the given datetime.
+        """
+        with self._lock:
+            generation = self._generation
+            self._pending = set()
+
+        try:
+            # The version and time are read before the products, so changes in between are noticed by the next check.
+            catalog_version = self.get_catalog_version()
+            synced_on = timezone.now()
+            names = self._load(since)
+            deleted = self._load_deleted(since) if since is not None else ()
+            if since is None:
+                index = AutocompleteIndex()
+                for product_id, (display_name, product_names) in names.items():
+                    index._add(product_id, display_name, product_names)
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, None
+
+        with self._lock:
+            if generation != self._generation:
+                return ()
+
+            if since is None:
+                self._products, self._words = index._products, index._words
+                self._vocabulary, self._trigrams = index._vocabulary, index._trigrams
+            else:
+                for product_id in deleted:
+                    self._remove(product_id)
+                for product_id, (display_name, product_names) in names.items():
+                    self._remove(product_id)
+                    self._add(product_id, display_name, product_names)
+
+            self.catalog_version = catalog_version
+            self.synced_on = synced_on
+            self.is_built = True
+
+        return pending
+
+    def build(self):
+        """
+        Build the index from the database. The current index, if any, is served until the new one is complete.
+        """
+        with self._build_lock:
+            pending = self._build()
+
+        # Products that changed while the index was being built are reindexed.
+        for product_id in pending:
+            self.update_product(product_id)
+
+    def sync(self):
+        """
+        Reindex the products that changed since the index was last built or synchronized, i.e. by another process.
+        Rows are written before their transaction commits, so changes within the FOOD_CATALOG_SYNC_MARGIN
+        before then are reindexed again (see get_catalog_changes). Builds the index if it has not been built yet.
+        """
+        with self._build_lock:
+            with self._lock:
+                since = self.synced_on - get_sync_margin() if self.is_built else None
+            pending = self._build(since)
+
+        for product_id in pending:
+            self.update_product(product_id)
+
+    def _ensure_built(self):
+        if self.is_built:
+            self.check()
+            return
+
+        with self._build_lock:
+            pending = self._build() if not self.is_built else ()
+
+        for product_id in pending:
+            self.update_product(product_id)
+
+    def check(self):
+        """
+        Synchronize the index in the background if the products were changed by another process since it was built.
+        """
+        catalog_version = self.get_catalog_version()
+        with self._lock:
+            if not self.is_built or self._refreshing or self.catalog_version == catalog_version:
+                return
+
+            if self.versions.is_own(FOOD_PRODUCT_CATALOG, self.catalog_version, catalog_version):
+                self.catalog_version = catalog_version
+                return
+
+            self._refreshing = True
+
+        self.refresh()
+
+    def refresh(self):
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        from django.db import connection
+
+        try:
+            self.sync()
+        except Exception:
+            logger.exception('Failed to synchronize the autocomplete index.')
+        finally:
+            self._refreshing = False
+            connection.close()
+
+    def _add(self, product_id, display_name, names):
+        names = [name for name in dict.fromkeys(names) if name]
+        words = {word for name in names for word in normalize(name)}
+
+        self._products[product_id] = {
+            'display_name': display_name,
+            'names': names,
+            'words': words,
+            'length': min(len(name) for name in names) if names else 0,
+        }
+
+        for word in words:
+            if word not in self._words:
+                self._words[word] = set()
+                bisect.insort(self._vocabulary, word)
+                for trigram in get_trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+
+            self._words[word].add(product_id)
+
+    def _remove(self, product_id):
+        product = self._products.pop(product_id, None)
+        if product is None:
+            return
+
+        for word in product['words']:
+            product_ids = self._words[word]
+            product_ids.discard(product_id)
+
+            if not product_ids:
+                del self._words[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+                for trigram in get_trigrams(word):
+                    self._trigrams[trigram].discard(word)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+    def update_product(self, product_id):
+        """
+        Reindex the names of a single product. While the index is being built, the product is queued instead,
+        and it is reindexed once the index is built. Does nothing when the index has not been built yet.
+        """
+        from caloriecounter.food.models import FoodProduct, FoodProductCommonName
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending.add(product_id)
+            if not self.is_built:
+                return
+
+        product = FoodProduct.objects.filter(pk=product_id).values_list('full_name', 'display_name').first()
+        if product is None:
+            self.remove_product(product_id)
+            return
+
+        full_name, display_name = product
+        common_names = list(FoodProductCommonName.objects.filter(food_product_id=product_id)
+                            .order_by('pk').values_list('text', flat=True))
+
+        with self._lock:
+            self._remove(product_id)
+            self._add(product_id, display_name or full_name, [full_name, display_name] + common_names)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.add(product_id)
+            self._remove(product_id)
+
+    def _get_words_with_prefix(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + '\uffff', start)
+        return self._vocabulary[start:end]
+
+    def _get_similar_words(self, word):
+        trigrams = get_trigrams(word)
+        counts = {}
+        for trigram in trigrams:
+            for similar_word in self._trigrams.get(trigram, ()):
+                counts[similar_word] = counts.get(similar_word, 0) + 1
+
+        return [similar_word for similar_word, count in counts.items()
+                if count / len(trigrams | get_trigrams(similar_word)) >= self.SIMILARITY_THRESHOLD]
+
+    def _get_candidates(self, search_words, get_words):
+        candidates = None
+
+        # Start with the longest (usually most selective) word, to keep the intersections small.
+        for search_word in sorted(search_words, key=len, reverse=True):
+            product_ids = set()
+            for word in get_words(search_word):
+                product_ids.update(self._words[word])
+
+            candidates = product_ids if candidates is None else candidates & product_ids
+            if not candidates:
+                return set()
+
+        return candidates
+
+    def _get_matched_name(self, product, search_words):
+        # The shortest name that contains a word starting with each search word, if any.
+        for name in sorted(product['names'], key=len):
+            words = normalize(name)
+            if all(any(word.startswith(search_word) for word in words) for search_word in search_words):
+                return name
+
+        return min(product['names'], key=len)
+
+    def query(self, text, limit=10):
+        """
+        Return up to limit (product id, display name, matched name) tuples for products with a name
+        that matches the given text, preferring short names that start with the text.
+        """
+        self._ensure_built()
+
+        search_words = normalize(text)
+        if not search_words:
+            return []
+
+        text = ' '.join(search_words)
+
+        with self._lock:
+            candidates = self._get_candidates(search_words, self._get_words_with_prefix)
+            if not candidates:
+                candidates = self._get_candidates(search_words, self._get_similar_words)
+
+            # Preselect by the length of the shortest name, then rank the preselection on their matched name.
+            preselection = heapq.nsmallest(limit * 5, candidates,
+                                           key=lambda product_id: (self._products[product_id]['length'],
+                                                                   product_id))
+
+            results = []
+            for product_id in preselection:
+                product = self._products[product_id]
+                matched_name = self._get_matched_name(product, search_words)
+                results.append((not matched_name.lower().startswith(text), len(matched_name), product_id,
+                                product['display_name'], matched_name))
+
+        return [(product_id, display_name, matched_name)
+                for _, _, product_id, display_name, matched_name in sorted(results)[:limit]]
+
+
+# The process-wide autocomplete index.
+autocomplete_index = AutocompleteIndex(versions=catalog_versions)
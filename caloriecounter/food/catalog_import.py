@@ -0,0 +1,264 @@
+import json
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.dispatch import Signal
+
+from caloriecounter.food.catalog_versions import CATALOGS
+from caloriecounter.food.validation import validate_many
+
+
+# The models that can be imported, in the order they depend on each other.
+IMPORT_MODELS = (
+    'food.unit',
+    'food.nutrient',
+    'food.foodgroup',
+    'food.foodproduct',
+    'food.foodproductnutrient',
+    'food.foodproductunit',
+    'food.foodproductcommonname',
+)
+
+
+# Sent after the rows of a model in a batch are imported, within the transaction of the batch, since the rows are
+# written without sending post_save. instances are the rows that were inserted or changed, and updated holds
+# the primary keys of the changed rows that existed before.
+rows_imported = Signal(providing_args=['instances', 'updated'])
+
+
+def iter_json_array(file, chunk_size=1 << 16):
+    """
+    Yield the objects of a JSON array (i.e. a Django fixture) one by one,
+    reading the file in chunks instead of parsing it in memory as a whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace, and the commas between objects.
+        while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ',')):
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('The catalog must be a JSON array.')
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The object is incomplete, so the next chunk is read, unless there is none.
+                if eof:
+                    raise
+            else:
+                # An object at the very end of the buffer might be incomplete (i.e. a number), unless there is no more.
+                if end < len(buffer) or eof:
+                    yield obj
+                    position = end
+                    continue
+        elif eof:
+            if started:
+                raise ValueError('The catalog ends before its array is closed.')
+            return
+
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+
+class CatalogImporter:
+    """
+    Imports the food catalog from a Django fixture, in batches.
+
+    Rows are validated per batch, with validate_many, so all their foreign keys and unique constraints are checked
+    with one query per relation or constraint. Rows that conflict with another row on a unique field
+    (i.e. a unit with the name of another unit) are skipped, and reported as invalid.
+    Valid rows are then inserted, or update the existing row with their primary key, with a single query (see upsert),
+    so an interrupted import can be resumed (or repeated) safely, and a repeated import applies any changed rows.
+
+    Rows that only refer to rows that do not exist yet (i.e. a product nutrient before its product) are deferred,
+    and validated again with every next batch, since the rows they refer to may be in a later batch.
+    The rows that are still deferred when the import finishes are reported as invalid.
+    """
+
+    def __init__(self, batch_size=2000, deferred=()):
+        self.batch_size = batch_size
+        self.models = OrderedDict((label, apps.get_model(label)) for label in IMPORT_MODELS)
+        self.deferred = list(deferred)
+
+    def build_instance(self, model, data):
+        instance = model(pk=data.get('pk'))
+
+        fields = data.get('fields', {})
+        if not isinstance(fields, dict):
+            raise ValidationError('The fields of a row must be an object.')
+
+        for name, value in fields.items():
+            field = model._meta.get_field(name)
+            if field.many_to_many:
+                continue
+
+            if field.is_relation:
+                setattr(instance, field.attname, value)
+            else:
+                setattr(instance, field.attname, field.to_python(value))
+
+        return instance
+
+    def validate(self, model, rows):
+        """
+        Return the valid instances for a list of fixture rows, and a list of (row, error) tuples for invalid rows.
+        """
+        valid_rows = []
+        instances = []
+        errors = []
+
+        for row in rows:
+            try:
+                instances.append(self.build_instance(model, row))
+                valid_rows.append(row)
+            except (ValidationError, ValueError, LookupError, FieldDoesNotExist) as error:
+                errors.append((row, error))
+
+        # Existing rows with the same primary key are updated, so only conflicts with other rows are errors.
+        results = validate_many(instances)
+        errors.extend((row, error) for row, error in zip(valid_rows, results) if error is not None)
+
+        return [instance for instance, error in zip(instances, results) if error is None], errors
+
+    @staticmethod
+    def refers_to_missing_rows(model, error):
+        """
+        Return whether all errors of a row are foreign keys to rows that do not exist (yet), see validate_many.
+        """
+        relations = {field.name for field in model._meta.concrete_fields if field.is_relation}
+        return hasattr(error, 'error_dict') and all(
+            name in relations and all(message.code == 'invalid' for message in messages)
+            for name, messages in error.error_dict.items())
+
+    def upsert(self, model, instances):
+        """
+        Insert instances, or update the existing rows with their primary keys, with a single query per batch.
+        Existing rows that are unchanged are not written, so their updated_on is kept.
+        Returns the primary keys of the inserted rows, and those of the updated rows.
+        """
+        fields = model._meta.concrete_fields
+        pk = model._meta.pk
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = [connection.ops.quote_name(field.column) for field in fields]
+        assigned = [column for field, column in zip(fields, columns) if not field.primary_key]
+        compared = [column for field, column in zip(fields, columns)
+                    if not field.primary_key and not getattr(field, 'auto_now', False)]
+
+        created = []
+        updated = []
+        for start in range(0, len(instances), self.batch_size):
+            batch = instances[start:start + self.batch_size]
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO {0} ({1})
+                    VALUES {2}
+                    ON CONFLICT ({3})
+                    DO UPDATE SET {4}
+                    WHERE ({5}) IS DISTINCT FROM ({6})
+                    RETURNING {0}.{3}, {0}.xmax = 0
+                """.format(table, ', '.join(columns),
+                           ', '.join(['({0})'.format(', '.join(['%s'] * len(fields)))] * len(batch)),
+                           connection.ops.quote_name(pk.column),
+                           ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in assigned),
+                           ', '.join('{0}.{1}'.format(table, column) for column in compared),
+                           ', '.join('EXCLUDED.{0}'.format(column) for column in compared)),
+                    [field.get_db_prep_save(field.pre_save(instance, True), connection)
+                     for instance in batch for field in fields])
+
+                # The xmax of a row is only 0 when it was inserted, not when it was updated.
+                for pk_value, inserted in cursor.fetchall():
+                    (created if inserted else updated).append(pk_value)
+
+        return created, updated
+
+    def import_batch(self, rows, defer=True):
+        """
+        Validate and insert (or update) a batch of fixture rows, and the rows deferred by earlier batches,
+        in a single transaction. Rows that refer to rows that do not exist yet are deferred, unless defer is False.
+        Returns the number of inserted or updated rows, and a list of (row, error) tuples for invalid rows.
+        """
+        rows_by_model = OrderedDict((label, []) for label in self.models)
+        errors = []
+
+        rows, self.deferred = self.deferred + list(rows), []
+        for row in rows:
+            if not isinstance(row, dict):
+                errors.append((row, ValidationError('A row must be an object, not {0}.'.format(type(row).__name__))))
+                continue
+
+            label = str(row.get('model', '')).lower()
+            if label in rows_by_model:
+                rows_by_model[label].append(row)
+            else:
+                errors.append((row, ValidationError('Unknown model "{0}".'.format(row.get('model')))))
+
+        count = 0
+        with transaction.atomic():
+            for label, model_rows in rows_by_model.items():
+                if not model_rows:
+                    continue
+
+                model = self.models[label]
+                instances, model_errors = self.validate(model, model_rows)
+                created, updated = self.upsert(model, instances)
+
+                for row, error in model_errors:
+                    if defer and self.refers_to_missing_rows(model, error):
+                        self.deferred.append(row)
+                    else:
+                        errors.append((row, error))
+
+                changed = set(created).union(updated)
+                if changed:
+                    rows_imported.send(sender=model, instances=[instance for instance in instances
+                                                                if instance.pk in changed], updated=set(updated))
+                count += len(changed)
+
+        return count, errors
+
+    def finish(self):
+        """
+        Import the deferred rows whose references exist by now, and report the others.
+        Returns the number of inserted or updated rows, and a list of (row, error) tuples for invalid rows.
+
+        Then update everything that is derived from the catalog, since the rows are written without sending post_save.
+        Derived data of other apps (i.e. the stored quantities of diary entries) is updated from rows_imported.
+
+        The in-memory structures of the running processes (the unit graph, conversion tables, autocomplete index
+        and product fragments) are not cleared here, since that would only affect this process.
+        Every process notices the import through the CatalogVersions that are bumped instead (see catalog_versions.py).
+        """
+        from caloriecounter.food.models import CatalogVersion, FoodSearchDocument
+
+        count, errors = self.import_batch([], defer=False)
+
+        # Rows are imported with their primary keys, so the sequences are reset to the highest key.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(self.models.values())):
+                cursor.execute(sql)
+
+        FoodSearchDocument.rebuild()
+
+        for name in CATALOGS:
+            CatalogVersion.bump(name)
+
+        return count, errors
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+# The names of the CatalogVersions of each part of the food catalog.
+# The version of FoodProducts also covers their nutrients, units and common names.
+FOOD_PRODUCT_CATALOG = 'food_product'
+FOOD_GROUP_CATALOG = 'food_group'
+NUTRIENT_CATALOG = 'nutrient'
+UNIT_CATALOG = 'unit'
+
+CATALOGS = (FOOD_PRODUCT_CATALOG, FOOD_GROUP_CATALOG, NUTRIENT_CATALOG, UNIT_CATALOG)
+
+
+class CatalogVersionWatcher:
+    """
+    The versions of all parts of the catalog, as stored in the database (see CatalogVersion),
+    for the in-memory structures of a process that are derived from the catalog (i.e. the unit graph).
+
+    These structures are invalidated in the process that changes the catalog, but other processes
+    (other workers, or a management command) only notice a change through its CatalogVersion.
+    The versions are read with a single query, at most once every FOOD_CATALOG_VERSION_INTERVAL seconds,
+    so a change made elsewhere is picked up within that interval.
+
+    The versions produced by the changes of this process itself are recorded (see record_bump),
+    so structures that were already updated for those changes can skip them.
+    """
+
+    # The number of versions of each catalog that are remembered as produced by this process.
+    MAX_OWN_VERSIONS = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._read_on = None
+        self._own_versions = {name: set() for name in CATALOGS}
+
+    def get_interval(self):
+        return getattr(settings, 'FOOD_CATALOG_VERSION_INTERVAL', 5.0)
+
+    def get(self, name) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if self._versions is not None and now - self._read_on < self.get_interval():
+                return self._versions[name]
+
+        return self.refresh()[name]
+
+    def refresh(self):
+        """
+        Read the versions from the database, and return them as a {name: version} dict.
+        """
+        from caloriecounter.food.models import CatalogVersion
+
+        versions = {name: version for name, (version, updated_on) in CatalogVersion.get_versions(CATALOGS).items()}
+        with self._lock:
+            self._versions, self._read_on = versions, time.monotonic()
+
+        return versions
+
+    def record_bump(self, name, version):
+        """
+        Record a version of a catalog that was produced by a change in this process.
+        """
+        with self._lock:
+            own_versions = self._own_versions[name]
+            own_versions.add(version)
+            if len(own_versions) > self.MAX_OWN_VERSIONS:
+                own_versions.remove(min(own_versions))
+
+    def is_own(self, name, from_version, to_version):
+        """
+        Return whether all versions of a catalog after from_version, up to and including to_version,
+        were produced by changes in this process.
+        """
+        if from_version is None or to_version is None or to_version <= from_version:
+            return False
+
+        with self._lock:
+            return self._own_versions[name].issuperset(range(from_version + 1, to_version + 1))
+
+    def clear(self):
+        with self._lock:
+            self._versions = self._read_on = None
+            for own_versions in self._own_versions.values():
+                own_versions.clear()
+
+
+# The process-wide catalog versions.
+catalog_versions = CatalogVersionWatcher()
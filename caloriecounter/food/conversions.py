@@ -0,0 +1,190 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from caloriecounter.food.unit_graph import Conversion, unit_graph
+
+
+class ProductConversionTable:
+    """
+    All units a FoodProduct can be measured in, each with the conversion to the product's default unit.
+
+    The table is compiled from the product's FoodProductUnits and the unit graph,
+    using the same rules (and order of precedence) as FoodProduct.get_quantity_in_default_unit used to apply per call:
+
+    1. The unit is explicitly defined in a FoodProductUnit.
+    2. The unit is either the product's default unit or a child of the product's default unit.
+    3. The product has an explicitly defined number of grams per ml, and the unit is a volume.
+    4. A constant FoodProductUnit has a unit that is either the parent or shares its parent with the unit.
+    """
+
+    PRODUCT_UNIT_FIELDS = ('product_id', 'unit_id', 'multiplier')
+
+    def __init__(self, product_id, default_unit_id, grams_per_ml, conversions, graph_version, updated_on=None):
+        self.product_id = product_id
+        self.default_unit_id = default_unit_id
+        self.grams_per_ml = grams_per_ml
+        self.conversions = conversions
+        self.graph_version = graph_version
+        self.updated_on = updated_on
+
+    def __contains__(self, unit_id):
+        return unit_id in self.conversions
+
+    def conversion(self, unit_id) -> Conversion:
+        return self.conversions[unit_id]
+
+    # Tables are also stale once the product or its FoodProductUnits changed in another process,
+    # since that touches the updated_on of the product (see models.py).
+    def is_stale(self, product):
+        unit_graph.check()
+        return self.graph_version != unit_graph.version \
+               or self.updated_on != product.updated_on \
+               or self.default_unit_id != product.default_unit_id \
+               or self.grams_per_ml != product.grams_per_ml
+
+    @classmethod
+    def compile(cls, product, product_units, graph=unit_graph):
+        """
+        Compile the table for a product from its FoodProductUnits.
+        product_units are dicts with the keys in PRODUCT_UNIT_FIELDS, ordered by primary key.
+        """
+        graph_version = graph.version
+        default_unit_id = product.default_unit_id
+        conversions = {}
+
+        # 1. Explicitly defined units
+        for product_unit in product_units:
+            unit_id = product_unit['unit_id']
+            if unit_id is not None and unit_id not in conversions:
+                conversions[unit_id] = Conversion(product_unit['multiplier'], 1, 1)
+
+        def add_family(base_unit_id, get_conversion):
+            for unit_id in graph.family(base_unit_id):
+                if unit_id not in conversions and graph.base_unit_id(unit_id) == base_unit_id:
+                    conversions[unit_id] = get_conversion(unit_id)
+
+        # 2. The default unit, and its children
+        if default_unit_id is not None and default_unit_id in graph:
+            add_family(default_unit_id, lambda unit_id: graph.conversion(unit_id, default_unit_id))
+
+        # 3. Volumes, for products with a known number of grams per ml
+        # TODO: We should use volume/mass over a custom base unit. (Products are either defined per 100 ml or per 100 gr.)
+        if product.grams_per_ml != 0 and default_unit_id in graph and graph.unit(default_unit_id)['name'] == 'gram':
+            for milliliter_id in graph.unit_ids_by_name('milliliter'):
+                add_family(milliliter_id,
+                           lambda unit_id: Conversion(graph.conversion(unit_id, milliliter_id).numerator,
+                                                      1,
+                                                      product.grams_per_ml))
+
+        # 4. Units that share their base unit with a constant, explicitly defined unit
+        # The first (by primary key) matching product unit is used for each base unit.
+        shared_base_units = OrderedDict()
+        for product_unit in product_units:
+            unit_id = product_unit['unit_id']
+            if unit_id is None or unit_id not in graph or not graph.unit(unit_id)['is_constant']:
+                continue
+
+            for base_unit_id in (graph.unit(unit_id)['parent_id'], unit_id):
+                if base_unit_id is not None and base_unit_id in graph:
+                    shared_base_units.setdefault(base_unit_id, product_unit)
+
+        for base_unit_id, product_unit in shared_base_units.items():
+            divisor = graph.unit(product_unit['unit_id'])['base_unit_multiplier']
+            add_family(base_unit_id,
+                       lambda unit_id: Conversion(graph.unit(unit_id)['base_unit_multiplier'],
+                                                  divisor,
+                                                  product_unit['multiplier']))
+
+        return cls(product.pk, default_unit_id, product.grams_per_ml, conversions, graph_version, product.updated_on)
+
+    @classmethod
+    def compile_many(cls, products):
+        """
+        Compile the tables for a number of products, using a single query.
+        """
+        from caloriecounter.food.models import FoodProductUnit
+
+        # The products were loaded before their product units, so changes in between make the tables stale.
+        product_units = {product.pk: [] for product in products}
+        for product_unit in FoodProductUnit.objects.filter(product_id__in=list(product_units.keys())) \
+                .order_by('pk').values(*cls.PRODUCT_UNIT_FIELDS):
+            product_units[product_unit['product_id']].append(product_unit)
+
+        return {product.pk: cls.compile(product, product_units[product.pk]) for product in products}
+
+
+class ProductConversionTableCache:
+    """
+    A bounded, least recently used, cache of compiled conversion tables, by product id.
+    """
+
+    def __init__(self, max_size=None):
+        self._lock = threading.Lock()
+        self._tables = OrderedDict()
+        self.max_size = max_size
+
+    def _get_max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+
+        return getattr(settings, 'FOOD_CONVERSION_TABLE_CACHE_SIZE', 10000)
+
+    def _get_cached(self, product):
+        with self._lock:
+            table = self._tables.get(product.pk)
+            if table is None or table.is_stale(product):
+                return None
+
+            self._tables.move_to_end(product.pk)
+            return table
+
+    def _store(self, tables):
+        max_size = self._get_max_size()
+        with self._lock:
+            for product_id, table in tables.items():
+                self._tables[product_id] = table
+                self._tables.move_to_end(product_id)
+
+            while len(self._tables) > max_size:
+                self._tables.popitem(last=False)
+
+    def get(self, product) -> ProductConversionTable:
+        return self.get_many([product])[product.pk]
+
+    def get_many(self, products):
+        """
+        Return the conversion tables for the given products, compiling all missing tables with a single query.
+        """
+        tables = {}
+        missing = {}
+
+        for product in products:
+            if product.pk in tables or product.pk in missing:
+                continue
+
+            table = self._get_cached(product)
+            if table is None:
+                missing[product.pk] = product
+            else:
+                tables[product.pk] = table
+
+        if missing:
+            compiled = ProductConversionTable.compile_many(list(missing.values()))
+            self._store(compiled)
+            tables.update(compiled)
+
+        return tables
+
+    def invalidate(self, product_id):
+        with self._lock:
+            self._tables.pop(product_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+
+# The process-wide conversion table cache.
+conversion_tables = ProductConversionTableCache()
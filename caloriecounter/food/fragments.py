@@ -0,0 +1,124 @@
+import uuid
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def render_fragments(product_ids):
+    """
+    Return the rendered JSON of products in their default representation, by product id.
+    """
+    from caloriecounter.food.api.renderers import ORJSONRenderer
+    from caloriecounter.food.api.serializers import FoodProductSerializer
+    from caloriecounter.food.models import FoodProduct
+
+    serializer = FoodProductSerializer()
+    renderer = ORJSONRenderer()
+
+    products = serializer.prefetch_queryset(FoodProduct.objects.filter(pk__in=list(product_ids)))
+    return {product.pk: renderer.render(serializer.to_representation(product)) for product in products}
+
+
+class ProductFragmentCache:
+    """
+    A cache of the rendered JSON of FoodProducts in their default representation, per product,
+    in the Django cache named by the FOOD_FRAGMENT_CACHE setting.
+
+    Fragments are stored with the version of the nutrient catalog, since every product embeds its nutrients,
+    and are only used while that version is current. The updated_on of its product is part of the key of each
+    fragment, and is touched whenever the product's nutrients, units or common names change (see the receivers
+    in models.py), so a change to a product replaces only its own fragment, whichever process made it
+    (i.e. a catalog import), also when the cache is local to each process. Fragments can be cleared as a whole
+    by replacing the token that is part of every key.
+    """
+
+    def get_cache(self):
+        return caches[getattr(settings, 'FOOD_FRAGMENT_CACHE', 'default')]
+
+    def get_timeout(self):
+        return getattr(settings, 'FOOD_FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)
+
+    def get_token(self):
+        cache = self.get_cache()
+        token = cache.get('food_fragments')
+        if token is None:
+            cache.add('food_fragments', uuid.uuid4().hex, None)
+            token = cache.get('food_fragments')
+
+        return token
+
+    def make_keys(self, updated_on):
+        """
+        Return the cache keys of products by product id, for a {product id: updated on} dict.
+        """
+        token = self.get_token()
+        return {product_id: 'food_fragment:{0}:{1}:{2}'.format(token, product_id, stamp.isoformat())
+                for product_id, stamp in updated_on.items()}
+
+    def get_version(self):
+        from caloriecounter.food.models import CatalogVersion, NUTRIENT_CATALOG
+
+        return CatalogVersion.get_version(NUTRIENT_CATALOG)
+
+    def get_updated_on(self, product_ids):
+        """
+        Return the updated_on of the given products that exist, by product id, with a single query.
+        """
+        from caloriecounter.food.models import FoodProduct
+
+        return dict(FoodProduct.objects.filter(pk__in=product_ids).order_by().values_list('pk', 'updated_on'))
+
+    def get_many(self, product_ids, render=render_fragments):
+        """
+        Return the fragments of the given products, by product id. Missing fragments are rendered, and cached.
+        Products that do not exist are left out.
+        """
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+
+        version = self.get_version()
+        updated_on = self.get_updated_on(product_ids)
+        keys = self.make_keys({product_id: updated_on[product_id] for product_id in product_ids
+                               if product_id in updated_on})
+        cache = self.get_cache()
+
+        fragments = {}
+        cached = cache.get_many(list(keys.values()))
+        for product_id, key in keys.items():
+            if key in cached and cached[key][0] == version:
+                fragments[product_id] = cached[key][1]
+
+        missing = [product_id for product_id in keys if product_id not in fragments]
+        if missing:
+            rendered = render(missing)
+            cache.set_many({keys[product_id]: (version, fragment) for product_id, fragment in rendered.items()},
+                           self.get_timeout())
+            fragments.update(rendered)
+
+        return fragments
+
+    def clear(self):
+        self.get_cache().set('food_fragments', uuid.uuid4().hex, None)
+
+    def warm(self, product_ids, chunk_size=500):
+        """
+        Render and cache the fragments of the given products that are not cached yet, in chunks.
+        Returns the number of products.
+        """
+        count = 0
+        product_ids = iter(product_ids)
+        while True:
+            chunk = list(islice(product_ids, chunk_size))
+            if not chunk:
+                break
+
+            self.get_many(chunk)
+            count += len(chunk)
+
+        return count
+
+
+# The process-wide product fragment cache.
+product_fragments = ProductFragmentCache()
@@ -0,0 +1,56 @@
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+
+def parse_ordering(ordering):
+    """
+    Return an ordering, i.e. ('-date', 'time', 'pk'), as a list of (field name, descending) tuples.
+    """
+    return [(field[1:], True) if field.startswith('-') else (field, False) for field in ordering]
+
+
+def get_position(row, ordering):
+    """
+    Return the values of the ordering fields of a row, which is a model instance or a dict (from .values()).
+    """
+    if isinstance(row, dict):
+        return [row[name] for name, descending in parse_ordering(ordering)]
+
+    return [getattr(row, name) for name, descending in parse_ordering(ordering)]
+
+
+def keyset_filter(queryset, ordering, position, reverse=False):
+    """
+    Filter a queryset on the rows that come after a position (or, when reversed, before it) in the given ordering.
+
+    For an ordering (a, -b, pk) and a position (x, y, z) this is a > x OR (a = x AND b < y) OR (a = x AND b = y AND pk > z),
+    which the database can answer with an index on (a, -b, pk), without counting or skipping rows.
+    All ordering fields must be non-null, and the last one must be unique.
+    """
+    fields = parse_ordering(ordering)
+    if len(position) != len(fields):
+        raise ValueError('A position needs a value for every ordering field.')
+
+    conditions = []
+    for index, (name, descending) in enumerate(fields):
+        lookup = 'lt' if descending != reverse else 'gt'
+        equal = {fields[previous][0]: position[previous] for previous in range(index)}
+        conditions.append(Q(**equal, **{'{0}__{1}'.format(name, lookup): position[index]}))
+
+    return queryset.filter(reduce(or_, conditions))
+
+
+def get_keyset_page(queryset, ordering, position=None, reverse=False, page_size=20):
+    """
+    Return a page of rows that come after a position (or, when reversed, before it, in reverse order).
+    One more row than the page size is returned, to tell whether there is another page.
+    """
+    if position is not None:
+        queryset = keyset_filter(queryset, ordering, position, reverse)
+
+    if reverse:
+        ordering = ['{0}{1}'.format('' if descending else '-', name) for name, descending in parse_ordering(ordering)]
+
+    return list(queryset.order_by(*ordering)[:page_size + 1])
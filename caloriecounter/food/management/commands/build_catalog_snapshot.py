@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from caloriecounter.food.snapshot import write_catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes a compressed snapshot of the full food catalog, to be downloaded by clients for offline use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='The directory to write the snapshot to. '
+                                                'Defaults to the FOOD_CATALOG_SNAPSHOT_DIR setting.')
+
+    def handle(self, *args, **options):
+        path = write_catalog_snapshot(options['directory'])
+
+        self.stdout.write(self.style.SUCCESS('Wrote catalog snapshot to {0}.'.format(path)))
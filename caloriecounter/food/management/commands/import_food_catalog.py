@@ -0,0 +1,97 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from caloriecounter.food.catalog_import import CatalogImporter, iter_json_array
+
+
+class Command(BaseCommand):
+    help = 'Imports the food catalog from a (large) fixture, i.e. fixtures/food.json. ' \
+           'The fixture is read incrementally, and imported in batches, ' \
+           'with a checkpoint after every batch, so an interrupted import can be resumed with --resume. ' \
+           'Existing rows are updated, so an import can be repeated to apply a newer version of the fixture.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='The path of the fixture to import.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='The number of rows per batch.')
+        parser.add_argument('--checkpoint', help='The path of the checkpoint file. '
+                                                 'Defaults to the path of the fixture, with .checkpoint appended.')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows imported before the checkpoint.')
+
+    # Returns the number of rows imported before the checkpoint, and the rows that were deferred (see CatalogImporter).
+    def read_checkpoint(self, path, source):
+        if not os.path.exists(path):
+            return 0, []
+
+        with open(path) as file:
+            checkpoint = json.load(file)
+
+        if checkpoint.get('source') != os.path.abspath(source):
+            raise CommandError('The checkpoint {0} belongs to another fixture.'.format(path))
+
+        return checkpoint['rows'], checkpoint.get('deferred', [])
+
+    def write_checkpoint(self, path, source, rows, deferred):
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'source': os.path.abspath(source), 'rows': rows, 'deferred': deferred}, file)
+        os.replace(path + '.tmp', path)
+
+    def write_errors(self, errors):
+        for row, error in errors:
+            if isinstance(row, dict):
+                self.stderr.write('Skipped {0} {1}: {2}'.format(row.get('model'), row.get('pk'), error))
+            else:
+                self.stderr.write('Skipped {0!r}: {1}'.format(row, error))
+
+    def handle(self, *args, **options):
+        source = options['source']
+        checkpoint = options['checkpoint'] or source + '.checkpoint'
+
+        if not os.path.exists(source):
+            raise CommandError('The fixture {0} does not exist.'.format(source))
+
+        skip, deferred = self.read_checkpoint(checkpoint, source) if options['resume'] else (0, [])
+        importer = CatalogImporter(batch_size=options['batch_size'], deferred=deferred)
+
+        processed = skip
+        imported = 0
+        invalid = 0
+        started_on = time.time()
+
+        with open(source, encoding='utf-8') as file:
+            rows = islice(iter_json_array(file), skip, None)
+            if skip:
+                self.stdout.write('Resuming after {0} rows.'.format(skip))
+
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+
+                count, errors = importer.import_batch(batch)
+                processed += len(batch)
+                imported += count
+                invalid += len(errors)
+
+                self.write_errors(errors)
+
+                # The checkpoint is only written once the batch has been committed.
+                self.write_checkpoint(checkpoint, source, processed, importer.deferred)
+
+                if options['verbosity'] >= 1:
+                    self.stdout.write('Processed {0} rows, {1} imported or updated, {2} skipped ({3:.0f} rows/s).'.format(
+                        processed, imported, invalid, (processed - skip) / max(time.time() - started_on, 0.001)))
+
+        count, errors = importer.finish()
+        imported += count
+        invalid += len(errors)
+        self.write_errors(errors)
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported or updated {0} rows, skipped {1} invalid rows.'.format(imported, invalid)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from caloriecounter.food.fragments import product_fragments
+from caloriecounter.food.models import FoodProduct
+
+
+class Command(BaseCommand):
+    help = 'Renders and caches the fragments of all products that are not cached yet. ' \
+           'Run this on deploy, with a cache that is shared between processes (see FOOD_FRAGMENT_CACHE).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='The number of products that are rendered at once.')
+
+    def handle(self, *args, **options):
+        product_ids = FoodProduct.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        count = product_fragments.warm(product_ids, chunk_size=options['chunk_size'])
+
+        self.stdout.write(self.style.SUCCESS('Cached the fragments of {0} products.'.format(count)))
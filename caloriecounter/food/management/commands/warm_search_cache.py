@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from rest_framework.settings import api_settings
+
+from caloriecounter.food.search_cache import search_query_log, warm_search_results
+
+
+class Command(BaseCommand):
+    help = 'Fills the food search result cache with the first page of the most popular searches. ' \
+           'Run this on deploy, with a cache that is shared between processes (see FOOD_SEARCH_CACHE). ' \
+           'A cache that is local to each process is warmed by every worker when it starts (see gunicorn.conf.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100, help='The number of popular searches to cache.')
+        parser.add_argument('--page-size', type=int, default=api_settings.PAGE_SIZE,
+                            help='The page size of the cached results.')
+
+    def handle(self, *args, **options):
+        search_query_log.flush()
+
+        count = warm_search_results(options['top'], options['page_size'])
+
+        self.stdout.write(self.style.SUCCESS('Cached the results of {0} searches.'.format(count)))
@@ -0,0 +1,15 @@
+from caloriecounter.food.request_cache import request_cache
+
+
+class RequestCacheMiddleware:
+    """
+    Opens a request cache scope (see request_cache.py) for every request,
+    so products, units and conversions are only resolved once per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_cache.scope():
+            return self.get_response(request)
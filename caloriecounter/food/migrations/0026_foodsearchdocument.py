@@ -0,0 +1,45 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:19
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0025_auto_20200617_2217'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='FoodSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='food.FoodProduct', verbose_name='product')),
+                ('document', models.TextField(verbose_name='search document')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='foodsearchdocument',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['document'], name='food_search_document_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        # Fill the search documents for all existing products, in the same format as get_search_document.
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO food_foodsearchdocument (product_id, document)
+                SELECT product.id,
+                       concat_ws(E'\\n',
+                                 NULLIF(product.full_name, ''),
+                                 NULLIF(product.display_name, ''),
+                                 NULLIF(string_agg(concat_ws(E'\\n', NULLIF(common_name.text, ''),
+                                                             NULLIF(common_name.text_plural, '')),
+                                                   E'\\n' ORDER BY common_name.id), ''))
+                FROM food_foodproduct product
+                LEFT JOIN food_foodproductcommonname common_name ON common_name.food_product_id = product.id
+                GROUP BY product.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0026_foodsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='name')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='version')),
+                ('updated_on', models.DateTimeField(auto_now=True, verbose_name='updated on')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FoodSearchQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terms', models.CharField(max_length=255, unique=True, verbose_name='search terms')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='count')),
+                ('last_searched_on', models.DateTimeField(auto_now=True, verbose_name='last searched on')),
+            ],
+        ),
+    ]
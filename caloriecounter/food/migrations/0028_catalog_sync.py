@@ -0,0 +1,46 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0027_catalogversion_foodsearchquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=255, verbose_name='table')),
+                ('object_id', models.IntegerField(verbose_name='object id')),
+                ('deleted_on', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='deleted on')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='foodproduct',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated on'),
+        ),
+        migrations.AddField(
+            model_name='foodproductcommonname',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated on'),
+        ),
+        migrations.AddField(
+            model_name='foodproductnutrient',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated on'),
+        ),
+        migrations.AddField(
+            model_name='foodproductunit',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated on'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogtombstone',
+            index=models.Index(fields=['table', 'deleted_on'], name='food_catalo_table_f202fe_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.4 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0028_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='foodproduct',
+            name='food_foodpr_full_na_8df215_idx',
+        ),
+        migrations.AddIndex(
+            model_name='foodproduct',
+            index=models.Index(fields=['full_name', 'id'], name='food_foodpr_full_na_e850ea_idx'),
+        ),
+    ]
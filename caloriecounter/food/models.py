@@ -1,12 +1,29 @@
+from functools import partial
+
 from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from caloriecounter.food.autocomplete import autocomplete_index
+from caloriecounter.food.catalog_import import rows_imported
+from caloriecounter.food.catalog_versions import CATALOGS, FOOD_PRODUCT_CATALOG, FOOD_GROUP_CATALOG, \
+    NUTRIENT_CATALOG, UNIT_CATALOG, catalog_versions
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.request_cache import request_cache
+from caloriecounter.food.search import get_search_document
+from caloriecounter.food.unit_graph import unit_graph
+from caloriecounter.food.validation import validate_on_save
+
+
 
 # Units like g, ml etc.
+@validate_on_save
 class Unit(models.Model):
     class Meta:
         ordering = ['-is_base', '-is_constant', 'base_unit_multiplier']
@@ -52,29 +69,34 @@ class Unit(models.Model):
 
         return self.base_unit_multiplier * quantity
 
+    # Conversions are looked up in the process-wide unit graph,
+    # which also converts between units that are more than one parent apart.
     def convert_to_unit(self, quantity, unit):
         if unit == self:
             return quantity
 
-        if unit == self.parent:
-            return quantity * self.base_unit_multiplier
+        return unit_graph.convert(quantity, self.pk, unit.pk)
 
-        if self == unit.parent:
-            return quantity / unit.base_unit_multiplier
+    @property
+    def base_unit_id(self):
+        if self.pk is not None and self.pk in unit_graph:
+            return unit_graph.base_unit_id(self.pk)
 
-        if self.parent == unit.parent and self.parent is not None:
-            return (quantity * self.base_unit_multiplier) / unit.base_unit_multiplier
+        if self.is_base or not self.parent_id:
+            return self.pk
 
-        raise ValueError('Tried to convert two unrelated units.')
+        return self.parent_id
 
     @property
     def base_unit(self):
-        if self.is_base:
+        base_unit_id = self.base_unit_id
+
+        if base_unit_id == self.pk:
             return self
-        elif self.parent:
+        elif base_unit_id == self.parent_id:
             return self.parent
 
-        return self
+        return Unit.objects.get(pk=base_unit_id)
 
     @property
     def name_plural(self):
@@ -108,6 +130,7 @@ class Unit(models.Model):
 
 
 # Foodgroups like Dairy, Poultry etc.
+@validate_on_save
 class FoodGroup(models.Model):
     class Meta:
         ordering = ['name']
@@ -119,10 +142,12 @@ class FoodGroup(models.Model):
 
 
 # Foodproducts like broccoli, butter, etc.
+@validate_on_save
 class FoodProduct(models.Model):
     class Meta:
         indexes = [
-            models.Index(fields=['full_name']),
+            # Covers the keyset pagination of products, see FoodProductPagination.
+            models.Index(fields=['full_name', 'id']),
             GinIndex(fields=['full_name']),
             models.Index(fields=['food_source'])
         ]
@@ -162,38 +187,34 @@ class FoodProduct(models.Model):
 
     units = models.ManyToManyField(verbose_name=_('units'), to=Unit, through='FoodProductUnit', related_name='products')
 
+    updated_on = models.DateTimeField(verbose_name=_('updated on'), auto_now=True, db_index=True)
+
     # Converts a quantity of a random unit to a quantity of the default unit, if possible.
+    # All conversions for a product are compiled once into a ProductConversionTable, see conversions.py,
+    # and each conversion is looked up once per request (see request_cache.py).
     def get_quantity_in_default_unit(self, quantity, unit: Unit = None):
-        # 1. Unit is None:
         if unit is None:
             return quantity * self.default_quantity
 
-        # 2. Current unit is explicitly defined in the food_product_unit
-        food_product_unit = FoodProductUnit.objects.filter(product=self, unit=unit).first()
-
-        if food_product_unit is not None:
-            return food_product_unit.multiplier * quantity
+        if self.pk is None or unit.pk is None:
+            return self.get_conversion(unit).apply(quantity)
 
-        # 3. Current unit is either the product's default unit or a child of the product's unit
-        if unit.base_unit == self.default_unit:
-            return unit.convert_to_base(quantity)
+        key = ('conversion', self.pk, self.default_unit_id, self.grams_per_ml, unit.pk)
+        return request_cache.memoize(key, lambda: self.get_conversion(unit)).apply(quantity)
 
-        # 4. food_product has an explicitly defined number of grams per ml
-        # TODO: We should use volume/mass over a custom base unit. (Products are either defined per 100 ml or per 100 gr.)
-        if self.grams_per_ml != 0:
-            if self.default_unit.name == 'gram' and unit.base_unit.name == 'milliliter':
-                return unit.convert_to_base(quantity) * self.grams_per_ml
+    # Returns the Conversion of a unit to the default unit of this product, or raises a ValueError.
+    def get_conversion(self, unit: Unit):
+        table = conversion_tables.get(self)
 
-        # 5. food_product_unit has a unit that is either the parent or a unit with a shared parent to current unit.
-        food_product_unit = FoodProductUnit.objects.filter(product=self, unit__is_constant=True) \
-            .filter(Q(unit__parent=unit.base_unit) | Q(unit=unit.base_unit)) \
-            .first()
+        # The unit was created after the unit graph was built (possibly in another process).
+        if unit.pk not in table and unit.pk not in unit_graph:
+            unit_graph.invalidate()
+            table = conversion_tables.get(self)
 
-        if food_product_unit is not None:
-            return ((unit.base_unit_multiplier * quantity) / food_product_unit.unit.base_unit_multiplier) \
-                   * food_product_unit.multiplier
+        if unit.pk not in table:
+            raise ValueError('Unit "{0}" is not a valid unit for product "{1}"'.format(unit, self))
 
-        raise ValueError('Unit "{0}" is not a valid unit for product "{1}"'.format(unit, self))
+        return table.conversion(unit.pk)
 
     def __str__(self):
         if self.display_name and not self.display_name == '':
@@ -203,6 +224,7 @@ class FoodProduct(models.Model):
 
 
 # Nutrients like Energy, Protein etc.
+@validate_on_save
 class Nutrient(models.Model):
     class Meta:
         ordering = ['-rank']
@@ -219,6 +241,7 @@ class Nutrient(models.Model):
 
 
 # Through model for nutrients per food product, containing the quantity.
+@validate_on_save
 class FoodProductNutrient(models.Model):
     class Meta:
         unique_together = [('product', 'nutrient'), ]
@@ -233,12 +256,15 @@ class FoodProductNutrient(models.Model):
 
     quantity = models.FloatField(verbose_name=_('quantity'), validators=[MinValueValidator(0), ])
 
+    updated_on = models.DateTimeField(verbose_name=_('updated on'), auto_now=True, db_index=True)
+
     def __str__(self):
         return '{0} {1} per 100 {2} of {3}'.format(self.quantity, self.nutrient, self.product.default_unit,
                                                    self.product)
 
 
 # Through model for nutrients per food product, containing the quantity,
+@validate_on_save
 class FoodProductUnit(models.Model):
     class Meta:
         pass
@@ -264,6 +290,8 @@ class FoodProductUnit(models.Model):
 
     modifier = models.CharField(verbose_name=_('Portion modifier'), max_length=255, null=True, blank=True)
 
+    updated_on = models.DateTimeField(verbose_name=_('updated on'), auto_now=True, db_index=True)
+
     def __str__(self):
         unit_name = ', '.join([str(name) for name in [self.unit, self.description, self.modifier] if name is not None])
         return '{0} of {3} ({4} {5})'.format(unit_name, self.description, self.modifier, self.product, self.multiplier, self.product.default_unit)
@@ -309,6 +337,7 @@ class FoodProductUnit(models.Model):
         super(FoodProductUnit, self).clean(*args, **kwargs)
 
 
+@validate_on_save
 class FoodProductCommonName(models.Model):
     class Meta:
         indexes = [
@@ -320,3 +349,278 @@ class FoodProductCommonName(models.Model):
 
     food_product = models.ForeignKey(verbose_name=_('Food product'), to=FoodProduct,
                                      related_name='common_names', on_delete=models.CASCADE)
+
+    updated_on = models.DateTimeField(verbose_name=_('updated on'), auto_now=True, db_index=True)
+
+
+# A denormalized document with all names of a FoodProduct, used for trigram search.
+# Keeping all names in one row (with one trigram index) lets a search use the index,
+# and return each product once, instead of joining and scanning all common names.
+class FoodSearchDocument(models.Model):
+    class Meta:
+        indexes = [
+            GinIndex(fields=['document'], name='food_search_document_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+    product = models.OneToOneField(verbose_name=_('product'), to=FoodProduct, primary_key=True,
+                                   related_name='search_document', on_delete=models.CASCADE)
+
+    document = models.TextField(verbose_name=_('search document'))
+
+    @classmethod
+    def update_for_product(cls, product: FoodProduct):
+        common_names = FoodProductCommonName.objects.filter(food_product=product) \
+            .order_by('pk').values_list('text', 'text_plural')
+
+        cls.objects.update_or_create(product=product, defaults={
+            'document': get_search_document(product.full_name, product.display_name, common_names)
+        })
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Rebuild the search documents of all products in a single query, i.e. after a bulk import.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO food_foodsearchdocument (product_id, document)
+                SELECT product.id,
+                       concat_ws(E'\\n',
+                                 NULLIF(product.full_name, ''),
+                                 NULLIF(product.display_name, ''),
+                                 NULLIF(string_agg(concat_ws(E'\\n', NULLIF(common_name.text, ''),
+                                                             NULLIF(common_name.text_plural, '')),
+                                                   E'\\n' ORDER BY common_name.id), ''))
+                FROM food_foodproduct product
+                LEFT JOIN food_foodproductcommonname common_name ON common_name.food_product_id = product.id
+                GROUP BY product.id
+                ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document
+            """)
+
+    def __str__(self):
+        return self.document
+
+
+class CatalogVersion(models.Model):
+    """
+    A counter that is incremented whenever (a part of) the food catalog changes, so anything derived
+    from the catalog, i.e. cached search results, can be keyed on its version.
+    """
+    name = models.CharField(verbose_name=_('name'), max_length=255, unique=True)
+    version = models.PositiveIntegerField(verbose_name=_('version'), default=0)
+    updated_on = models.DateTimeField(verbose_name=_('updated on'), auto_now=True)
+
+    @classmethod
+    def get_version(cls, name) -> int:
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def get_versions(cls, names):
+        """
+        Return a {name: (version, updated on)} dict, with (0, None) for catalogs that have never changed.
+        """
+        versions = {name: (0, None) for name in names}
+        for name, version, updated_on in cls.objects.filter(name__in=names) \
+                .values_list('name', 'version', 'updated_on'):
+            versions[name] = (version, updated_on)
+
+        return versions
+
+    @classmethod
+    def bump(cls, name) -> int:
+        """
+        Increment the version of a catalog, and return the new version.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(version=F('version') + 1, updated_on=timezone.now()):
+                version, created = cls.objects.get_or_create(name=name, defaults={'version': 1})
+                if created:
+                    return 1
+                cls.objects.filter(name=name).update(version=F('version') + 1, updated_on=timezone.now())
+
+            # The row is locked by the update until the transaction is committed, so this is the version it produced.
+            return cls.objects.filter(name=name).values_list('version', flat=True).get()
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.name, self.version)
+
+
+class CatalogTombstone(models.Model):
+    """
+    Records the deletion of a row of the food catalog, so clients that synchronize the catalog can delete it too.
+    """
+    class Meta:
+        indexes = [
+            models.Index(fields=['table', 'deleted_on']),
+        ]
+
+    table = models.CharField(verbose_name=_('table'), max_length=255)
+    object_id = models.IntegerField(verbose_name=_('object id'))
+    deleted_on = models.DateTimeField(verbose_name=_('deleted on'), auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return '{0} {1}'.format(self.table, self.object_id)
+
+
+class FoodSearchQuery(models.Model):
+    """
+    The number of times a (normalized) search has been made, to find the most popular searches.
+    """
+    terms = models.CharField(verbose_name=_('search terms'), max_length=255, unique=True)
+    count = models.PositiveIntegerField(verbose_name=_('count'), default=0)
+    last_searched_on = models.DateTimeField(verbose_name=_('last searched on'), auto_now=True)
+
+    def __str__(self):
+        return self.terms
+
+
+# The unit graph is rebuilt on its next use after any unit changes.
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def invalidate_unit_graph(sender, **kwargs):
+    unit_graph.invalidate()
+
+
+# A product's conversion table is compiled again on its next use after the product or its units change.
+@receiver(post_save, sender=FoodProduct)
+@receiver(post_delete, sender=FoodProduct)
+def invalidate_product_conversion_table(sender, instance, **kwargs):
+    conversion_tables.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=FoodProductUnit)
+@receiver(post_delete, sender=FoodProductUnit)
+def invalidate_product_unit_conversion_table(sender, instance, **kwargs):
+    conversion_tables.invalidate(instance.product_id)
+
+
+# Search documents are kept in sync with the names of their product.
+@receiver(post_save, sender=FoodProduct)
+def update_product_search_document(sender, instance, **kwargs):
+    FoodSearchDocument.update_for_product(instance)
+
+
+@receiver(post_save, sender=FoodProductCommonName)
+def update_common_name_search_document(sender, instance, **kwargs):
+    FoodSearchDocument.update_for_product(instance.food_product)
+
+
+# On deletion, the document is only updated if it still exists, since the product itself might be deleted as well.
+@receiver(post_delete, sender=FoodProductCommonName)
+def delete_common_name_search_document(sender, instance, **kwargs):
+    if FoodSearchDocument.objects.filter(product_id=instance.food_product_id).exists():
+        FoodSearchDocument.update_for_product(FoodProduct.objects.get(pk=instance.food_product_id))
+
+
+# The autocomplete index is updated per product, once it has been built.
+@receiver(post_save, sender=FoodProduct)
+def update_product_autocomplete_index(sender, instance, **kwargs):
+    autocomplete_index.update_product(instance.pk)
+
+
+@receiver(post_delete, sender=FoodProduct)
+def remove_product_autocomplete_index(sender, instance, **kwargs):
+    autocomplete_index.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=FoodProductCommonName)
+@receiver(post_delete, sender=FoodProductCommonName)
+def update_common_name_autocomplete_index(sender, instance, **kwargs):
+    autocomplete_index.update_product(instance.food_product_id)
+
+
+# The updated_on of a product is touched whenever anything it embeds changes, so it stamps the product as a whole,
+# i.e. for its rendered fragment (see fragments.py) and its conversion table (see conversions.py).
+def touch_products(product_ids):
+    updated_on = timezone.now()
+    FoodProduct.objects.filter(pk__in=list(product_ids)).update(updated_on=updated_on)
+    return updated_on
+
+
+# The product instance that a nutrient, unit or common name holds (if any) is touched as well.
+def touch_related_product(instance, field_name):
+    field = instance._meta.get_field(field_name)
+    updated_on = touch_products([getattr(instance, field.attname)])
+    if field.is_cached(instance) and field.get_cached_value(instance) is not None:
+        field.get_cached_value(instance).updated_on = updated_on
+
+
+@receiver(post_save, sender=FoodProductNutrient)
+@receiver(post_delete, sender=FoodProductNutrient)
+@receiver(post_save, sender=FoodProductUnit)
+@receiver(post_delete, sender=FoodProductUnit)
+def touch_relation_product(sender, instance, **kwargs):
+    touch_related_product(instance, 'product')
+
+
+@receiver(post_save, sender=FoodProductCommonName)
+@receiver(post_delete, sender=FoodProductCommonName)
+def touch_common_name_product(sender, instance, **kwargs):
+    touch_related_product(instance, 'food_product')
+
+
+# A catalog import writes its rows without sending post_save, see catalog_import.py.
+@receiver(rows_imported)
+def touch_imported_products(sender, instances, **kwargs):
+    if sender in (FoodProductNutrient, FoodProductUnit):
+        touch_products({instance.product_id for instance in instances})
+    elif sender is FoodProductCommonName:
+        touch_products({instance.food_product_id for instance in instances})
+
+
+def bump_version(name):
+    # The in-memory structures of this process are already updated, so they skip the version it produced.
+    catalog_versions.record_bump(name, CatalogVersion.bump(name))
+
+
+# The version of a catalog is bumped once the transaction that changed it is committed, and only once per transaction,
+# so concurrent changes to the catalog do not wait for each other's lock on its CatalogVersion row.
+CATALOG_VERSION_BUMPS = {name: partial(bump_version, name) for name in CATALOGS}
+
+
+def bump_version_on_commit(name):
+    bump = CATALOG_VERSION_BUMPS[name]
+    if any(callback[1] is bump for callback in transaction.get_connection().run_on_commit):
+        return
+
+    transaction.on_commit(bump)
+
+
+# Cached search results and responses are keyed on the version of the part of the catalog they contain.
+@receiver(post_save, sender=FoodProduct)
+@receiver(post_delete, sender=FoodProduct)
+@receiver(post_save, sender=FoodProductCommonName)
+@receiver(post_delete, sender=FoodProductCommonName)
+@receiver(post_save, sender=FoodProductNutrient)
+@receiver(post_delete, sender=FoodProductNutrient)
+@receiver(post_save, sender=FoodProductUnit)
+@receiver(post_delete, sender=FoodProductUnit)
+def bump_food_product_version(sender, **kwargs):
+    bump_version_on_commit(FOOD_PRODUCT_CATALOG)
+
+
+@receiver(post_save, sender=FoodGroup)
+@receiver(post_delete, sender=FoodGroup)
+def bump_food_group_version(sender, **kwargs):
+    bump_version_on_commit(FOOD_GROUP_CATALOG)
+
+
+@receiver(post_save, sender=Nutrient)
+@receiver(post_delete, sender=Nutrient)
+def bump_nutrient_version(sender, **kwargs):
+    bump_version_on_commit(NUTRIENT_CATALOG)
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def bump_unit_version(sender, **kwargs):
+    bump_version_on_commit(UNIT_CATALOG)
+
+
+# Deleted rows of synchronized tables are recorded, see snapshot.py.
+@receiver(post_delete, sender=FoodProduct)
+@receiver(post_delete, sender=FoodProductNutrient)
+@receiver(post_delete, sender=FoodProductUnit)
+@receiver(post_delete, sender=FoodProductCommonName)
+def create_catalog_tombstone(sender, instance, **kwargs):
+    CatalogTombstone.objects.create(table=sender._meta.model_name, object_id=instance.pk)
@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+
+from django.core.exceptions import ValidationError
+
+
+class RequestCache:
+    """
+    A request-scoped identity map and memo.
+
+    Within a scope (one per request, see RequestCacheMiddleware), every FoodProduct, Unit or FoodProductUnit
+    that is looked up by primary key is loaded once, and the same instance is returned to every later lookup.
+    Derived results, like unit conversions, are memoized by key for the rest of the request.
+
+    Outside of a scope (i.e. in management commands) nothing is cached, so long running processes never see
+    stale instances. Scopes are thread (or, with gevent, greenlet) local.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _get_scope(self):
+        return getattr(self._local, 'scope', None)
+
+    @property
+    def active(self):
+        return self._get_scope() is not None
+
+    @contextmanager
+    def scope(self):
+        """
+        Cache lookups within this block. Nested scopes share the outermost scope.
+        """
+        if self.active:
+            yield
+            return
+
+        self._local.scope = {'instances': {}, 'memo': {}}
+        try:
+            yield
+        finally:
+            self._local.scope = None
+
+    def clear(self):
+        scope = self._get_scope()
+        if scope is not None:
+            scope['instances'].clear()
+            scope['memo'].clear()
+
+    def add(self, *instances):
+        """
+        Add already loaded instances (i.e. with their relations prefetched) to the identity map.
+        Instances of the same model and primary key that are already in the map are kept.
+        """
+        scope = self._get_scope()
+        if scope is None:
+            return
+
+        for instance in instances:
+            if instance is not None and instance.pk is not None:
+                scope['instances'].setdefault((instance._meta.label_lower, instance.pk), instance)
+
+    def get_instance(self, queryset, pk):
+        """
+        Return the instance with the given primary key from a queryset (or model),
+        from the identity map if it has been loaded before within this scope.
+        Raises the model's DoesNotExist exception (or a TypeError/ValueError) like queryset.get would.
+        """
+        if not hasattr(queryset, 'query'):
+            queryset = queryset._default_manager.all()
+
+        scope = self._get_scope()
+
+        # A filtered queryset might not contain an instance that is in the map.
+        if scope is None or queryset.query.where:
+            return queryset.get(pk=pk)
+
+        model = queryset.model
+        try:
+            key = (model._meta.label_lower, model._meta.pk.to_python(pk))
+        except ValidationError:
+            return queryset.get(pk=pk)
+
+        instance = scope['instances'].get(key)
+        if instance is None:
+            instance = queryset.get(pk=pk)
+            scope['instances'][key] = instance
+
+        return instance
+
+    def get_related(self, instance, field_name):
+        """
+        Return the object a foreign key of an instance refers to (or None), through the identity map.
+        """
+        field = instance._meta.get_field(field_name)
+        if field.is_cached(instance):
+            return field.get_cached_value(instance)
+
+        value = getattr(instance, field.attname)
+        if value is None:
+            return None
+
+        if not self.active:
+            return getattr(instance, field_name)
+
+        related = self.get_instance(field.remote_field.model, value)
+        field.set_cached_value(instance, related)
+        return related
+
+    def memoize(self, key, compute):
+        """
+        Return the result of compute() for a key, computing it only once within this scope.
+        Exceptions are not memoized.
+        """
+        scope = self._get_scope()
+        if scope is None:
+            return compute()
+
+        memo = scope['memo']
+        if key not in memo:
+            memo[key] = compute()
+
+        return memo[key]
+
+
+# The process-wide request cache, see RequestCacheMiddleware.
+request_cache = RequestCache()
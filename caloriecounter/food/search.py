@@ -0,0 +1,104 @@
+from django.contrib.postgres.lookups import PostgresSimpleLookup
+from django.contrib.postgres.search import TrigramDistance
+from django.db.backends.signals import connection_created
+from django.db.models import FloatField, Func, OuterRef, Subquery, TextField, Value
+from django.dispatch import receiver
+
+from caloriecounter.food.keyset import get_keyset_page
+
+
+# Search results are ordered, and paginated, by distance, with the pk as tiebreaker.
+SEARCH_ORDERING = ('distance', 'pk')
+
+
+# Postgres' pg_trgm word similarity, see https://www.postgresql.org/docs/current/pgtrgm.html
+# Unlike plain similarity, word similarity compares a search term to the best matching part of a (longer) text,
+# so a term can match any single name in a search document that holds all names of a product.
+class TrigramWordSimilar(PostgresSimpleLookup):
+    """
+    Filters on the word similarity of a search term to a text being above pg_trgm.word_similarity_threshold
+    (see WORD_SIMILARITY_THRESHOLD). This lookup can use a GIN index with the gin_trgm_ops operator class.
+    """
+    lookup_name = 'trigram_word_similar'
+    operator = '%%>'
+
+
+TextField.register_lookup(TrigramWordSimilar)
+
+
+# Products match a search with a word similarity of at least 0.3, like the trigram distance of at most 0.7
+# that products were searched with before, instead of pg_trgm's default threshold of 0.6.
+WORD_SIMILARITY_THRESHOLD = 0.3
+
+
+@receiver(connection_created)
+def set_word_similarity_threshold(sender, connection, **kwargs):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET pg_trgm.word_similarity_threshold = %s', [WORD_SIMILARITY_THRESHOLD])
+
+
+class TrigramWordDistance(Func):
+    """
+    The word distance (1 - word similarity) of a search term to a text.
+
+    pg_trgm returns a real, which is cast to double precision, so the distance that is returned (and put in
+    pagination cursors) is exactly the value that the database compares to, see keyset.py.
+    """
+    template = '(%(expressions)s)::double precision'
+    arg_joiner = ' <<-> '
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, output_field=FloatField(), **extra)
+
+
+def get_search_document(full_name, display_name, common_names):
+    """
+    Return the search document of a product: its full name, display name, and all its common names and plurals,
+    each on a separate line.
+    common_names is a list of (text, text_plural) tuples.
+    """
+    names = [full_name, display_name]
+    for text, text_plural in common_names:
+        names.extend([text, text_plural])
+
+    return '\n'.join(name for name in names if name)
+
+
+def search_food_products(queryset, search_terms):
+    """
+    Filter and order FoodProducts by the trigram word distance of their search document to the search terms.
+
+    Candidates are selected with the word similarity operator, which uses the trigram index on the search document.
+    Only these candidates are re-ranked by distance, and annotated with the pk of their closest common name.
+    """
+    from caloriecounter.food.models import FoodProductCommonName
+
+    search_term = ' '.join(search_terms)
+
+    common_names = FoodProductCommonName.objects.filter(food_product=OuterRef('pk')) \
+        .annotate(distance=TrigramDistance('text', search_term)) \
+        .filter(distance__lte=0.7) \
+        .order_by('distance', 'pk') \
+        .values('pk')[:1]
+
+    return queryset.filter(search_document__document__trigram_word_similar=search_term) \
+        .annotate(distance=TrigramWordDistance(search_term, 'search_document__document')) \
+        .annotate(common_name=Subquery(common_names)) \
+        .order_by(*SEARCH_ORDERING)
+
+
+def get_search_page(search_terms, cursor, page_size):
+    """
+    Return a page of the FoodProducts matching the search terms, as {pk, common_name, distance} dicts,
+    that starts after (or, when reversed, ends before) the (position, reverse) of a cursor, see get_keyset_page.
+    Matches are not counted, so a page costs the same no matter how many products match.
+    """
+    from caloriecounter.food.models import FoodProduct
+
+    position, reverse = cursor or (None, False)
+    queryset = search_food_products(FoodProduct.objects.all(), search_terms).values('pk', 'common_name', 'distance')
+
+    return get_keyset_page(queryset, SEARCH_ORDERING, position, reverse, page_size)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from caloriecounter.food.search import get_search_page
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_search_terms(search_terms):
+    """
+    Return the search terms as a tuple of lowercase terms, so equal searches share their cached results.
+    """
+    return tuple(term.lower() for term in search_terms if term)
+
+
+class SearchResultCache:
+    """
+    A cache of food search result pages, stored in the Django cache named by the FOOD_SEARCH_CACHE setting.
+    Its size is bounded by that cache, i.e. by the MAX_ENTRIES of a local memory cache,
+    which evicts the least recently used entries first.
+
+    Results are keyed on the version of the food catalog, the normalized search terms and the page cursor,
+    so any change to the products or their names invalidates all cached results.
+
+    A result is fresh for FOOD_SEARCH_CACHE_TTL seconds, after which it is stale for another
+    FOOD_SEARCH_CACHE_STALE_TTL seconds. A stale result is still returned, while it is refreshed in the background.
+    """
+
+    # Refreshes run in a background thread. This can be disabled (i.e. in tests) to refresh within the request.
+    refresh_in_background = True
+
+    def get_cache(self):
+        return caches[getattr(settings, 'FOOD_SEARCH_CACHE', 'default')]
+
+    def get_ttl(self):
+        return getattr(settings, 'FOOD_SEARCH_CACHE_TTL', 300)
+
+    def get_stale_ttl(self):
+        return getattr(settings, 'FOOD_SEARCH_CACHE_STALE_TTL', 3600)
+
+    def clear(self):
+        self.get_cache().clear()
+
+    def make_key(self, version, search_terms, cursor, page_size):
+        # Search terms and cursors are hashed, since cache backends like memcached do not allow spaces and long keys.
+        terms = hashlib.md5('\n'.join(normalize_search_terms(search_terms)).encode('utf-8')).hexdigest()
+        page = hashlib.md5(json.dumps(cursor).encode('utf-8')).hexdigest() if cursor is not None else 'first'
+        return 'food_search:{0}:{1}:{2}:{3}'.format(version, page_size, page, terms)
+
+    def set(self, key, value):
+        ttl = self.get_ttl()
+        self.get_cache().set(key, (time.time() + ttl, value), ttl + self.get_stale_ttl())
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for a key, or compute and store it when there is none.
+        """
+        entry = self.get_cache().get(key)
+        if entry is None:
+            value = compute()
+            self.set(key, value)
+            return value
+
+        fresh_until, value = entry
+        if fresh_until <= time.time():
+            self.refresh(key, compute)
+
+        return value
+
+    def refresh(self, key, compute):
+        # Only one process refreshes a stale result at a time.
+        if not self.get_cache().add(key + ':refresh', True, self.get_ttl()):
+            return
+
+        if self.refresh_in_background:
+            threading.Thread(target=self._refresh, args=(key, compute), daemon=True).start()
+        else:
+            self._refresh(key, compute)
+
+    def _refresh(self, key, compute):
+        try:
+            self.set(key, compute())
+        except Exception:
+            logger.exception('Failed to refresh cached search results.')
+        finally:
+            self.get_cache().delete(key + ':refresh')
+            if self.refresh_in_background:
+                connection.close()
+
+
+class SearchQueryLog:
+    """
+    Counts searches, to find the most popular searches to warm the search result cache with.
+    Counts are buffered in memory, and written to the database every FLUSH_SIZE searches or FLUSH_INTERVAL seconds,
+    with a single query, in a background thread, so no search waits for them.
+    """
+
+    FLUSH_SIZE = 100
+    FLUSH_INTERVAL = 60
+
+    # Flushes run in a background thread. This can be disabled (i.e. in tests) to flush within the request.
+    flush_in_background = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._flushed_on = time.time()
+        self._flushing = False
+
+    def record(self, search_terms):
+        terms = ' '.join(normalize_search_terms(search_terms))[:255]
+        if not terms:
+            return
+
+        with self._lock:
+            self._counts[terms] += 1
+            should_flush = not self._flushing and (sum(self._counts.values()) >= self.FLUSH_SIZE
+                                                   or time.time() - self._flushed_on >= self.FLUSH_INTERVAL)
+            if should_flush:
+                self._flushing = True
+
+        if not should_flush:
+            return
+
+        if self.flush_in_background:
+            threading.Thread(target=self._flush, daemon=True).start()
+        else:
+            self._flush()
+
+    def _flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to write the search counts.')
+        finally:
+            self._flushing = False
+            if self.flush_in_background:
+                connection.close()
+
+    def flush(self):
+        """
+        Add the buffered counts to the FoodSearchQueries, with a single query.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed_on = time.time()
+
+        # The rows are written in order, so concurrent flushes lock them in the same order.
+        rows = sorted(counts.items())
+        if not rows:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO food_foodsearchquery (terms, count, last_searched_on)
+                VALUES {0}
+                ON CONFLICT (terms)
+                DO UPDATE SET count = food_foodsearchquery.count + EXCLUDED.count,
+                              last_searched_on = EXCLUDED.last_searched_on
+            """.format(', '.join(['(%s, %s, now())'] * len(rows))), [value for row in rows for value in row])
+
+    def get_popular(self, limit):
+        """
+        Return the search terms of the most popular searches, as lists of terms.
+        """
+        from caloriecounter.food.models import FoodSearchQuery
+
+        return [terms.split() for terms in FoodSearchQuery.objects.order_by('-count', 'terms')
+                .values_list('terms', flat=True)[:limit]]
+
+
+# The process-wide search result cache and search query log.
+search_cache = SearchResultCache()
+search_query_log = SearchQueryLog()
+
+
+def get_search_results(search_terms, cursor, page_size):
+    """
+    Return the (cached) result of get_search_page for the current version of the food catalog.
+    The first page has a cursor of None.
+    """
+    from caloriecounter.food.models import CatalogVersion, FOOD_PRODUCT_CATALOG
+
+    search_terms = list(normalize_search_terms(search_terms))
+    version = CatalogVersion.get_version(FOOD_PRODUCT_CATALOG)
+    key = search_cache.make_key(version, search_terms, cursor, page_size)
+
+    return search_cache.get_or_compute(key, lambda: get_search_page(search_terms, cursor, page_size))
+
+
+def warm_search_results(top, page_size):
+    """
+    Cache the first page of the results of the top most popular searches. Returns the number of searches.
+    """
+    searches = search_query_log.get_popular(top)
+    for search_terms in searches:
+        get_search_results(search_terms, None, page_size)
+
+    return len(searches)
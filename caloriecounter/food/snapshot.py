@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+
+# The tables of a catalog snapshot, by model name, with their columns.
+# Rows are stored column by column ({column: [values]}), so column names are not repeated for every row.
+SNAPSHOT_TABLES = {
+    'unit': ('id', 'name', 'name_plural', 'short_name', 'is_base', 'is_constant', 'parent_id',
+             'base_unit_multiplier'),
+    'nutrient': ('id', 'name', 'unit_id', 'rank'),
+    'foodgroup': ('id', 'name'),
+    'foodproduct': ('id', 'full_name', 'display_name', 'default_unit_id', 'grams_per_ml', 'default_quantity',
+                    'food_group_id'),
+    'foodproductnutrient': ('id', 'product_id', 'nutrient_id', 'quantity'),
+    'foodproductunit': ('id', 'product_id', 'unit_id', 'quantity', 'multiplier', 'description', 'modifier'),
+    'foodproductcommonname': ('id', 'food_product_id', 'text', 'text_plural'),
+}
+
+# Tables with an updated_on column and tombstones, that are synchronized row by row.
+# The other (small) tables are synchronized in full whenever their CatalogVersion changes.
+SYNCHRONIZED_TABLES = ('foodproduct', 'foodproductnutrient', 'foodproductunit', 'foodproductcommonname')
+
+SNAPSHOT_FILE_NAME = re.compile(r'^catalog-(\d+)\.json\.gz$')
+
+
+def get_models():
+    from caloriecounter.food.models import Unit, Nutrient, FoodGroup, FoodProduct, FoodProductNutrient, \
+        FoodProductUnit, FoodProductCommonName
+
+    return {model._meta.model_name: model for model in (Unit, Nutrient, FoodGroup, FoodProduct, FoodProductNutrient,
+                                                        FoodProductUnit, FoodProductCommonName)}
+
+
+def get_columns(queryset, columns):
+    """
+    Return the rows of a queryset in a columnar layout: {column: [values]}
+    """
+    # Unit.name_plural is a property over the _name_plural field.
+    fields = ['_name_plural' if column == 'name_plural' else column for column in columns]
+    values = {column: [] for column in columns}
+
+    for row in queryset.order_by('pk').values_list(*fields).iterator():
+        for column, value in zip(columns, row):
+            values[column].append(value)
+
+    return values
+
+
+def get_catalog_version():
+    from caloriecounter.food.models import CatalogVersion, FOOD_PRODUCT_CATALOG
+
+    return CatalogVersion.get_version(FOOD_PRODUCT_CATALOG)
+
+
+def build_catalog_snapshot():
+    """
+    Return the full food catalog, with all tables in a columnar layout.
+    """
+    synced_on = timezone.now()
+    models = get_models()
+
+    return {
+        'version': get_catalog_version(),
+        'synced_on': synced_on,
+        'tables': {name: get_columns(models[name].objects.all(), columns)
+                   for name, columns in SNAPSHOT_TABLES.items()},
+    }
+
+
+def get_sync_margin():
+    return timedelta(seconds=getattr(settings, 'FOOD_CATALOG_SYNC_MARGIN', 300))
+
+
+def get_catalog_changes(since):
+    """
+    Return the rows of the food catalog that changed after the given (aware) datetime, and the ids of deleted rows.
+    Clients pass the synced_on of the snapshot (or previous changes) they have, to get the next changes.
+
+    The updated_on of a row is the time it was written, not the time its transaction committed, so a row that was
+    written before a sync, and committed after it, would never be returned. Rows that changed within the
+    FOOD_CATALOG_SYNC_MARGIN before since are therefore returned again; clients apply changes idempotently.
+    Writes in transactions that take longer than the margin can still be missed until the next snapshot.
+    """
+    from caloriecounter.food.models import CatalogTombstone, CatalogVersion, FOOD_GROUP_CATALOG, NUTRIENT_CATALOG, \
+        UNIT_CATALOG
+
+    synced_on = timezone.now()
+    since = since - get_sync_margin()
+    models = get_models()
+    tables = {}
+
+    for name in SYNCHRONIZED_TABLES:
+        tables[name] = get_columns(models[name].objects.filter(updated_on__gte=since), SNAPSHOT_TABLES[name])
+
+    catalog_versions = CatalogVersion.get_versions([UNIT_CATALOG, NUTRIENT_CATALOG, FOOD_GROUP_CATALOG])
+    for name, catalog in (('unit', UNIT_CATALOG), ('nutrient', NUTRIENT_CATALOG), ('foodgroup', FOOD_GROUP_CATALOG)):
+        version, updated_on = catalog_versions[catalog]
+        if updated_on is not None and updated_on >= since:
+            tables[name] = get_columns(models[name].objects.all(), SNAPSHOT_TABLES[name])
+
+    deleted = {name: [] for name in SYNCHRONIZED_TABLES}
+    for table, object_id in CatalogTombstone.objects.filter(deleted_on__gte=since, table__in=SYNCHRONIZED_TABLES) \
+            .order_by('pk').values_list('table', 'object_id'):
+        deleted[table].append(object_id)
+
+    return {
+        'version': get_catalog_version(),
+        'synced_on': synced_on,
+        'tables': tables,
+        'deleted': deleted,
+    }
+
+
+def get_snapshot_directory():
+    return getattr(settings, 'FOOD_CATALOG_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def write_catalog_snapshot(directory=None):
+    """
+    Write a gzipped JSON snapshot of the catalog, named by its version, and return its path.
+    """
+    directory = directory or get_snapshot_directory()
+    os.makedirs(directory, exist_ok=True)
+
+    snapshot = build_catalog_snapshot()
+    path = os.path.join(directory, 'catalog-{0}.json.gz'.format(snapshot['version']))
+
+    # The snapshot is written to a temporary file first, so a snapshot that is being served is never incomplete.
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as file:
+        json.dump(snapshot, file, cls=DjangoJSONEncoder, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+    return path
+
+
+def get_latest_snapshot_path(directory=None):
+    """
+    Return the path of the snapshot with the highest version, or None if no snapshot has been built.
+    """
+    directory = directory or get_snapshot_directory()
+    if not os.path.isdir(directory):
+        return None
+
+    snapshots = [(int(match.group(1)), file_name) for match, file_name in
+                 ((SNAPSHOT_FILE_NAME.match(file_name), file_name) for file_name in os.listdir(directory)) if match]
+    if not snapshots:
+        return None
+
+    return os.path.join(directory, max(snapshots)[1])
@@ -1,3 +1,5 @@
 from .models import *
 from .base import *
-from .api import *
\ No newline at end of file
+from .api import *
+from .commands import *
+from .validation import *
\ No newline at end of file
@@ -1,6 +1,32 @@
+import base64
+import gzip
+import json
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APIClient
-
+from rest_framework.test import APIClient, APIRequestFactory
+
+from caloriecounter.food.api.renderers import ORJSONRenderer
+from caloriecounter.food.api.serializers import FoodProductSerializer
+from caloriecounter.food.api.views import FoodProductPagination, FoodSearchPagination
+from caloriecounter.food.autocomplete import autocomplete_index
+from caloriecounter.food.catalog_versions import catalog_versions
+from caloriecounter.food.fragments import product_fragments
+from caloriecounter.food.models import CatalogVersion, FoodProduct, FoodProductCommonName, FoodSearchDocument, \
+    FOOD_PRODUCT_CATALOG, bump_version
+from caloriecounter.food.search import get_search_page
+from caloriecounter.food.search_cache import search_cache, search_query_log
 from caloriecounter.food.tests import BaseTest
 
 
@@ -16,6 +42,24 @@ class FoodProductViewSetTestCase(BaseTest):
     def setUp(self):
         super().setUp()
         self.client = APIClient()
+        search_cache.clear()
+        product_fragments.clear()
+
+        # Searches counted by earlier tests are flushed into this test's transaction, and rolled back with it.
+        search_query_log.flush()
+        search_query_log.flush_in_background = False
+        self.addCleanup(setattr, search_query_log, 'flush_in_background', True)
+
+    def search(self, search_term):
+        """
+        Search for products, and return the pks of the results, and whether the search query itself was executed.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("foodproduct-list"), {'search': search_term})
+
+        self.assertEqual(response.status_code, 200)
+        searched = any('%>' in query['sql'] for query in context.captured_queries)
+        return [result['pk'] for result in response.data['results']], searched
 
     def test_foodproduct_list(self):
         """
@@ -30,7 +74,357 @@ class FoodProductViewSetTestCase(BaseTest):
         self.assertEqual(response.status_code, 200)
 
         # Assert 2.
-        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertNotIn('count', response.data)
+
+    def test_foodproduct_list_pagination(self):
+        """
+        Assert:
+        1. Products are paginated by full name, with a next cursor and without counting the products.
+        2. The next cursor continues after the last product of a page.
+        3. The previous cursor returns to the page before.
+        4. An invalid cursor is answered with 404.
+        5. Search results are paginated by distance, and pages are cached per cursor.
+        6. The distance of a result is returned exactly, so a page starts right after the position of any result.
+        7. A search cursor with an invalid position is answered with 404, but errors of the search itself are not.
+        """
+        url = reverse("foodproduct-list")
+
+        # Assert 1.
+        with mock.patch.object(FoodProductPagination, 'page_size', 3), \
+                CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual([result['full_name'] for result in response.data['results']],
+                         ['Mushrooms (portobello,cooked)', 'Mushrooms (portobello,raw)', 'Mushrooms (shiitake,raw)'])
+        self.assertIsNone(response.data['previous'])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+
+        # Assert 2.
+        with mock.patch.object(FoodProductPagination, 'page_size', 3):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([result['pk'] for result in response.data['results']], [self.product.pk])
+        self.assertIsNone(response.data['next'])
+
+        # Assert 3.
+        with mock.patch.object(FoodProductPagination, 'page_size', 3):
+            response = self.client.get(response.data['previous'])
+        self.assertEqual([result['full_name'] for result in response.data['results']],
+                         ['Mushrooms (portobello,cooked)', 'Mushrooms (portobello,raw)', 'Mushrooms (shiitake,raw)'])
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
+
+        # Assert 4.
+        self.assertEqual(self.client.get(url, {'cursor': 'invalid'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'cursor': 'eyJwIjpbMV19'}).status_code, 404)
+
+        # Assert 5.
+        pks = []
+        next_url = url + '?search=mushrooms'
+        with mock.patch.object(FoodSearchPagination, 'page_size', 1):
+            while next_url:
+                response = self.client.get(next_url)
+                self.assertEqual(len(response.data['results']), 1)
+                pks.append(response.data['results'][0]['pk'])
+                next_url = response.data['next']
+
+            self.assertEqual(len(pks), 4)
+            self.assertEqual(len(set(pks)), 4)
+
+            response = self.client.get(response.data['previous'])
+            self.assertEqual([result['pk'] for result in response.data['results']], [pks[2]])
+
+        # Assert 6.
+        rows = get_search_page(['mushroom portobelo'], None, 10)
+        for index, row in enumerate(rows):
+            page = get_search_page(['mushroom portobelo'], ([row['distance'], row['pk']], False), 10)
+            self.assertEqual([result['pk'] for result in page], [result['pk'] for result in rows[index + 1:]])
+
+        # Assert 7.
+        cursor = base64.urlsafe_b64encode(json.dumps({'p': ['far', 1]}).encode('utf-8')).decode('ascii')
+        self.assertEqual(self.client.get(url, {'search': 'mushrooms', 'cursor': cursor}).status_code, 404)
+        with mock.patch('caloriecounter.food.api.views.get_search_results', side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                self.client.get(url, {'search': 'mushrooms'})
+
+    def test_foodproduct_read_serializer(self):
+        """
+        Assert:
+        1. The compiled representation of a product equals the one of DRF's generic field machinery.
+        2. The same holds with expanded and compact fields, and a searched common name.
+        3. Responses are rendered as JSON by the ORJSONRenderer.
+        4. The ORJSONRenderer renders lazy translations and numpy values.
+        """
+        common_name = FoodProductCommonName.objects.create(text='button mushroom', food_product=self.product)
+        self.product.common_name = common_name.pk
+
+        for params in [{}, {'expand': 'default_unit,food_group', 'compact': 'true'}]:
+            request = Request(APIRequestFactory().get('/', params))
+            serializer = FoodProductSerializer(self.product, context={'request': request})
+
+            # Assert 1. and 2.
+            self.assertEqual(serializer.data, serializers.Serializer.to_representation(serializer, self.product))
+
+        # Assert 3.
+        response = self.client.get(reverse("foodproduct-detail", kwargs={'pk': self.product.pk}))
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(response.data)))
+
+        # Assert 4.
+        self.assertEqual(ORJSONRenderer().render({'detail': gettext_lazy('Not found.'), 'total': np.float64(1.5)}),
+                         b'{"detail":"Not found.","total":1.5}')
+
+    def test_foodproduct_fragments(self):
+        """
+        Assert:
+        1. Pages and products in the default representation are the same as when they are serialized.
+        2. A repeated page is assembled from cached fragments, without loading the products.
+        3. A change to a nutrient of a product touches the product's updated_on,
+           which invalidates only the fragment of that product, also in other processes.
+        4. A change to the nutrient catalog invalidates all fragments.
+        5. The warm_product_fragments command caches the fragments of all products.
+        6. A change that sends no signals (i.e. by another process) invalidates the fragment of its product
+           by its updated_on alone.
+        """
+        list_url = reverse("foodproduct-list")
+        detail_url = reverse("foodproduct-detail", kwargs={'pk': self.product.pk})
+
+        # Assert 1. (?compact=false selects the default representation, without using fragments.)
+        self.assertEqual(self.client.get(list_url).json(), self.client.get(list_url, {'compact': 'false'}).json())
+        self.assertEqual(self.client.get(detail_url).json(), self.client.get(detail_url, {'compact': 'false'}).json())
+
+        # Assert 2.
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(list_url)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertFalse(any('food_foodproductnutrient' in query['sql'] for query in context.captured_queries))
+
+        # Assert 3.
+        rendered = []
+
+        def render(product_ids):
+            rendered.extend(product_ids)
+            return {}
+
+        self.food_product_nutrient_fat.quantity = 5
+        self.food_product_nutrient_fat.save()
+        self.run_commit_callbacks()
+        product_fragments.get_many([self.product.pk, self.product_with_cup.pk], render=render)
+        self.assertEqual(rendered, [self.product.pk])
+        # Nutrients with the same rank are in no particular order, so the changed one is looked up.
+        quantities = {item['nutrient']['pk']: item['quantity']
+                      for item in self.client.get(detail_url).data['nutritional_information']}
+        self.assertEqual(quantities[self.fat.pk], 5)
+
+        # Assert 4.
+        rendered.clear()
+        self.fat.name = 'total fat'
+        self.fat.save()
+        self.run_commit_callbacks()
+        product_fragments.get_many([self.product.pk, self.product_with_cup.pk], render=render)
+        self.assertEqual(rendered, [self.product.pk, self.product_with_cup.pk])
+
+        # Assert 5.
+        product_fragments.clear()
+        call_command('warm_product_fragments', stdout=open(os.devnull, 'w'))
+        rendered.clear()
+        product_fragments.get_many([self.product.pk, self.product_with_cup.pk], render=render)
+        self.assertEqual(rendered, [])
+
+        # Assert 6.
+        FoodProduct.objects.filter(pk=self.product.pk).update(full_name='Champignons', updated_on=timezone.now())
+        self.assertEqual(self.client.get(detail_url).json()['full_name'], 'Champignons')
+
+    def test_foodproduct_fields(self):
+        """
+        Assert:
+        1. ?fields= only returns the selected fields, without prefetching any relations.
+        2. ?omit= leaves out the omitted fields.
+        3. ?expand= returns related objects in full.
+        4. ?compact= returns nutrients as a map of nutrient ids to quantities, without loading the nutrients.
+        """
+        url = reverse("foodproduct-detail", kwargs={'pk': self.product.pk})
+
+        # Assert 1. (The first query is the catalog version of the ETag.)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'pk,full_name'})
+        self.assertEqual(response.data, {'pk': self.product.pk, 'full_name': 'Mushrooms (white,raw)'})
+
+        # Assert 2.
+        response = self.client.get(url, {'omit': 'units,common_names,nutritional_information'})
+        self.assertNotIn('units', response.data)
+        self.assertNotIn('nutritional_information', response.data)
+        self.assertIn('default_unit', response.data)
+
+        # Assert 3.
+        response = self.client.get(url, {'fields': 'pk,default_unit', 'expand': 'default_unit'})
+        self.assertEqual(response.data['default_unit']['name'], 'gram')
+
+        # Assert 4.
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'fields': 'nutritional_information', 'compact': 'true'})
+        self.assertEqual(response.data, {'nutritional_information': {str(self.fat.pk): 4, str(self.protein.pk): 6}})
+
+    def test_foodproduct_search(self):
+        """
+        Assert:
+        1. Searching for a common name returns its product once, annotated with the matching common name.
+        2. Searching for (part of) a full name returns the product.
+        3. A search document is kept up to date when a common name is deleted.
+        4. A misspelled or partial search term with a word similarity between 0.3 and 0.6 still matches.
+        """
+        common_name = FoodProductCommonName.objects.create(text='button mushroom', text_plural='button mushrooms',
+                                                           food_product=self.product)
+        FoodProductCommonName.objects.create(text='champignon', food_product=self.product)
+
+        url = reverse("foodproduct-list")
+
+        # Assert 1.
+        response = self.client.get(url, {'search': 'button mushroom'})
+        self.assertEqual(response.status_code, 200)
+        pks = [result['pk'] for result in response.data['results']]
+        self.assertEqual(pks.count(self.product.pk), 1)
+        self.assertEqual(pks[0], self.product.pk)
+        self.assertEqual(response.data['results'][0]['common_name']['id'], common_name.pk)
+
+        # Assert 2.
+        response = self.client.get(url, {'search': 'shiitake'})
+        self.assertEqual([result['pk'] for result in response.data['results']], [self.product_with_cup.pk])
+
+        # Assert 3.
+        common_name.delete()
+        self.assertNotIn('button', FoodSearchDocument.objects.get(product=self.product).document)
+
+        # Assert 4. (The word similarity of "shii" to "Shiitake mushrooms" is 0.4.)
+        response = self.client.get(url, {'search': 'shii'})
+        self.assertEqual([result['pk'] for result in response.data['results']], [self.product_with_cup.pk])
+
+    def test_foodproduct_search_cache(self):
+        """
+        Assert:
+        1. Repeated searches, with differently cased search terms, are served from the search result cache.
+        2. Cached results are invalidated when a common name is added.
+        3. Stale results are returned while they are refreshed.
+        4. Searches are counted, with a single query per flush,
+        and the most popular searches are cached by the warm_search_cache command.
+        """
+        # Assert 1.
+        self.assertEqual(self.search('Shiitake'), ([self.product_with_cup.pk], True))
+        self.assertEqual(self.search('shiitake'), ([self.product_with_cup.pk], False))
+
+        # Assert 2.
+        self.assertEqual(self.search('champignon'), ([], True))
+        FoodProductCommonName.objects.create(text='champignon', food_product=self.product)
+        self.run_commit_callbacks()
+        self.assertEqual(self.search('champignon'), ([self.product.pk], True))
+
+        # Assert 3.
+        search_cache.refresh_in_background = False
+        self.addCleanup(setattr, search_cache, 'refresh_in_background', True)
+
+        with override_settings(FOOD_SEARCH_CACHE_TTL=0):
+            self.assertEqual(search_cache.get_or_compute('stale', lambda: 1), 1)
+            self.assertEqual(search_cache.get_or_compute('stale', lambda: 2), 1)
+            self.assertEqual(search_cache.get_or_compute('stale', lambda: 3), 2)
+
+        # Assert 4.
+        with self.assertNumQueries(1):
+            search_query_log.flush()
+        self.assertEqual(search_query_log.get_popular(1), [['shiitake']])
+
+        search_cache.clear()
+        call_command('warm_search_cache', top=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.search('shiitake'), ([self.product_with_cup.pk], False))
+
+    def test_foodproduct_autocomplete(self):
+        """
+        Assert:
+        1. The foodproduct-autocomplete view returns products with a name starting with the typed prefix.
+        2. Products are matched on their common names.
+        3. Misspelled words are matched on their trigrams.
+        4. The index is updated when a common name is added.
+        5. The index is updated when a product is deleted.
+        6. A product that changes while the index is being built is reindexed once it is built.
+        7. A change by another process starts a synchronization of the index, once the catalog versions are read again.
+        8. The synchronization only reindexes the products that changed.
+        9. A version that was produced by a change in this process does not start a synchronization.
+        """
+        autocomplete_index.clear()
+        FoodProductCommonName.objects.create(text='button mushroom', food_product=self.product)
+        url = reverse("foodproduct-autocomplete")
+
+        # Assert 1.
+        response = self.client.get(url, {'search': 'shii'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{'pk': self.product_with_cup.pk,
+                                          'display_name': 'Shiitake mushrooms',
+                                          'matched_name': 'Shiitake mushrooms'}])
+
+        # Assert 2.
+        response = self.client.get(url, {'search': 'butt mush'})
+        self.assertEqual([(result['pk'], result['matched_name']) for result in response.data],
+                         [(self.product.pk, 'button mushroom')])
+
+        # Assert 3.
+        response = self.client.get(url, {'search': 'shitake'})
+        self.assertEqual([result['pk'] for result in response.data], [self.product_with_cup.pk])
+
+        # Assert 4.
+        FoodProductCommonName.objects.create(text='black forest mushroom', food_product=self.product_with_cup)
+        response = self.client.get(url, {'search': 'black for'})
+        self.assertEqual([result['pk'] for result in response.data], [self.product_with_cup.pk])
+
+        # Assert 5.
+        self.product_with_cup.delete()
+        response = self.client.get(url, {'search': 'black for'})
+        self.assertEqual(response.data, [])
+
+        # Assert 6.
+        load = autocomplete_index._load
+
+        def load_and_rename(since=None):
+            names = load(since)
+            FoodProductCommonName.objects.create(text='champignon', food_product=self.product)
+            return names
+
+        with mock.patch.object(autocomplete_index, '_load', side_effect=load_and_rename):
+            autocomplete_index.build()
+        response = self.client.get(url, {'search': 'champ'})
+        self.assertEqual([result['pk'] for result in response.data], [self.product.pk])
+
+        # Assert 7.
+        FoodProduct.objects.filter(pk=self.product.pk).update(full_name='Chanterelle', display_name='Chanterelle',
+                                                              updated_on=timezone.now())
+        CatalogVersion.bump(FOOD_PRODUCT_CATALOG)
+        with mock.patch.object(autocomplete_index, 'refresh') as refresh:
+            self.client.get(url, {'search': 'chanter'})
+            refresh.assert_not_called()
+
+            catalog_versions.clear()
+            self.client.get(url, {'search': 'chanter'})
+            self.client.get(url, {'search': 'chanter'})
+            refresh.assert_called_once_with()
+        # The mocked refresh never finishes.
+        autocomplete_index._refreshing = False
+
+        # Assert 8.
+        with mock.patch.object(autocomplete_index, '_load', wraps=autocomplete_index._load) as load:
+            autocomplete_index.sync()
+            self.assertIsNotNone(load.call_args[0][0])
+        response = self.client.get(url, {'search': 'chanter'})
+        self.assertEqual([result['pk'] for result in response.data], [self.product.pk])
+        self.assertEqual(autocomplete_index.catalog_version, CatalogVersion.get_version(FOOD_PRODUCT_CATALOG))
+
+        # Assert 9.
+        self.addCleanup(catalog_versions.clear)
+        FoodProductCommonName.objects.create(text='girolle', food_product=self.product)
+        bump_version(FOOD_PRODUCT_CATALOG)
+        catalog_versions.refresh()
+        with mock.patch.object(autocomplete_index, 'refresh') as refresh:
+            response = self.client.get(url, {'search': 'girol'})
+            refresh.assert_not_called()
+        self.assertEqual([result['pk'] for result in response.data], [self.product.pk])
+        self.assertEqual(autocomplete_index.catalog_version, CatalogVersion.get_version(FOOD_PRODUCT_CATALOG))
 
     def test_foodproduct_item(self):
         """
@@ -47,6 +441,27 @@ class FoodProductViewSetTestCase(BaseTest):
         # Assert 2.
         self.assertEqual(response.data['pk'], self.product.pk)
 
+    def test_foodproduct_item_conditional(self):
+        """
+        Assert:
+        1. The foodproduct-detail view answers a request with a matching If-None-Match header with 304.
+        2. The ETag changes when a nutrient of the product changes.
+        """
+        url = reverse("foodproduct-detail", kwargs={'pk': self.product.pk})
+        etag = self.client.get(url)['ETag']
+
+        # Assert 1.
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Assert 2.
+        self.food_product_nutrient_fat.quantity = 5
+        self.food_product_nutrient_fat.save()
+        self.run_commit_callbacks()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        quantities = {item['nutrient']['pk']: item['quantity'] for item in response.data['nutritional_information']}
+        self.assertEqual(quantities[self.fat.pk], 5)
+
     def test_foodproduct_create_not_allowed(self):
         """
         Assert:
@@ -214,6 +629,42 @@ class UnitViewSetTestCase(BaseTest):
         # Assert 2.
         self.assertEqual(response.data['count'], 7)
 
+    def test_unit_list_conditional(self):
+        """
+        Assert:
+        1. The unit-list view returns an ETag and Last-Modified header.
+        2. A request with a matching If-None-Match header is answered with 304, with a single query.
+        3. A repeated request is answered from the rendered response cache, with a single query.
+        4. The ETag changes when a unit changes.
+        """
+        url = reverse("unit-list")
+        response = self.client.get(url)
+
+        # Assert 1.
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        # Assert 2.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Assert 3.
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 7)
+
+        # Assert 4.
+        self.g.short_name = 'gr'
+        self.g.save()
+        self.run_commit_callbacks()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_unit_item(self):
         """
         Assert:
@@ -374,4 +825,82 @@ class FoodGroupViewSetTestCase(BaseTest):
         response = self.client.delete(url)
 
         # Assert 1.
-        self.assertEqual(response.status_code, 405)
\ No newline at end of file
+        self.assertEqual(response.status_code, 405)
+
+
+class CatalogViewSetTestCase(BaseTest):
+    """
+    A TestCase that performs tests on the CatalogViewSet in the api package of the food app.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(FOOD_CATALOG_SNAPSHOT_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_catalog_snapshot(self):
+        """
+        Assert:
+        1. The catalog-snapshot view returns 404 when no snapshot has been built.
+        2. The catalog-snapshot view returns the latest snapshot, with all tables in a columnar layout.
+        """
+        url = reverse("catalog-snapshot")
+
+        # Assert 1.
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        # Assert 2.
+        call_command('build_catalog_snapshot', stdout=open(os.devnull, 'w'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        snapshot = json.loads(gzip.decompress(b''.join(response.streaming_content)).decode('utf-8'))
+        products = snapshot['tables']['foodproduct']
+        self.assertEqual(len(products['id']), 4)
+        index = products['id'].index(self.product.pk)
+        self.assertEqual(products['full_name'][index], 'Mushrooms (white,raw)')
+        self.assertEqual(len(snapshot['tables']['unit']['id']), 7)
+        self.assertEqual(len(snapshot['tables']['foodproductnutrient']['id']), 4)
+
+    def test_catalog_changes(self):
+        """
+        Assert:
+        1. The catalog-changes view requires a valid since datetime, with a time zone.
+        2. Only the rows changed since the given datetime are returned, with the ids of deleted rows.
+           Products are changed as well when their nutrients, units or common names change.
+        3. Rows that changed within the FOOD_CATALOG_SYNC_MARGIN before the given datetime are returned again.
+        """
+        url = reverse("catalog-changes")
+
+        # Assert 1.
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2000-01-01T00:00:00'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2020-13-45T00:00:00Z'}).status_code, 400)
+
+        # Assert 2.
+        synced_on = self.client.get(url, {'since': '2000-01-01T00:00:00Z'}).data['synced_on']
+
+        common_name = FoodProductCommonName.objects.create(text='champignon', food_product=self.product)
+        self.product_with_cup.display_name = 'Shiitake'
+        self.product_with_cup.save()
+        deleted_pk = self.food_product_nutrient_fat.pk
+        self.food_product_nutrient_fat.delete()
+
+        with override_settings(FOOD_CATALOG_SYNC_MARGIN=0):
+            response = self.client.get(url, {'since': synced_on.isoformat()})
+        tables = response.data['tables']
+        self.assertEqual(sorted(tables['foodproduct']['id']), [self.product.pk, self.product_with_cup.pk])
+        self.assertEqual(tables['foodproductcommonname']['id'], [common_name.pk])
+        self.assertEqual(tables['foodproductnutrient']['id'], [])
+        self.assertNotIn('unit', tables)
+        self.assertEqual(response.data['deleted']['foodproductnutrient'], [deleted_pk])
+
+        # Assert 3.
+        synced_on = self.client.get(url, {'since': '2000-01-01T00:00:00Z'}).data['synced_on']
+        response = self.client.get(url, {'since': synced_on.isoformat()})
+        self.assertIn(self.product_with_cup.pk, response.data['tables']['foodproduct']['id'])
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from caloriecounter.food.catalog_import import iter_json_array
+from caloriecounter.food.models import CatalogVersion, FoodProduct, FoodProductCommonName, FoodProductNutrient, \
+    FoodSearchDocument, Unit, FOOD_PRODUCT_CATALOG
+
+
+class ImportFoodCatalogTest(TestCase):
+    """
+    Tests the import_food_catalog management command.
+    """
+
+    fixture = [
+        {'model': 'food.unit', 'pk': 1001, 'fields': {'name': 'gram', 'short_name': 'g', 'is_base': True,
+                                                      'is_constant': True, 'base_unit_multiplier': 1}},
+        {'model': 'food.nutrient', 'pk': 1001, 'fields': {'name': 'fat', 'unit': 1001, 'rank': 1}},
+        {'model': 'food.foodgroup', 'pk': 1001, 'fields': {'name': 'Vegetables'}},
+        {'model': 'food.foodproduct', 'pk': 1001, 'fields': {'full_name': 'Mushrooms (white,raw)',
+                                                             'display_name': 'White mushrooms',
+                                                             'default_unit': 1001, 'default_quantity': 100,
+                                                             'food_group': 1001}},
+        {'model': 'food.foodproduct', 'pk': 1002, 'fields': {'full_name': 'Onions (raw)', 'display_name': 'Onions', 'default_unit': 1001,
+                                                             'default_quantity': 110, 'food_group': 1001}},
+        {'model': 'food.foodproductnutrient', 'pk': 1001, 'fields': {'product': 1001, 'nutrient': 1001,
+                                                                     'quantity': 0.34}},
+        # Refers to a product that does not exist.
+        {'model': 'food.foodproductnutrient', 'pk': 1002, 'fields': {'product': 9999, 'nutrient': 1001,
+                                                                     'quantity': 1}},
+        # Has a negative quantity.
+        {'model': 'food.foodproductnutrient', 'pk': 1003, 'fields': {'product': 1002, 'nutrient': 1001,
+                                                                     'quantity': -1}},
+        {'model': 'food.foodproductcommonname', 'pk': 1001, 'fields': {'text': 'button mushroom',
+                                                                       'food_product': 1001}},
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.source = os.path.join(directory.name, 'food.json')
+        self.write_fixture(self.fixture)
+
+    def import_catalog(self, *args, **kwargs):
+        """
+        Run the import_food_catalog command, and return what it reported on stderr (the skipped rows).
+        """
+        stderr = io.StringIO()
+        call_command('import_food_catalog', self.source, *args, stdout=io.StringIO(), stderr=stderr, **kwargs)
+        return stderr.getvalue()
+
+    def write_fixture(self, fixture):
+        with open(self.source, 'w') as file:
+            json.dump(fixture, file, indent=2)
+
+    def test_iter_json_array(self):
+        """
+        Assert:
+        1. All objects of a JSON array are returned, also when they are split over multiple chunks.
+        2. A truncated array raises a ValueError.
+        """
+        text = json.dumps([{'a': 1}, 12345, 'text', [1, 2], {'b': {'c': None}}])
+
+        # Assert 1.
+        for chunk_size in (1, 3, 7, 1000):
+            self.assertEqual(list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)), json.loads(text))
+
+        # Assert 2.
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO(text[:-5]), chunk_size=4))
+
+    def test_import(self):
+        """
+        Assert:
+        1. All valid rows are imported, and invalid rows are skipped.
+        2. The search documents of the imported products are built.
+        3. The sequences are reset, so new rows can be created after an import.
+        4. Importing again does not duplicate any rows.
+        """
+        self.import_catalog(batch_size=4)
+
+        # Assert 1.
+        self.assertEqual(FoodProduct.objects.count(), 2)
+        self.assertEqual(list(FoodProductNutrient.objects.values_list('pk', flat=True)), [1001])
+
+        # Assert 2.
+        self.assertEqual(FoodSearchDocument.objects.get(product_id=1001).document,
+                         'Mushrooms (white,raw)\nWhite mushrooms\nbutton mushroom')
+
+        # Assert 3.
+        unit = Unit.objects.create(name='kilogram', short_name='kg', is_base=False, is_constant=True,
+                                   parent_id=1001, base_unit_multiplier=1000)
+        self.assertGreater(unit.pk, 1001)
+
+        # Assert 4.
+        self.import_catalog()
+        self.assertEqual(FoodProduct.objects.count(), 2)
+
+    def test_reimport(self):
+        """
+        Assert:
+        1. Importing a changed fixture again updates the changed rows, and leaves the unchanged rows as they are.
+        2. Rows that conflict with another row on a unique field are skipped, and reported.
+        3. Rows with an unknown field are skipped, and reported, without aborting the import.
+        4. The catalog versions are bumped, so other processes notice the import.
+        """
+        self.import_catalog()
+        unchanged_on = FoodProduct.objects.get(pk=1002).updated_on
+        version = CatalogVersion.get_version(FOOD_PRODUCT_CATALOG)
+
+        fixture = json.loads(json.dumps(self.fixture))
+        fixture[3]['fields']['display_name'] = 'Button mushrooms'
+        fixture.extend([
+            {'model': 'food.unit', 'pk': 1002, 'fields': {'name': 'gram', 'short_name': 'gr', 'is_base': True,
+                                                          'is_constant': True, 'base_unit_multiplier': 1}},
+            {'model': 'food.foodproductcommonname', 'pk': 1002, 'fields': {'text': 'button mushroom',
+                                                                           'food_product': 1002}},
+            {'model': 'food.foodgroup', 'pk': 1002, 'fields': {'name': 'Fruits', 'colour': 'red'}},
+        ])
+        self.write_fixture(fixture)
+        errors = self.import_catalog()
+
+        # Assert 1.
+        self.assertEqual(FoodProduct.objects.get(pk=1001).display_name, 'Button mushrooms')
+        self.assertEqual(FoodProduct.objects.get(pk=1002).updated_on, unchanged_on)
+
+        # Assert 2.
+        self.assertFalse(Unit.objects.filter(pk=1002).exists())
+        self.assertFalse(FoodProductCommonName.objects.filter(pk=1002).exists())
+        self.assertIn('Skipped food.unit 1002', errors)
+        self.assertIn('Skipped food.foodproductcommonname 1002', errors)
+
+        # Assert 3.
+        self.assertIn('Skipped food.foodgroup 1002', errors)
+
+        # Assert 4.
+        self.assertEqual(CatalogVersion.get_version(FOOD_PRODUCT_CATALOG), version + 1)
+
+    def test_deferred_rows(self):
+        """
+        Assert:
+        1. Rows that refer to rows in a later batch are imported.
+        2. Rows that refer to rows that are not in the fixture at all are reported once the import finishes.
+        3. Rows that are not objects, or with fields that are not an object, are skipped, and reported.
+        """
+        fixture = json.loads(json.dumps(self.fixture))
+        fixture = fixture[5:] + fixture[:5] + [['food.unit'], {'model': 'food.unit', 'pk': 1003, 'fields': [1]}]
+        self.write_fixture(fixture)
+        errors = self.import_catalog(batch_size=2)
+
+        # Assert 1.
+        self.assertEqual(list(FoodProductNutrient.objects.values_list('pk', flat=True)), [1001])
+        self.assertTrue(FoodProductCommonName.objects.filter(pk=1001).exists())
+
+        # Assert 2.
+        self.assertEqual(errors.count('Skipped food.foodproductnutrient 1002'), 1)
+
+        # Assert 3.
+        self.assertIn("Skipped ['food.unit']", errors)
+        self.assertIn('Skipped food.unit 1003', errors)
+
+    def test_resume(self):
+        """
+        Assert:
+        1. A resumed import skips the rows before its checkpoint.
+        2. A resumed import imports the rows that were deferred before its checkpoint.
+        """
+        self.import_catalog()
+        FoodProduct.objects.all().delete()
+
+        with open(self.source + '.checkpoint', 'w') as file:
+            json.dump({'source': os.path.abspath(self.source), 'rows': 4}, file)
+
+        self.import_catalog(resume=True)
+
+        # Assert 1.
+        self.assertEqual(list(FoodProduct.objects.values_list('pk', flat=True)), [1002])
+        self.assertFalse(os.path.exists(self.source + '.checkpoint'))
+
+        # Assert 2.
+        FoodProduct.objects.all().delete()
+        with open(self.source + '.checkpoint', 'w') as file:
+            json.dump({'source': os.path.abspath(self.source), 'rows': 4, 'deferred': [self.fixture[3]]}, file)
+
+        self.import_catalog(resume=True)
+        self.assertEqual(list(FoodProduct.objects.order_by('pk').values_list('pk', flat=True)), [1001, 1002])
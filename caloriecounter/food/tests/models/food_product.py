@@ -1,9 +1,15 @@
 from django.contrib.admin import AdminSite
 from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
+from django.db import connection, transaction
 from django.test import TestCase
+from django.utils import timezone
 
-from caloriecounter.food.models import FoodProduct, Unit, Nutrient, FoodGroup, FoodProductUnit, FoodProductNutrient
+from caloriecounter.food.models import FoodProduct, Unit, Nutrient, FoodGroup, FoodProductUnit, FoodProductNutrient, \
+    CatalogVersion, FOOD_PRODUCT_CATALOG
 from caloriecounter.food.admin import FoodProductAdmin
+from caloriecounter.food.catalog_versions import catalog_versions
+from caloriecounter.food.conversions import conversion_tables
+from caloriecounter.food.unit_graph import unit_graph
 
 
 class BaseTest(TestCase):
@@ -13,6 +19,8 @@ class BaseTest(TestCase):
     # so it's better to do it properly one time.
     # TODO: In the future, it's probably best to move this code to fixtures.
     def setUp(self):
+        # The catalog versions are read now, so tests that count queries do not count reading them.
+        catalog_versions.refresh()
 
         #Set up units
         self.ml = Unit(name="mililiter", short_name='ml', is_base=True, is_constant=True)
@@ -106,6 +114,16 @@ class BaseTest(TestCase):
         self.food_product_unit_cup = FoodProductUnit(product=self.product_with_cup, unit=self.cup, multiplier=150)
         self.food_product_unit_cup.save()
 
+        # The catalog versions are bumped as if the test data was committed.
+        self.run_commit_callbacks()
+
+    # The transaction of a TestCase is never committed, so the callbacks of transaction.on_commit never run by themselves.
+    # This runs them as if the changes made so far were committed, i.e. to bump the catalog versions.
+    def run_commit_callbacks(self):
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for callback in callbacks:
+            callback[1]()
+
 
 class FoodProductTest(BaseTest):
 
@@ -118,6 +136,22 @@ class FoodProductTest(BaseTest):
         self.product_no_display_name.display_name = ''
         self.assertEqual(str(self.product_no_display_name), 'Mushrooms (portobello,raw)')
 
+    # Assert:
+    # 1. Changes to the catalog do not bump its version before they are committed.
+    # 2. The version is bumped once per transaction, however many rows were changed.
+    def test_catalog_version_bump(self):
+        version = CatalogVersion.get_version(FOOD_PRODUCT_CATALOG)
+        with transaction.atomic():
+            self.product.save()
+            self.product_with_cup.save()
+
+        # Assert 1.
+        self.assertEqual(CatalogVersion.get_version(FOOD_PRODUCT_CATALOG), version)
+
+        # Assert 2.
+        self.run_commit_callbacks()
+        self.assertEqual(CatalogVersion.get_version(FOOD_PRODUCT_CATALOG), version + 1)
+
 
     # Assert:
     # 1. get_quantity_in_default_unit returns the correct value for an explicitly defined unit.
@@ -153,6 +187,70 @@ class FoodProductTest(BaseTest):
         self.assertEqual(self.product.get_quantity_in_default_unit(9), 135)
 
 
+class ProductConversionTableTest(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        conversion_tables.clear()
+
+    # Assert:
+    # 1. The conversion tables for a number of products are compiled with a single query.
+    # 2. The compiled tables contain all units that can be converted, and none that can not.
+    # 3. A cached table is used without any queries.
+    def test_get_many(self):
+        products = [self.product, self.product_with_cup, self.product_no_default_quantity]
+        unit_graph.family(self.g.pk)
+
+        # Assert 1.
+        with self.assertNumQueries(1):
+            tables = conversion_tables.get_many(products)
+
+        # Assert 2.
+        table = tables[self.product.pk]
+        for unit in [self.g, self.kg, self.bowl, self.ml, self.l, self.cup]:
+            self.assertIn(unit.pk, table)
+        self.assertNotIn(self.handful.pk, table)
+
+        self.assertNotIn(self.ml.pk, tables[self.product_no_default_quantity.pk])
+
+        # Assert 3.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.product.get_quantity_in_default_unit(0.3, self.l), 600)
+
+    # Assert:
+    # 1. A product's table is compiled again after a FoodProductUnit of the product is saved.
+    # 2. A product's table is compiled again after a FoodProductUnit of the product is deleted.
+    #    Bowls are then converted through the product's mililiters, since bowl's parent unit is mililiter.
+    # 3. A product's table is compiled again once the product's updated_on changed in another process,
+    #    while the tables of other products are kept when the food product catalog version is bumped.
+    def test_invalidation(self):
+        self.assertEqual(self.product.get_quantity_in_default_unit(2, self.bowl), 400)
+
+        # Assert 1.
+        self.food_product_unit_bowl.multiplier = 150
+        self.food_product_unit_bowl.save()
+        self.assertEqual(self.product.get_quantity_in_default_unit(2, self.bowl), 300)
+
+        # Assert 2.
+        self.food_product_unit_bowl.delete()
+        self.assertEqual(self.product.get_quantity_in_default_unit(2, self.bowl), 4)
+
+        # Assert 3. (The catalog versions are rolled back after the test, which the watcher and graph do not notice.)
+        self.addCleanup(catalog_versions.clear)
+        self.addCleanup(unit_graph.invalidate)
+        catalog_versions.refresh()
+        unit_graph.check()
+        table = conversion_tables.get(self.product_with_cup)
+
+        FoodProductUnit.objects.filter(pk=self.food_product_unit_ml.pk).update(multiplier=3)
+        FoodProduct.objects.filter(pk=self.product.pk).update(updated_on=timezone.now())
+        CatalogVersion.bump(FOOD_PRODUCT_CATALOG)
+        catalog_versions.refresh()
+
+        self.assertEqual(FoodProduct.objects.get(pk=self.product.pk).get_quantity_in_default_unit(2, self.ml), 6)
+        self.assertIs(conversion_tables.get(self.product_with_cup), table)
+
+
 class FoodProductNutrientTest(BaseTest):
 
     def test_nutrient_to_string(self):
@@ -1,6 +1,8 @@
 from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
 from django.test import TestCase
-from caloriecounter.food.models import Unit
+from caloriecounter.food.catalog_versions import catalog_versions
+from caloriecounter.food.models import CatalogVersion, Unit, UNIT_CATALOG
+from caloriecounter.food.unit_graph import UnitGraph, unit_graph
 
 
 class UnitTest(TestCase):
@@ -221,4 +223,77 @@ class UnitTest(TestCase):
             bowl.convert_to_unit(23, kg)
             raise AssertionError("ValueError not raised")
         except ValueError as e:
-            pass
\ No newline at end of file
+            pass
+
+class UnitGraphTest(TestCase):
+    # This is the TestCase class for the UnitGraph, which holds the precomputed conversions between all units.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.g = Unit.objects.create(name='gram', short_name='g', is_base=True, is_constant=True)
+        cls.kg = Unit.objects.create(name='kilogram', short_name='kg', is_base=False, is_constant=True,
+                                     parent=cls.g, base_unit_multiplier=1000)
+        cls.ml = Unit.objects.create(name='mililiter', short_name='ml', is_base=True, is_constant=True)
+
+    # Assert:
+    # 1. Conversions between units more than one parent apart are precomputed.
+    # 2. Converting two unrelated units raises a ValueError.
+    # 3. The base unit of each unit is the root of its chain of parents.
+    def test_transitive_conversion(self):
+        graph = UnitGraph(rows=[
+            {'id': 1, 'name': 'gram', 'is_base': True, 'is_constant': True,
+             'parent_id': None, 'base_unit_multiplier': 1},
+            {'id': 2, 'name': 'kilogram', 'is_base': False, 'is_constant': True,
+             'parent_id': 1, 'base_unit_multiplier': 1000},
+            {'id': 3, 'name': 'ton', 'is_base': False, 'is_constant': True,
+             'parent_id': 2, 'base_unit_multiplier': 1000},
+            {'id': 4, 'name': 'mililiter', 'is_base': True, 'is_constant': True,
+             'parent_id': None, 'base_unit_multiplier': 1},
+        ])
+
+        # Assert 1.
+        self.assertEqual(2000000, graph.convert(2, 3, 1))
+        self.assertEqual(0.5, graph.convert(500, 2, 3))
+        self.assertEqual(1000, graph.factor(3, 2))
+
+        # Assert 2.
+        with self.assertRaises(ValueError):
+            graph.factor(3, 4)
+
+        # Assert 3.
+        self.assertEqual(1, graph.base_unit_id(3))
+        self.assertEqual((1, 2, 3), graph.family(1))
+
+    # Assert:
+    # 1. The process-wide graph contains conversions for the saved units.
+    # 2. The graph is rebuilt when a unit is saved.
+    # 3. The graph is rebuilt when a unit is deleted.
+    def test_invalidation(self):
+        # Assert 1.
+        self.assertEqual(1000, unit_graph.factor(self.kg.pk, self.g.pk))
+
+        # Assert 2.
+        self.kg.base_unit_multiplier = 100
+        self.kg.save()
+        self.assertEqual(100, unit_graph.factor(self.kg.pk, self.g.pk))
+
+        # Assert 3.
+        ml_pk = self.ml.pk
+        self.ml.delete()
+        self.assertNotIn(ml_pk, unit_graph)
+
+    # Assert:
+    # 1. A unit that is changed in another process is noticed once the catalog versions are read again.
+    def test_catalog_version(self):
+        # The change is rolled back after the test, which the graph does not notice by itself.
+        self.addCleanup(unit_graph.invalidate)
+        self.assertEqual(1000, unit_graph.factor(self.kg.pk, self.g.pk))
+
+        # A change by another process, without any signals.
+        Unit.objects.filter(pk=self.kg.pk).update(base_unit_multiplier=10)
+        CatalogVersion.bump(UNIT_CATALOG)
+        self.assertEqual(1000, unit_graph.factor(self.kg.pk, self.g.pk))
+
+        # Assert 1.
+        catalog_versions.clear()
+        self.assertEqual(10, unit_graph.factor(self.kg.pk, self.g.pk))
@@ -0,0 +1,50 @@
+from django.core.exceptions import ValidationError
+
+from caloriecounter.food.models import Unit, FoodProductNutrient, CatalogVersion
+from caloriecounter.food.tests import BaseTest
+from caloriecounter.food.validation import validate_many
+
+
+class ValidationTest(BaseTest):
+
+    # Assert:
+    # 1. Models that opt in are validated when they are saved.
+    # 2. Models that do not opt in are not validated.
+    def test_validate_on_save(self):
+        # Assert 1.
+        unit = Unit(name='pound', short_name='lb', is_base=True, is_constant=True, parent=self.g,
+                    base_unit_multiplier=453.6)
+        with self.assertRaises(ValidationError):
+            unit.save()
+
+        # Assert 2.
+        CatalogVersion(name='', version=1).save()
+
+    # Assert:
+    # 1. validate_many returns an error for each invalid instance: a missing product, a negative quantity,
+    # an existing product and nutrient combination, and a duplicate within the batch.
+    # 2. The number of queries does not depend on the number of instances.
+    def test_validate_many(self):
+        FoodProductNutrient.objects.filter(product=self.product_with_cup).delete()
+
+        instances = [
+            FoodProductNutrient(product_id=self.product_with_cup.pk, nutrient_id=self.fat.pk, quantity=1),
+            FoodProductNutrient(product_id=-1, nutrient_id=self.fat.pk, quantity=1),
+            FoodProductNutrient(product_id=self.product_with_cup.pk, nutrient_id=self.protein.pk, quantity=-1),
+            FoodProductNutrient(product_id=self.product.pk, nutrient_id=self.fat.pk, quantity=1),
+            FoodProductNutrient(product_id=self.product_with_cup.pk, nutrient_id=self.fat.pk, quantity=2),
+        ]
+
+        # Assert 1. (A query for the product and nutrient relations, and one for the unique constraint.)
+        with self.assertNumQueries(3):
+            errors = validate_many(instances)
+
+        self.assertIsNone(errors[0])
+        self.assertIn('product', errors[1].message_dict)
+        self.assertIn('quantity', errors[2].message_dict)
+        self.assertIn('__all__', errors[3].message_dict)
+        self.assertIn('__all__', errors[4].message_dict)
+
+        # Assert 2.
+        with self.assertNumQueries(3):
+            validate_many(instances * 10)
@@ -0,0 +1,159 @@
+import threading
+from collections import namedtuple
+
+from caloriecounter.food.catalog_versions import UNIT_CATALOG, catalog_versions
+
+
+# A conversion from one quantity to another, applied as quantity * numerator / denominator * multiplier.
+# The three parts are kept separately (instead of folded into one factor), so converted quantities are
+# calculated in the same order, and thus with the same floating point results, as the original model methods.
+class Conversion(namedtuple('Conversion', ['numerator', 'denominator', 'multiplier'])):
+    __slots__ = ()
+
+    def apply(self, quantity):
+        return quantity * self.numerator / self.denominator * self.multiplier
+
+    @property
+    def factor(self):
+        return self.numerator / self.denominator * self.multiplier
+
+
+IDENTITY = Conversion(1, 1, 1)
+
+
+class UnitGraph:
+    """
+    An in-memory graph of all Units, containing the conversion between every pair of related units.
+
+    Units are related when they share the same base unit, either directly (g and kg) or transitively through
+    a chain of parents. All conversions are precomputed when the graph is built,
+    so looking one up is a single dictionary access instead of a walk over (lazily loaded) parent units.
+
+    The graph is built on first use, and is invalidated whenever a Unit is saved or deleted. Units that are changed
+    by another process are noticed through the version of the UNIT_CATALOG (see catalog_versions.py).
+    """
+
+    UNIT_FIELDS = ('id', 'name', 'is_base', 'is_constant', 'parent_id', 'base_unit_multiplier')
+
+    def __init__(self, rows=None, versions=None):
+        self._lock = threading.Lock()
+        self._state = None
+        self.version = 0
+        self.versions = versions
+
+        if rows is not None:
+            self._state = self._build(rows)
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+            self.version += 1
+
+    def get_catalog_version(self):
+        return self.versions.get(UNIT_CATALOG) if self.versions is not None else None
+
+    def check(self):
+        """
+        Invalidate the graph if the units changed since it was built, possibly in another process.
+        """
+        state = self._state
+        if state is not None and state['catalog_version'] != self.get_catalog_version():
+            self.invalidate()
+
+    def _load(self):
+        from caloriecounter.food.models import Unit
+
+        return Unit.objects.order_by().values(*self.UNIT_FIELDS)
+
+    def _get_state(self):
+        self.check()
+
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    # The version is read before the units, so changes in between are noticed by the next check.
+                    catalog_version = self.get_catalog_version()
+                    self._state = self._build(self._load(), catalog_version)
+                state = self._state
+
+        return state
+
+    @staticmethod
+    def _build(rows, catalog_version=None):
+        units = {row['id']: row for row in rows}
+
+        # Walk up the parents of each unit, to find its base unit and the multiplier to that base unit.
+        base_units = {}
+        to_base = {}
+        for unit_id, unit in units.items():
+            multiplier = 1
+            visited = {unit_id}
+            current = unit
+            while not current['is_base'] and current['parent_id'] in units \
+                    and current['parent_id'] not in visited:
+                multiplier = multiplier * current['base_unit_multiplier']
+                visited.add(current['parent_id'])
+                current = units[current['parent_id']]
+
+            base_units[unit_id] = current['id']
+            to_base[unit_id] = multiplier
+
+        names = {}
+        for unit_id, unit in units.items():
+            names.setdefault(unit['name'], []).append(unit_id)
+
+        families = {}
+        for unit_id, base_unit_id in base_units.items():
+            families.setdefault(base_unit_id, []).append(unit_id)
+
+        conversions = {}
+        for members in families.values():
+            for from_unit_id in members:
+                for to_unit_id in members:
+                    if from_unit_id == to_unit_id:
+                        conversions[(from_unit_id, to_unit_id)] = IDENTITY
+                    else:
+                        conversions[(from_unit_id, to_unit_id)] = Conversion(to_base[from_unit_id],
+                                                                             to_base[to_unit_id], 1)
+
+        return {
+            'units': units,
+            'base_units': base_units,
+            'names': {name: tuple(unit_ids) for name, unit_ids in names.items()},
+            'families': {base_unit_id: tuple(members) for base_unit_id, members in families.items()},
+            'conversions': conversions,
+            'catalog_version': catalog_version,
+        }
+
+    def __contains__(self, unit_id):
+        return unit_id in self._get_state()['units']
+
+    def unit(self, unit_id):
+        return self._get_state()['units'][unit_id]
+
+    def base_unit_id(self, unit_id):
+        return self._get_state()['base_units'].get(unit_id, unit_id)
+
+    def unit_ids_by_name(self, name):
+        return self._get_state()['names'].get(name, ())
+
+    def family(self, unit_id):
+        state = self._get_state()
+        return state['families'].get(state['base_units'].get(unit_id), ())
+
+    def conversion(self, from_unit_id, to_unit_id) -> Conversion:
+        try:
+            return self._get_state()['conversions'][(from_unit_id, to_unit_id)]
+        except KeyError:
+            raise ValueError('Tried to convert two unrelated units.')
+
+    def factor(self, from_unit_id, to_unit_id) -> float:
+        return self.conversion(from_unit_id, to_unit_id).factor
+
+    def convert(self, quantity, from_unit_id, to_unit_id):
+        return self.conversion(from_unit_id, to_unit_id).apply(quantity)
+
+
+# The process-wide unit graph.
+unit_graph = UnitGraph(versions=catalog_versions)
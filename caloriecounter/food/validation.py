@@ -0,0 +1,165 @@
+from collections import OrderedDict
+
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import pre_save
+
+
+# Validation on save is opt-in per model, with the validate_on_save class decorator.
+def validate_instance(sender, instance, raw=False, **kwargs):
+    # Fixtures (raw saves) are loaded as they are.
+    if raw:
+        return
+
+    instance.full_clean()
+
+
+def validate_on_save(model):
+    """
+    A class decorator that makes a model validate (full_clean) its instances whenever they are saved.
+    """
+    pre_save.connect(validate_instance, sender=model, weak=False,
+                     dispatch_uid='validate_on_save_{0}'.format(model._meta.label_lower))
+    return model
+
+
+def get_relation_errors(model, instances):
+    """
+    Check the foreign keys of a list of instances of a model with one query per relation,
+    and return a {index: {field name: [ValidationError]}} dict for the instances that refer to a missing row.
+    Related objects that are found are cached on the instances, so clean() does not have to fetch them again.
+    """
+    errors = {}
+
+    for field in model._meta.concrete_fields:
+        if not field.is_relation:
+            continue
+
+        values = {getattr(instance, field.attname) for instance in instances} - {None}
+        if not values:
+            continue
+
+        target = field.remote_field.model
+        related = target._default_manager.filter(**{field.remote_field.field_name + '__in': values}) \
+            .complex_filter(field.get_limit_choices_to()) \
+            .in_bulk(field_name=field.remote_field.field_name)
+
+        # Self referencing instances (i.e. parent units) can refer to instances in the same batch.
+        if target is model:
+            batch = {getattr(instance, field.remote_field.field_name) for instance in instances}
+        else:
+            batch = set()
+
+        for index, instance in enumerate(instances):
+            value = getattr(instance, field.attname)
+            if value is None:
+                continue
+
+            if value in related:
+                if not field.is_cached(instance):
+                    field.set_cached_value(instance, related[value])
+            elif value not in batch:
+                errors.setdefault(index, {}).setdefault(field.name, []).append(ValidationError(
+                    field.error_messages['invalid'],
+                    code='invalid',
+                    params={'model': target._meta.verbose_name, 'pk': value,
+                            'field': field.remote_field.field_name, 'value': value}))
+
+    return errors
+
+
+def get_unique_errors(model, instances):
+    """
+    Check the unique fields and unique_together constraints of a list of instances of a model,
+    with one query per constraint, and return a {index: {field name: [ValidationError]}} dict.
+    """
+    errors = {}
+    unique_checks, _ = instances[0]._get_unique_checks() if instances else ([], [])
+
+    for model_class, unique_check in unique_checks:
+        lookups = {}
+        for index, instance in enumerate(instances):
+            values = tuple(getattr(instance, model_class._meta.get_field(name).attname) for name in unique_check)
+            if any(value is None for value in values):
+                continue
+            lookups.setdefault(values, []).append(index)
+
+        if not lookups:
+            continue
+
+        query = Q()
+        for values in lookups:
+            query |= Q(**dict(zip(unique_check, values)))
+
+        existing = {}
+        for row in model_class._default_manager.filter(query).values_list('pk', *unique_check):
+            existing[row[1:]] = row[0]
+
+        for values, indexes in lookups.items():
+            for position, index in enumerate(indexes):
+                instance = instances[index]
+                # Either another row exists with these values, or an earlier instance in the batch has them.
+                if (values in existing and existing[values] != instance.pk) or position > 0:
+                    key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+                    errors.setdefault(index, {}).setdefault(key, []).append(
+                        instance.unique_error_message(model_class, unique_check))
+
+    return errors
+
+
+def validate_many(instances, validate_unique=True):
+    """
+    Validate a batch of model instances, like full_clean would, with a fixed number of queries per model
+    (instead of a number of queries per instance).
+
+    Returns a list with either None or a ValidationError for each instance.
+    """
+    results = [None] * len(instances)
+
+    by_model = OrderedDict()
+    for index, instance in enumerate(instances):
+        by_model.setdefault(type(instance), []).append(index)
+
+    for model, indexes in by_model.items():
+        batch = [instances[index] for index in indexes]
+        errors = get_relation_errors(model, batch)
+        if validate_unique:
+            for index, unique_errors in get_unique_errors(model, batch).items():
+                for name, messages in unique_errors.items():
+                    errors.setdefault(index, {}).setdefault(name, []).extend(messages)
+
+        relations = [field.name for field in model._meta.concrete_fields if field.is_relation]
+
+        # Prefetch anything else the model needs to validate a batch, i.e. product conversion tables.
+        if hasattr(model, 'prepare_validation'):
+            model.prepare_validation(batch)
+
+        for position, instance in enumerate(batch):
+            instance_errors = errors.get(position, {})
+            relations_with_errors = list(instance_errors)
+
+            try:
+                # Relations have been checked above, without a query per instance.
+                # Models that override clean_fields (to call clean_relations) are cleaned by the Model implementation.
+                models.Model.clean_fields(instance, exclude=relations + relations_with_errors)
+            except ValidationError as e:
+                instance_errors = e.update_error_dict(instance_errors)
+
+            # Models can validate fields against their (prefetched) related objects, see DiaryEntry.
+            if not instance_errors and hasattr(instance, 'clean_relations'):
+                try:
+                    instance.clean_relations(exclude=relations_with_errors)
+                except ValidationError as e:
+                    instance_errors = e.update_error_dict(instance_errors)
+
+            if not instance_errors:
+                try:
+                    instance.clean()
+                except ValidationError as e:
+                    instance_errors = e.update_error_dict(instance_errors)
+
+            if instance_errors:
+                results[indexes[position]] = ValidationError(instance_errors)
+
+    return results
@@ -61,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'caloriecounter.food.middleware.RequestCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'request_logging.middleware.LoggingMiddleware',
@@ -126,6 +127,49 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Food search results. A local memory cache evicts the least recently used entries over MAX_ENTRIES,
+    # and is warmed by every worker when it starts (see gunicorn.conf.py).
+    # Use a shared cache (i.e. memcached) to share results between processes, and to warm them once on deploy.
+    'food_search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'food_search',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+FOOD_SEARCH_CACHE = 'food_search'
+FOOD_SEARCH_CACHE_TTL = 300
+FOOD_SEARCH_CACHE_STALE_TTL = 3600
+# The number of popular searches a worker caches when it starts, with a local search result cache.
+FOOD_SEARCH_CACHE_WARM_TOP = 100
+
+# Rendered products, keyed on the version of the food product catalog (see food/fragments.py).
+FOOD_FRAGMENT_CACHE = 'default'
+FOOD_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Rolled up diary trends, keyed on the versions of the months they cover, which are kept in the database
+# (see diary/trends.py), so a per-process cache is never stale.
+DIARY_TRENDS_CACHE = 'default'
+DIARY_TRENDS_CACHE_TIMEOUT = 24 * 60 * 60
+
+# The directory catalog snapshots are written to, and served from (see the build_catalog_snapshot command).
+FOOD_CATALOG_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+# In-memory structures derived from the catalog (i.e. the unit graph) notice changes by other processes
+# within this many seconds (see food/catalog_versions.py).
+FOOD_CATALOG_VERSION_INTERVAL = 5.0
+
+# Catalog changes are returned from this many seconds before the since of a client (see food/snapshot.py).
+FOOD_CATALOG_SYNC_MARGIN = 300
+
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -159,22 +203,44 @@ REST_FRAMEWORK = {
 
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 
+    # JSON is rendered with orjson. Both renderers negotiate application/json, so the first one is used;
+    # the standard JSONRenderer takes over when the ORJSONRenderer is left out, i.e. to compare their output.
+    'DEFAULT_RENDERER_CLASSES': [
+        'caloriecounter.food.api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 
 }
 
 # Spacy configuration
-import spacy
-
-# load any spaCy models that are installed
-# This takes some time to load so doing it here instead of ad-hoc will increase performance.
-# The best place to do this would be in the voice AppConfig's ready method, but I haven't figured out a proper way to
-# both customize which models are loaded through settings, and sharing the loaded models within the app
-SUPPORTED_LANGUAGES = ['en']
+# The spaCy model of each language of the voice pipeline. Models are only loaded on first use,
+# or up front by the gunicorn hooks in gunicorn.conf.py (see caloriecounter/voice/models_registry.py).
+VOICE_LANGUAGE_MODELS = {
+    'en': 'en_core_web_sm',
+}
 
-LANGUAGE_MODELS = {}
-LANGUAGE_MODELS['en'] = spacy.load('en_core_web_sm')
+# The number of utterances that spaCy parses at once when sessions are processed in batches
+# (see process_sessions in caloriecounter/voice/pipeline.py).
+VOICE_BATCH_SIZE = 64
+
+# Whether voice sessions are processed by the process_voice_jobs command, instead of within the request.
+# Requests wait up to VOICE_INLINE_BUDGET seconds for the result, and otherwise respond with 202 Accepted,
+# after which clients long-poll the result for up to VOICE_LONG_POLL_TIMEOUT seconds per request.
+VOICE_ASYNC = False
+VOICE_INLINE_BUDGET = 2.0
+VOICE_LONG_POLL_TIMEOUT = 30.0
+
+# The number of processes (per web worker) that parse utterances, so parsing never blocks the web worker itself
+# (see caloriecounter/voice/executor.py). 0 parses utterances within the web worker.
+# At most VOICE_NLP_QUEUE_SIZE batches are queued, callers that find the queue full wait VOICE_NLP_QUEUE_TIMEOUT
+# seconds for room, before they are turned away with 503 Service Unavailable.
+VOICE_NLP_POOL_SIZE = 0
+VOICE_NLP_QUEUE_SIZE = 8
+VOICE_NLP_QUEUE_TIMEOUT = 1.0
 
 # this is used to display the language name
 LANGUAGE_MAPPING = {
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers
@@ -18,11 +19,45 @@ class VoiceSessionItemSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class VoiceSessionListSerializer(serializers.ListSerializer):
+    """
+    Creates a number of sessions, i.e. utterances that were recorded offline, and their items,
+    with a single bulk_create each.
+    """
+
+    # The maximum number of sessions that are created at once.
+    max_items = 500
+
+    def validate(self, attrs):
+        if len(attrs) > self.max_items:
+            raise serializers.ValidationError(_('At most {0} voice sessions can be created at once')
+                                              .format(self.max_items))
+
+        return attrs
+
+    def create(self, validated_data):
+        sessions = []
+        items = []
+        for session_data in validated_data:
+            session_data = dict(session_data)
+            items_data = session_data.pop('items')
+            session = VoiceSession(**session_data)
+            sessions.append(session)
+            items.extend(VoiceSessionItem(session=session, type='user_input', **item_data) for item_data in items_data)
+
+        with transaction.atomic():
+            VoiceSession.objects.bulk_create(sessions)
+            VoiceSessionItem.objects.bulk_create(items)
+
+        return sessions
+
+
 class VoiceSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = VoiceSession
         fields = ['pk', 'user_date', 'user_time', 'items']
         read_only_fields = ['pk']
+        list_serializer_class = VoiceSessionListSerializer
 
     items = VoiceSessionItemSerializer(many=True)
 
@@ -46,19 +81,16 @@ class VoiceSessionSerializer(serializers.ModelSerializer):
         items_data = validated_data.pop('items')
         session = VoiceSession.objects.create(**validated_data)
 
-        for item_data in items_data:
-            VoiceSessionItem.objects.create(session=session, type='user_input', **item_data)
+        # The created items are kept, so the view can process exactly these inputs.
+        self.created_items = [VoiceSessionItem.objects.create(session=session, type='user_input', **item_data)
+                              for item_data in items_data]
         return session
 
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items')
         instance = super().update(instance, validated_data)
 
-        for item_data in items_data:
-            VoiceSessionItem.objects.create(session=instance, type='user_input', **item_data)
+        self.created_items = [VoiceSessionItem.objects.create(session=instance, type='user_input', **item_data)
+                              for item_data in items_data]
 
         return instance
-
-
-
-
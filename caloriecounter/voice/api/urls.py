@@ -5,6 +5,7 @@ from caloriecounter.voice.api import views
 
 router = routers.DefaultRouter()
 router.register(r'voice_session', views.VoiceSessionViewSet, basename='voice_session')
+router.register(r'voice_models', views.VoiceModelStatusViewSet, basename='voice_models')
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
@@ -1,10 +1,29 @@
-from rest_framework import viewsets
+from contextlib import contextmanager
+
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, CreateModelMixin, UpdateModelMixin, DestroyModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
+from caloriecounter.voice import jobs
 from caloriecounter.voice.api.serializers import VoiceSessionSerializer
+from caloriecounter.voice.executor import ExecutorBusy, nlp_executor
 from caloriecounter.voice.models import VoiceSession
-from caloriecounter.voice.pipeline import process_session
+from caloriecounter.voice.models_registry import language_models
+from caloriecounter.voice.pipeline import get_last_inputs, process_session, process_sessions
+
+
+class VoiceServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('The voice assistant is busy, please try again later.')
+    default_code = 'service_unavailable'
+
+    # The number of seconds after which the client can try again (the Retry-After header).
+    wait = 1
 
 
 class VoiceSessionViewSet(viewsets.GenericViewSet,
@@ -26,11 +45,129 @@ class VoiceSessionViewSet(viewsets.GenericViewSet,
         return VoiceSession.objects.prefetch_related('items').filter(user=user)
 
     def perform_create(self, serializer):
-        session = serializer.save(user=self.request.user)
+        with self.reserve():
+            session = serializer.save(user=self.request.user)
 
-        process_session(session)
+            self.process(session, self.get_created_input(serializer))
 
     def perform_update(self, serializer):
-        session = serializer.save()
+        with self.reserve():
+            session = serializer.save()
+
+            self.process(session, self.get_created_input(serializer))
+
+    # Reserves room in the queue of the NLP executor before anything is saved, so a request that is turned away
+    # (with 503) leaves no session behind. Requests that are processed by a worker (VOICE_ASYNC) need no room.
+    @contextmanager
+    def reserve(self, inline=None):
+        if not (inline if inline is not None else not jobs.is_async()):
+            yield
+            return
+
+        try:
+            with nlp_executor.reserve():
+                yield
+        except ExecutorBusy:
+            raise VoiceServiceUnavailable()
+
+    # The user input that was created by a request, or None to process the last input of the session.
+    def get_created_input(self, serializer):
+        created_items = getattr(serializer, 'created_items', None)
+        return created_items[-1] if created_items else None
+
+    # Processes a user input of a session within the request, or, with VOICE_ASYNC, queues it for a worker
+    # (see jobs.py), and waits for the result within the VOICE_INLINE_BUDGET.
+    def process(self, session, item=None):
+        if not jobs.is_async():
+            try:
+                process_session(session, item)
+            except ExecutorBusy:
+                raise VoiceServiceUnavailable()
+            return
+
+        if item is None:
+            item = get_last_inputs([session]).get(session.pk)
+            if item is None:
+                # There is nothing to process.
+                return
+
+        self.job = jobs.wait(jobs.enqueue(item), jobs.get_inline_budget())
+
+    # Responds with 202 Accepted, and the URL of the result, while the job of a session is not finished.
+    def get_job_response(self, response):
+        job = getattr(self, 'job', None)
+        if job is not None and not job.finished:
+            response.status_code = status.HTTP_202_ACCEPTED
+            response['Location'] = reverse('voice_session-result', kwargs={'pk': job.session_id},
+                                           request=self.request)
+
+        return response
+
+    def create(self, request, *args, **kwargs):
+        return self.get_job_response(super().create(request, *args, **kwargs))
+
+    def update(self, request, *args, **kwargs):
+        return self.get_job_response(super().update(request, *args, **kwargs))
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """
+        Returns the session once its last queued job has finished, waiting (long-polling) for it at most
+        ?wait= seconds (up to VOICE_LONG_POLL_TIMEOUT). Responds with 202 Accepted while the job is not finished.
+        """
+        session = self.get_object()
+
+        try:
+            timeout = min(max(float(request.query_params.get('wait', 0)), 0), jobs.get_long_poll_timeout())
+        except ValueError:
+            raise ValidationError({'wait': _('A number of seconds is required.')})
+
+        self.job = session.jobs.order_by('-created_on', '-pk').first()
+        if self.job is not None and not self.job.finished:
+            self.job = jobs.wait(self.job, timeout)
+            session = self.get_object()
+
+        return self.get_job_response(Response(self.get_serializer(session).data))
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Creates and processes a number of sessions at once, i.e. utterances that were recorded offline:
+        a list of sessions, each like the sessions that are created one by one.
+
+        Returns the processed sessions. Sessions that could not be processed contain an error item,
+        like sessions that are created one by one.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with self.reserve(inline=True):
+            sessions = serializer.save(user=request.user)
+
+            if any(isinstance(result, ExecutorBusy) for result in process_sessions(sessions)):
+                raise VoiceServiceUnavailable()
+
+        processed = self.get_queryset().in_bulk([session.pk for session in sessions])
+        return Response(self.get_serializer([processed[session.pk] for session in sessions], many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class VoiceModelStatusViewSet(viewsets.ViewSet):
+    """
+    API endpoint that reports whether the language models of the voice pipeline have been loaded
+    (by the pool of the NLP executor, if it is enabled), i.e. for a readiness probe.
+    Responds with 503 until all models are loaded.
+    """
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        data = {'models': language_models.status()}
+
+        # With the NLP executor, the models are loaded by the processes of its pool instead.
+        if nlp_executor.enabled:
+            data['executor'] = nlp_executor.status()
+            ready = nlp_executor.ready
+        else:
+            ready = language_models.ready
 
-        process_session(session)
\ No newline at end of file
+        data['ready'] = ready
+        return Response(data, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -0,0 +1,188 @@
+import logging
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusy(Exception):
+    """
+    Raised when the queue of the NLP executor is full.
+    """
+    pass
+
+
+def init_worker():
+    """
+    Set up a process of the pool: Django, and the language models (see models_registry.warmup).
+    """
+    import django
+    django.setup()
+
+    from caloriecounter.voice.models_registry import warmup
+    warmup()
+
+
+def parse_in_worker(texts, batch_size=None):
+    """
+    Parse texts in a process of the pool, see pipeline.parse_texts.
+    Exceptions are returned by message, since not every exception can be sent back to the caller.
+    """
+    from caloriecounter.voice.pipeline import parse_texts
+
+    return [RuntimeError(str(result)) if isinstance(result, Exception) else result
+            for result in parse_texts(texts, batch_size)]
+
+
+def is_ready():
+    from caloriecounter.voice.models_registry import language_models
+    return language_models.ready
+
+
+class NLPExecutor:
+    """
+    Parses utterances in a pool of worker processes that have the language models loaded,
+    configured by the VOICE_NLP_POOL_SIZE setting (0, the default, parses within the calling process).
+
+    Parsing is CPU bound, and holds the GIL, so within a gevent worker it would stall every other greenlet,
+    including requests that have nothing to do with the voice pipeline. The pool only sends back the intent and
+    the extracted (plain) data of every text, so callers only wait for it, which gevent serves other requests during.
+
+    The number of batches that are queued or being parsed, per calling process, is bounded by VOICE_NLP_QUEUE_SIZE.
+    When the queue is full, callers wait at most VOICE_NLP_QUEUE_TIMEOUT seconds for room, and then get an
+    ExecutorBusy, so a spike of voice traffic is turned away instead of queueing up without bounds.
+    Callers can reserve their slot up front (see reserve), so they are turned away before they change anything.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = None
+        self._ready = False
+        # The slots that were reserved by the calling thread (or greenlet, with gevent), see reserve.
+        self._local = threading.local()
+
+    def get_pool_size(self):
+        return getattr(settings, 'VOICE_NLP_POOL_SIZE', 0)
+
+    def get_queue_size(self):
+        return getattr(settings, 'VOICE_NLP_QUEUE_SIZE', 4 * max(self.get_pool_size(), 1))
+
+    def get_queue_timeout(self):
+        return getattr(settings, 'VOICE_NLP_QUEUE_TIMEOUT', 1.0)
+
+    def get_timeout(self):
+        return getattr(settings, 'VOICE_NLP_TIMEOUT', 30.0)
+
+    @property
+    def enabled(self):
+        return self.get_pool_size() > 0
+
+    def create_pool(self):
+        # Worker processes are spawned rather than forked, since the caller might be a gevent worker with threads.
+        return ProcessPoolExecutor(max_workers=self.get_pool_size(), mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_worker)
+
+    def get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._slots is None:
+                    self._slots = threading.BoundedSemaphore(self.get_queue_size())
+                if self._pool is None:
+                    self._pool = self.create_pool()
+
+        return self._pool
+
+    def start(self):
+        """
+        Start all processes of the pool, and wait until they have loaded the language models.
+        Returns whether the models of all processes are loaded.
+        """
+        pool = self.get_pool()
+        futures = [pool.submit(is_ready) for i in range(self.get_pool_size())]
+        try:
+            self._ready = all(future.result() for future in futures)
+        except Exception:
+            logger.exception('Failed to start the NLP executor.')
+            self._ready = False
+
+        return self._ready
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def status(self):
+        return {'pool_size': self.get_pool_size(), 'queue_size': self.get_queue_size(), 'ready': self.ready}
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.get_queue_timeout()):
+            raise ExecutorBusy('Too many utterances are being processed, please try again later.')
+
+    @contextmanager
+    def reserve(self):
+        """
+        Reserve a slot of the queue for the next parse of the calling thread, which is released on exit
+        if it was not used. Raises an ExecutorBusy when the queue is full.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self.get_pool()
+        self.acquire()
+        self._local.reserved = True
+        try:
+            yield
+        finally:
+            if getattr(self._local, 'reserved', False):
+                self._local.reserved = False
+                self._slots.release()
+
+    def parse(self, texts, batch_size=None):
+        """
+        Parse texts in the pool, see pipeline.parse_texts. Raises an ExecutorBusy when the queue is full,
+        unless the caller reserved a slot.
+        """
+        pool = self.get_pool()
+        if getattr(self._local, 'reserved', False):
+            self._local.reserved = False
+        else:
+            self.acquire()
+
+        try:
+            future = pool.submit(parse_in_worker, list(texts), batch_size)
+        except Exception:
+            self._slots.release()
+            raise
+
+        # The slot is released once the task is done, rather than once the caller stops waiting for it,
+        # so tasks that time out still count towards the queue while they are running.
+        future.add_done_callback(lambda future: self._slots.release())
+
+        try:
+            return future.result(timeout=self.get_timeout())
+        except TimeoutError:
+            future.cancel()
+            raise
+        except BrokenProcessPool:
+            # A process of the pool died (i.e. it ran out of memory), the pool is replaced on the next call.
+            self.shutdown(wait=False)
+            raise
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool, self._ready = self._pool, None, False
+
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+# The process-wide NLP executor.
+nlp_executor = NLPExecutor()
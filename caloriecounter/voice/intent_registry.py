@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+from django.utils.module_loading import import_string
+
+
+def normalize_rows(matrix):
+    """
+    Scale the rows of a matrix to unit length, leaving rows of zeros (i.e. words without a vector) at zero.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class IntentRegistry:
+    """
+    The intents of the voice pipeline, with the keywords (verbs) that express them.
+
+    The keywords of all intents are embedded once per language model, into a matrix of unit vectors,
+    so scoring the verbs of an utterance against every intent is a single matrix product,
+    whose cost hardly grows with the number of intents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._intents = []
+        self._matrices = {}
+
+    def register(self, intent, keywords):
+        """
+        Register an intent, the import path of a module with a perform(doc, session) function, and its keywords.
+        The first registered intent is the default, for utterances without verbs.
+        """
+        self._intents.append((intent, list(keywords)))
+        self._matrices.clear()
+
+    def get_intent(self, index):
+        return import_string(self._intents[index][0])
+
+    def get_keyword_matrix(self, nlp):
+        """
+        Return the (keywords x vector width) matrix of unit vectors of the keywords of all intents, for a model,
+        and the index of the first keyword of every intent.
+        """
+        matrix = self._matrices.get(id(nlp))
+        if matrix is not None:
+            return matrix[1:]
+
+        with self._lock:
+            if id(nlp) not in self._matrices:
+                keywords = [keyword for intent, intent_keywords in self._intents for keyword in intent_keywords]
+                # Keywords are embedded like the tokens they are compared to, as the first token of a parsed text.
+                vectors = np.array([doc[0].vector for doc in nlp.pipe(keywords)], dtype=np.float32)
+                offsets = np.cumsum([0] + [len(intent_keywords) for intent, intent_keywords in self._intents[:-1]])
+
+                # The model is kept with its matrix, so its id is not reused by another model.
+                self._matrices[id(nlp)] = (nlp, normalize_rows(vectors), offsets)
+
+            return self._matrices[id(nlp)][1:]
+
+    def prepare(self, nlp):
+        self.get_keyword_matrix(nlp)
+
+    def score(self, nlp, tokens):
+        """
+        Return the score of every intent for the given tokens: the product, over all tokens,
+        of the highest cosine similarity of the token to any keyword of the intent.
+        """
+        matrix, offsets = self.get_keyword_matrix(nlp)
+        if not tokens:
+            return np.ones(len(self._intents))
+
+        vectors = normalize_rows(np.array([token.vector for token in tokens], dtype=np.float32))
+        if vectors.shape[1] != matrix.shape[1]:
+            # Tokens without vectors (i.e. of a blank model) are not similar to anything.
+            return np.zeros(len(self._intents))
+
+        similarities = vectors @ matrix.T
+        best = np.maximum.reduceat(np.maximum(similarities, 0), offsets, axis=1)
+
+        return np.prod(best, axis=0)
+
+    def get_probable_intent(self, nlp, tokens):
+        """
+        Return the intent the given tokens (the verbs of an utterance) most probably express.
+        """
+        if not tokens:
+            return self.get_intent(0)
+
+        return self.get_intent(int(np.argmax(self.score(nlp, tokens))))
+
+
+# The intents of the voice pipeline.
+intents = IntentRegistry()
+intents.register('caloriecounter.voice.intents.create_diary_entry.action', ['ate', 'log', 'register', 'write'])
+# intents.register('caloriecounter.voice.intents.query.action', ['are', 'is'])
+# intents.register('caloriecounter.voice.intents.recommend.action', ['should', 'recommend', 'can', 'eat', 'could'])
@@ -1,55 +1,174 @@
 from datetime import time, date, datetime
 
 from django.contrib.postgres.search import SearchVector, TrigramDistance, SearchQuery, SearchRank
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils.translation import ugettext_lazy as _
 
 from caloriecounter.diary.api.serializers import DiaryEntrySerializer
 from caloriecounter.diary.models import DiaryEntry
+from caloriecounter.diary.nutrition import attach_nutritional_information
+from caloriecounter.diary.totals import update_daily_totals
 from caloriecounter.food.models import FoodProduct, Unit, FoodProductCommonName
+from caloriecounter.food.validation import validate_many
 from caloriecounter.voice.models import VoiceSessionItem, VoiceSession
 
 from . import utils
 
 
-def perform(doc, session : VoiceSession):
-    items = []
+def perform(doc, session : VoiceSession, matches=None):
+    result = perform_many([(doc, session, matches)])[0]
+    if isinstance(result, Exception):
+        raise result
 
-    matches = utils.get_unique_matches_for_food_and_quantities(doc)
-
-    food_items = []
-    for match_id, start, end in matches:
-        food_items.append(utils.get_food_item_in_span(doc[start:end]))
-
-    items.append(
-        VoiceSessionItem(text="Got it!",
-                         session=session,
-                         type='feedback',
-                         user_created=False,
-                         data=None)
-    )
-
-    diary_entries = []
-
-    for food_item in food_items:
-        diary_entries.append(get_diary_entry(food_item, session))
-
-    for diary_entry in diary_entries:
-        diary_entry.save()
-
-    items.append(
-        VoiceSessionItem(text=None,
-                         session=session,
-                         type='objects_created',
-                         user_created=False,
-                         data=[DiaryEntrySerializer().to_representation(diary_entry)
-                               for diary_entry
-                               in diary_entries])
-    )
-
-    return items
-
-
-def get_diary_entry(food_item, session: VoiceSession):
+    return result
+
+
+def extract(doc, matches=None):
+    """
+    Return the food items of an utterance (see utils.get_food_item_in_span), as plain dicts,
+    so they can be extracted in another process (see executor.py).
+    """
+    return [utils.get_food_item_in_span(doc[start:end])
+            for match_id, start, end in utils.get_unique_matches_for_food_and_quantities(doc, matches)]
+
+
+def perform_many(requests):
+    """
+    Perform this intent for a batch of (doc, session, matches) requests at once, see perform_extracted.
+    """
+    return perform_extracted([(extract(doc, matches), session) for doc, session, matches in requests])
+
+
+def perform_extracted(requests, dry_run=False):
+    """
+    Perform this intent for a batch of (food items, session) requests at once, with the food items of extract:
+    the food items of all utterances are resolved together (see FoodItemResolver), validated with validate_many,
+    and the diary entries of all requests are written with a single bulk_create.
+    With dry_run, the entries are only validated, and returned in the VoiceSessionItems, but not saved.
+
+    Returns, for every request, either its (unsaved) VoiceSessionItems, or the exception that failed it.
+    A request fails as a whole, without creating any of its entries, like a single request would.
+    """
+    food_items = [items for items, session in requests]
+
+    resolver = FoodItemResolver([food_item for items in food_items for food_item in items])
+    diary_entries = [[get_diary_entry(food_item, session, resolver) for food_item in items]
+                     for items, session in requests]
+
+    results = [None] * len(requests)
+
+    for index, (items, entries) in enumerate(zip(food_items, diary_entries)):
+        for food_item, entry in zip(items, entries):
+            if entry.product_id is None:
+                results[index] = ValidationError(
+                    {'product': _('Could not find a product for "{0}"').format(food_item.get('raw'))})
+                break
+
+    batch = [(index, entry) for index, entries in enumerate(diary_entries) if results[index] is None
+             for entry in entries]
+    for (index, entry), error in zip(batch, validate_many([entry for index, entry in batch], validate_unique=False)):
+        if error is not None and results[index] is None:
+            results[index] = error
+
+    created = [entry for index, entry in batch if results[index] is None]
+    for entry in created:
+        entry.quantity_in_default_unit = entry.compute_quantity_in_default_unit()
+
+    if not dry_run:
+        with transaction.atomic():
+            DiaryEntry.objects.bulk_create(created)
+            update_daily_totals(added=created)
+
+        for entry in created:
+            entry.store_saved_state()
+
+    # The nutritional information of all entries is computed at once.
+    attach_nutritional_information(created)
+    serializer = DiaryEntrySerializer()
+
+    for index, (items, session) in enumerate(requests):
+        if results[index] is not None:
+            continue
+
+        results[index] = [
+            VoiceSessionItem(text="Got it!",
+                             session=session,
+                             type='feedback',
+                             user_created=False,
+                             data=None),
+            VoiceSessionItem(text=None,
+                             session=session,
+                             type='objects_created',
+                             user_created=False,
+                             data=[serializer.to_representation(diary_entry)
+                                   for diary_entry
+                                   in diary_entries[index]])
+        ]
+
+    return results
+
+
+class FoodItemResolver:
+    """
+    Finds the units and products of the food items of a batch of utterances.
+
+    The common names of all items are looked up with a single query, and units and products are searched
+    once per distinct text, so utterances that mention the same foods share their lookups.
+    """
+
+    def __init__(self, food_items):
+        self.units = {}
+        self.products = {}
+
+        names = set()
+        for food_item in food_items:
+            names.update(text.lower() for text in self.get_common_names(food_item))
+
+        # Names that are shared by several products resolve to the first one.
+        self.common_names = {}
+        if names:
+            common_names = FoodProductCommonName.objects.annotate(lower_text=Lower('text')) \
+                .filter(lower_text__in=names).select_related('food_product').order_by('pk')
+            for common_name in common_names:
+                self.common_names.setdefault(common_name.lower_text, common_name.food_product)
+
+    def get_common_names(self, food_item):
+        return [food_item.get('name'), '{0} {1}'.format(food_item.get('extra'), food_item.get('name'))]
+
+    def get_unit(self, food_item):
+        text = food_item.get('unit')
+        if text not in self.units:
+            vector = SearchVector('name', '_name_plural', 'short_name')
+            query = SearchQuery(text)
+            self.units[text] = Unit.objects.annotate(rank=SearchRank(vector, query)).order_by('-rank').first()
+
+        return self.units[text]
+
+    def get_product(self, food_item):
+        # 1.
+        for text in self.get_common_names(food_item):
+            product = self.common_names.get(text.lower())
+            if product is not None:
+                return product
+
+        # 2.
+        key = (food_item.get('name'), food_item.get('extra'))
+        if key not in self.products:
+            self.products[key] = FoodProduct.objects.annotate(
+                distance = TrigramDistance('full_name', '{0} {1}'
+                                           .format(food_item.get('name'), food_item.get('extra'))))\
+                .filter(Q(food_source='sr_legacy_food') | Q(food_source='survey_fndds_food'))\
+                .filter(full_name__istartswith= food_item.get('name')) \
+                .filter(distance__lte=0.7)\
+                .order_by('distance').first()
+
+        return self.products[key]
+
+
+def get_diary_entry(food_item, session: VoiceSession, resolver=None):
     # return {
     #     'quantity': str(number_of_items),
     #     'unit': str(unit_of_items),
@@ -62,50 +181,18 @@ def get_diary_entry(food_item, session: VoiceSession):
     # 1. Find the product in the FoodProductSearchCache (High probability of matching a common food.)
     # 2. Find the product in the sr_legacy_food and survey_fndds_food group.
     # 3. Find the product in all FoodProducts.
-
-    print(food_item)
+    # The lookups are shared by the food items of a batch of utterances, see FoodItemResolver.
+    if resolver is None:
+        resolver = FoodItemResolver([food_item])
 
     try:
         quantity = float(food_item.get('quantity'))
     except:
         quantity = 1
 
-    vector = SearchVector('name', '_name_plural', 'short_name')
-    query = SearchQuery(food_item.get('unit'))
-    unit = Unit.objects.annotate(rank=SearchRank(vector, query)).order_by('-rank').first()
-    product = None
-
-    # 1.
-    try:
-        search_cache_item = FoodProductCommonName.objects.get(text__iexact=food_item.get('name'))
-        product = search_cache_item.food_product
-    except FoodProductCommonName.DoesNotExist:
-        search_cache_item = None
-
-    if not search_cache_item:
-        try:
-            search_cache_item = FoodProductCommonName.objects\
-                .get(text__iexact='{0} {1}'.format(food_item.get('extra'), food_item.get('name')))
-            product = search_cache_item.food_product
-        except FoodProductCommonName.DoesNotExist:
-            search_cache_item = None
-
-    # 2.
-    if not product:
-        product = FoodProduct.objects.annotate(
-            distance = TrigramDistance('full_name', '{0} {1}'
-                                       .format(food_item.get('name'), food_item.get('extra'))))\
-            .filter(Q(food_source='sr_legacy_food') | Q(food_source='survey_fndds_food'))\
-            .filter(full_name__istartswith= food_item.get('name')) \
-            .filter(distance__lte=0.7)\
-            .order_by('distance').first()
-
-    diary_entry = DiaryEntry(user=session.user,
-                             product=product,
-                             quantity= quantity,
-                             unit=unit,
-                             date=datetime.now(),
-                             time=datetime.now())
-
-    diary_entry.full_clean()
-    return diary_entry
+    return DiaryEntry(user=session.user,
+                      product=resolver.get_product(food_item),
+                      quantity= quantity,
+                      unit=resolver.get_unit(food_item),
+                      date=session.user_date,
+                      time=session.user_time)
@@ -1,32 +1,17 @@
 from operator import itemgetter
 
-from django.conf import settings
-from spacy.matcher import Matcher
+from caloriecounter.voice.matcher_registry import matchers
 
-nlp = settings.LANGUAGE_MODELS['en']
 
+def get_unique_matches_for_food_and_quantities(doc, matches=None):
+    """
+    Return the longest, non-overlapping matches of quantities of food in a Doc,
+    from the matches of matchers.match(doc), if given.
+    """
+    if matches is None:
+        matches = matchers.match(doc)
 
-def get_unique_matches_for_food_and_quantities(doc):
-    for chunk in doc.noun_chunks:
-        print(chunk)
-    matcher = Matcher(nlp.vocab)
-
-    patterns = []
-    # 2 grams of chicken breast or 2 hamburgers from McDonalds
-    patterns.append([{"POS": "NUM"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}, {"OP": "?", "POS": "ADP"},
-                     {"OP": "*", "POS": "ADJ"}, {"OP": "*", "POS": {"IN": ["NOUN", "PROPN"]}}])
-
-    # A slice of bread
-    patterns.append(
-        [{"POS": "DET", "OP": "?"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}, {"OP": "?", "POS": "ADP"},
-         {"OP": "*", "POS": "ADJ"}, {"OP": "*", "POS": {"IN": ["NOUN", "PROPN"]}}])
-
-    # A raw broccoli stalk
-    patterns.append([{"POS": "DET"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}])
-
-    matcher.add("quantities-of-food", None, *patterns)
-
-    matches = matcher(doc)
+    matches = list(matches['quantities-of-food'])
     matches.sort(key=itemgetter(2), reverse=True)
     matches.sort(key=itemgetter(1))
 
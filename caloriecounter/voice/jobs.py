@@ -0,0 +1,110 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from caloriecounter.voice.models import VoiceSessionJob
+from caloriecounter.voice.pipeline import get_batch_size, process_inputs
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_async():
+    """
+    Whether voice sessions are processed by a worker (see the process_voice_jobs command),
+    instead of within the request, by the VOICE_ASYNC setting.
+    """
+    return getattr(settings, 'VOICE_ASYNC', False)
+
+
+def get_inline_budget():
+    # The number of seconds a request waits for its job, before it responds with 202 Accepted.
+    return getattr(settings, 'VOICE_INLINE_BUDGET', 2.0)
+
+
+def get_long_poll_timeout():
+    # The maximum number of seconds a client can wait for the result of a job.
+    return getattr(settings, 'VOICE_LONG_POLL_TIMEOUT', 30.0)
+
+
+def get_poll_interval():
+    return getattr(settings, 'VOICE_JOB_POLL_INTERVAL', 0.2)
+
+
+def get_max_attempts():
+    return getattr(settings, 'VOICE_JOB_MAX_ATTEMPTS', 3)
+
+
+def enqueue(item):
+    """
+    Queue a user input (a VoiceSessionItem) of a session to be processed by a worker.
+    """
+    return VoiceSessionJob.objects.create(session_id=item.session_id, item=item)
+
+
+def wait(job, timeout):
+    """
+    Wait at most timeout seconds for a job to finish, and return it with its current state.
+    With gevent, the worker serves other requests while a request waits.
+    """
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        time.sleep(min(get_poll_interval(), remaining))
+        job.refresh_from_db(fields=['state', 'finished_on', 'error'])
+
+    return job
+
+
+def process_jobs(batch_size=None, n_process=1):
+    """
+    Claim the oldest pending jobs, at most batch_size, and process their user inputs in a single batch
+    (see process_inputs). Returns the number of claimed jobs.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can process jobs
+    at once without claiming the same job, and remain locked until their results are committed.
+    A worker that dies releases its jobs, which are then claimed again. Jobs that fail as a whole
+    (i.e. the model can not be loaded) are retried, up to VOICE_JOB_MAX_ATTEMPTS times.
+    """
+    claimed = []
+    try:
+        with transaction.atomic():
+            claimed = list(VoiceSessionJob.objects.select_for_update(skip_locked=True, of=('self',))
+                           .filter(state=VoiceSessionJob.STATE_PENDING)
+                           .select_related('item', 'item__session')
+                           .order_by('created_on')[:batch_size or get_batch_size()])
+            if not claimed:
+                return 0
+
+            # Every job processes its own input, so updates of a session in the same batch are all processed.
+            results = process_inputs([job.item for job in claimed], batch_size=batch_size, n_process=n_process)
+
+            now = timezone.now()
+            for job, result in zip(claimed, results):
+                job.state = VoiceSessionJob.STATE_FAILED if isinstance(result, Exception) \
+                    else VoiceSessionJob.STATE_DONE
+                job.error = str(result) if isinstance(result, Exception) else ''
+                job.finished_on = now
+                job.attempts += 1
+
+            VoiceSessionJob.objects.bulk_update(claimed, ['state', 'error', 'finished_on', 'attempts'])
+
+    except Exception as e:
+        if not claimed:
+            raise
+
+        logger.exception('Failed to process %s voice session jobs.', len(claimed))
+
+        pks = [job.pk for job in claimed]
+        VoiceSessionJob.objects.filter(pk__in=pks).update(attempts=F('attempts') + 1, error=str(e))
+        VoiceSessionJob.objects.filter(pk__in=pks, attempts__gte=get_max_attempts()) \
+            .update(state=VoiceSessionJob.STATE_FAILED, finished_on=timezone.now())
+
+    return len(claimed)
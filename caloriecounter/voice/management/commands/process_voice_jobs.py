@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from caloriecounter.voice.jobs import get_poll_interval, process_jobs
+from caloriecounter.voice.models_registry import warmup
+from caloriecounter.voice.pipeline import get_batch_size
+
+
+class Command(BaseCommand):
+    help = 'Processes the queued voice session jobs (see VOICE_ASYNC), in batches, until it is stopped. ' \
+           'Any number of workers can run at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=get_batch_size(),
+                            help='The maximum number of jobs that are claimed, and processed, at once.')
+        parser.add_argument('--n-process', type=int, default=1,
+                            help='The number of processes that spaCy parses the utterances of a batch with.')
+        parser.add_argument('--idle-interval', type=float, default=None,
+                            help='The number of seconds to wait for new jobs when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Stop once the queue is empty, instead of waiting for new jobs.')
+
+    def handle(self, *args, **options):
+        # The models are loaded before the first job is claimed, so jobs are not held while loading them.
+        warmup()
+
+        idle_interval = options['idle_interval'] or get_poll_interval()
+        processed = 0
+        try:
+            while True:
+                count = process_jobs(batch_size=options['batch_size'], n_process=options['n_process'])
+                processed += count
+
+                if count:
+                    self.stdout.write('Processed {0} jobs.'.format(processed))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(idle_interval)
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('Processed {0} jobs.'.format(processed)))
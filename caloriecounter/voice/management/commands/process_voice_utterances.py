@@ -0,0 +1,131 @@
+import sys
+from datetime import datetime
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from caloriecounter.user.models import User
+from caloriecounter.voice.models import VoiceSession, VoiceSessionItem
+from caloriecounter.voice.pipeline import get_batch_size, get_last_inputs, process_sessions
+
+
+class Command(BaseCommand):
+    help = 'Processes voice utterances in batches: either utterances that were recorded offline, ' \
+           'from a file with one utterance per line (or - for stdin), which are added as new sessions of a user, ' \
+           'or, with --reprocess, the last utterance of existing sessions, i.e. after the voice patterns changed. ' \
+           'Reprocessing is a dry run: it only replaces the responses of the sessions, not the diary entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            help='A file with one utterance per line, or - to read the utterances from stdin.')
+        parser.add_argument('--user', metavar='USERNAME',
+                            help='The user of the utterances, or of the sessions that are reprocessed.')
+        parser.add_argument('--reprocess', action='store_true',
+                            help='Reprocess the existing sessions, instead of utterances from a file.')
+        parser.add_argument('--since', metavar='DATE',
+                            help='Only reprocess the sessions that were created on or after this date.')
+        parser.add_argument('--batch-size', type=int, default=get_batch_size(),
+                            help='The number of utterances that spaCy parses at once.')
+        parser.add_argument('--n-process', type=int, default=1,
+                            help='The number of processes that spaCy parses the utterances with.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='The number of sessions that are processed, and written, at once.')
+
+    def get_user(self, username):
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError('Unknown user: {0}'.format(username))
+
+    def get_sessions(self, options):
+        sessions = VoiceSession.objects.order_by('created_on', 'pk')
+        if options['user']:
+            sessions = sessions.filter(user=self.get_user(options['user']))
+
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('Invalid date: {0}'.format(options['since']))
+            sessions = sessions.filter(created_on__date__gte=since)
+
+        return sessions.iterator()
+
+    def read_utterances(self, path):
+        """
+        Return the non-empty lines of a file, or of stdin.
+        """
+        if path == '-':
+            lines = sys.stdin
+        else:
+            try:
+                lines = open(path, encoding='utf-8')
+            except OSError as e:
+                raise CommandError('Could not read {0}: {1}'.format(path, e))
+
+        with lines:
+            for line in lines:
+                if line.strip():
+                    yield line.strip()
+
+    def create_sessions(self, user, texts):
+        """
+        Add every text as the user input of a new session of the user, with a bulk_create per model.
+        """
+        now = datetime.now()
+        sessions = [VoiceSession(user=user, user_date=now.date(), user_time=now.time()) for text in texts]
+
+        with transaction.atomic():
+            VoiceSession.objects.bulk_create(sessions)
+            VoiceSessionItem.objects.bulk_create([VoiceSessionItem(session=session, type='user_input', text=text)
+                                                  for session, text in zip(sessions, texts)])
+
+        return sessions
+
+    def delete_responses(self, sessions):
+        """
+        Delete the responses to the last user input of every session, which are replaced when it is reprocessed.
+        """
+        last_inputs = get_last_inputs(sessions)
+        for session in sessions:
+            item = last_inputs.get(session.pk)
+            if item is not None:
+                VoiceSessionItem.objects.filter(session=session, user_created=False, created_on__gte=item.created_on) \
+                    .delete()
+
+    def get_chunks(self, iterable, chunk_size):
+        iterable = iter(iterable)
+        while True:
+            chunk = list(islice(iterable, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def handle(self, *args, **options):
+        if options['reprocess'] == bool(options['path']):
+            raise CommandError('Pass either the path of a file with utterances, or --reprocess.')
+
+        if options['reprocess']:
+            chunks = self.get_chunks(self.get_sessions(options), options['chunk_size'])
+        else:
+            if not options['user']:
+                raise CommandError('Pass the --user of the utterances.')
+            user = self.get_user(options['user'])
+            chunks = (self.create_sessions(user, texts)
+                      for texts in self.get_chunks(self.read_utterances(options['path']), options['chunk_size']))
+
+        processed = failed = 0
+        for sessions in chunks:
+            # Reprocessing does not add to the diaries of the users, the sessions already created their entries.
+            with transaction.atomic():
+                if options['reprocess']:
+                    self.delete_responses(sessions)
+                results = process_sessions(sessions, batch_size=options['batch_size'], n_process=options['n_process'],
+                                           dry_run=options['reprocess'])
+            failed += sum(1 for result in results if isinstance(result, Exception))
+            processed += len(results)
+
+            self.stdout.write('Processed {0} sessions.'.format(processed))
+
+        self.stdout.write(self.style.SUCCESS('Processed {0} sessions, of which {1} failed.'.format(processed, failed)))
@@ -0,0 +1,73 @@
+import threading
+
+from spacy.matcher import Matcher
+
+
+class MatcherRegistry:
+    """
+    The token patterns of the voice pipeline, by name, i.e. the verbs that express an intent,
+    and the quantities of food that an utterance lists.
+
+    All patterns are compiled once per vocabulary (i.e. per language model) into a single Matcher,
+    so a Doc is matched against every pattern in a single pass, whose matches serve both
+    intent detection and item extraction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._patterns = {}
+        self._matchers = {}
+
+    def register(self, name, patterns):
+        self._patterns[name] = list(patterns)
+        self._matchers.clear()
+
+    def get_matcher(self, vocab):
+        matcher = self._matchers.get(id(vocab))
+        if matcher is not None:
+            return matcher[1]
+
+        with self._lock:
+            if id(vocab) not in self._matchers:
+                matcher = Matcher(vocab)
+                for name, patterns in self._patterns.items():
+                    matcher.add(name, patterns)
+
+                # The vocabulary is kept with its matcher, so its id is not reused by another vocabulary.
+                self._matchers[id(vocab)] = (vocab, matcher)
+
+            return self._matchers[id(vocab)][1]
+
+    def match(self, doc):
+        """
+        Return the (match_id, start, end) matches of every pattern in a Doc, by pattern name.
+        """
+        matches = {name: [] for name in self._patterns}
+        strings = doc.vocab.strings
+        for match_id, start, end in self.get_matcher(doc.vocab)(doc):
+            matches[strings[match_id]].append((match_id, start, end))
+
+        return matches
+
+
+# The patterns of the voice pipeline.
+matchers = MatcherRegistry()
+
+# I ate ...
+matchers.register('subject-and-main-verb', [
+    # [{"POS": "PRON"}, {"IS_STOP" : True, "OP" : "?"} ,{"POS": "VERB"}],
+    [{"POS": "VERB"}],
+])
+
+matchers.register('quantities-of-food', [
+    # 2 grams of chicken breast or 2 hamburgers from McDonalds
+    [{"POS": "NUM"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}, {"OP": "?", "POS": "ADP"},
+     {"OP": "*", "POS": "ADJ"}, {"OP": "*", "POS": {"IN": ["NOUN", "PROPN"]}}],
+
+    # A slice of bread
+    [{"POS": "DET", "OP": "?"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}, {"OP": "?", "POS": "ADP"},
+     {"OP": "*", "POS": "ADJ"}, {"OP": "*", "POS": {"IN": ["NOUN", "PROPN"]}}],
+
+    # A raw broccoli stalk
+    [{"POS": "DET"}, {"OP": "*", "POS": "ADJ"}, {"OP": "+", "POS": {"IN": ["NOUN", "PROPN"]}}],
+])
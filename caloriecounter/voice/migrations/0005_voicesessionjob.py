@@ -0,0 +1,34 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voice', '0004_voicesessionresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoiceSessionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='state')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+                ('finished_on', models.DateTimeField(blank=True, null=True, verbose_name='finished on')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='voice.VoiceSession', verbose_name='voice session')),
+            ],
+            options={
+                'verbose_name': 'voice session job',
+                'ordering': ['created_on'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='voicesessionjob',
+            index=models.Index(fields=['state', 'created_on'], name='voice_voice_state_0fc745_idx'),
+        ),
+    ]
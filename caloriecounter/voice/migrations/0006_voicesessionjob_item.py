@@ -0,0 +1,43 @@
+# Generated by Django 2.2.4 on 2026-10-18 21:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_item(apps, schema_editor):
+    """
+    Link every existing job to the last user input of its session that was created before the job.
+    Jobs without such an input can not be processed, and are removed.
+    """
+    VoiceSessionJob = apps.get_model('voice', 'VoiceSessionJob')
+    VoiceSessionItem = apps.get_model('voice', 'VoiceSessionItem')
+
+    for job in VoiceSessionJob.objects.all().iterator():
+        item = VoiceSessionItem.objects.filter(session_id=job.session_id, type='user_input',
+                                               created_on__lte=job.created_on) \
+            .order_by('-created_on', '-pk').first()
+        if item is None:
+            job.delete()
+        else:
+            VoiceSessionJob.objects.filter(pk=job.pk).update(item=item)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voice', '0005_voicesessionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voicesessionjob',
+            name='item',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='voice.VoiceSessionItem', verbose_name='voice session item'),
+        ),
+        migrations.RunPython(backfill_item, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='voicesessionjob',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='voice.VoiceSessionItem', verbose_name='voice session item'),
+        ),
+    ]
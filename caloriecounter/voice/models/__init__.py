@@ -1,3 +1,4 @@
 from .voice_session import *
 from .voice_session_item import *
+from .voice_session_job import *
 from .voice_session_response import *
\ No newline at end of file
@@ -0,0 +1,52 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from caloriecounter.voice.models.voice_session import VoiceSession
+from caloriecounter.voice.models.voice_session_item import VoiceSessionItem
+
+
+VOICE_SESSION_JOB_STATES = [
+    ('pending', _('Pending')),
+    ('done', _('Done')),
+    ('failed', _('Failed')),
+]
+
+
+class VoiceSessionJob(models.Model):
+    """
+    A queued request to process a user input of a voice session, see jobs.py.
+    """
+    class Meta:
+        verbose_name = _('voice session job')
+        ordering = ['created_on']
+        indexes = [
+            # Covers claiming the oldest pending jobs.
+            models.Index(fields=['state', 'created_on']),
+        ]
+
+    STATE_PENDING = 'pending'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    session = models.ForeignKey(verbose_name=_('voice session'),
+                                to=VoiceSession,
+                                related_name='jobs',
+                                on_delete=models.CASCADE)
+
+    item = models.ForeignKey(verbose_name=_('voice session item'),
+                             to=VoiceSessionItem,
+                             related_name='jobs',
+                             on_delete=models.CASCADE)
+
+    state = models.CharField(verbose_name=_('state'), max_length=16, choices=VOICE_SESSION_JOB_STATES,
+                             default=STATE_PENDING)
+
+    created_on = models.DateTimeField(verbose_name=_('created on'), auto_now_add=True)
+    finished_on = models.DateTimeField(verbose_name=_('finished on'), null=True, blank=True)
+
+    attempts = models.PositiveIntegerField(verbose_name=_('attempts'), default=0)
+    error = models.TextField(verbose_name=_('error'), blank=True, default='')
+
+    @property
+    def finished(self):
+        return self.state != self.STATE_PENDING
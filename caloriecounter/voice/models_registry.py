@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# The load states of a language model.
+NOT_LOADED = 'not_loaded'
+LOADING = 'loading'
+LOADED = 'loaded'
+FAILED = 'failed'
+
+
+class LanguageModelRegistry:
+    """
+    The spaCy models of the voice pipeline, per language, configured by the VOICE_LANGUAGE_MODELS setting:
+    {language code: model name or path}.
+
+    Models take seconds, and hundreds of megabytes, to load, so they are only loaded on first use,
+    and then shared by everything in the process. Servers can load them up front with warmup(),
+    i.e. in the gunicorn master with preload_app, so forked workers share the loaded models (see gunicorn.conf.py).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._states = {}
+
+    def get_config(self):
+        return getattr(settings, 'VOICE_LANGUAGE_MODELS', {'en': 'en_core_web_sm'})
+
+    @property
+    def languages(self):
+        return list(self.get_config())
+
+    def load_model(self, name):
+        import spacy
+
+        return spacy.load(name)
+
+    def get(self, language='en'):
+        """
+        Return the model of a language, loading it if it has not been loaded yet.
+        Raises a LookupError for a language without a model, and an OSError for a model that is not installed.
+        """
+        model = self._models.get(language)
+        if model is not None:
+            return model
+
+        config = self.get_config()
+        if language not in config:
+            raise LookupError('No spaCy model is configured for language "{0}".'.format(language))
+
+        # Models are loaded once, while other threads (or greenlets) that need the same model wait for it.
+        with self._lock:
+            model = self._models.get(language)
+            if model is not None:
+                return model
+
+            self._states[language] = {'state': LOADING}
+            started = time.monotonic()
+            try:
+                model = self.load_model(config[language])
+            except Exception as e:
+                self._states[language] = {'state': FAILED, 'error': str(e)}
+                raise
+
+            self._models[language] = model
+            self._states[language] = {'state': LOADED, 'load_seconds': round(time.monotonic() - started, 3)}
+            logger.info('Loaded spaCy model %s in %.1f seconds.', config[language],
+                        self._states[language]['load_seconds'])
+
+        return model
+
+    def warmup(self, languages=None):
+        """
+        Load the models of the given (or all configured) languages. Models that fail to load are logged,
+        and reported by status(), instead of failing the caller, i.e. a server that is starting.
+        Returns whether all models are loaded.
+        """
+        for language in languages or self.languages:
+            try:
+                self.get(language)
+            except Exception:
+                logger.exception('Failed to load the spaCy model for language "%s".', language)
+
+        return self.ready
+
+    def is_loaded(self, language):
+        return language in self._models
+
+    @property
+    def ready(self):
+        return all(self.is_loaded(language) for language in self.languages)
+
+    def status(self):
+        """
+        Return the load state of the model of every configured language.
+        """
+        return {language: dict({'model': name, 'state': NOT_LOADED}, **self._states.get(language, {}))
+                for language, name in self.get_config().items()}
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._states.clear()
+
+
+# The process-wide registry of language models.
+language_models = LanguageModelRegistry()
+
+
+def get_language_model(language='en'):
+    return language_models.get(language)
+
+
+def warmup(languages=None):
+    """
+    Load the language models up front, and embed the keywords of the intents with them.
+    Gunicorn calls this from gunicorn.conf.py.
+    """
+    from caloriecounter.voice.intent_registry import intents
+
+    ready = language_models.warmup(languages)
+    for language in languages or language_models.languages:
+        if language_models.is_loaded(language):
+            intents.prepare(language_models.get(language))
+
+    return ready
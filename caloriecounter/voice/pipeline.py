@@ -1,39 +1,175 @@
+from collections import OrderedDict
+from importlib import import_module
+
+from django.conf import settings
+
 import caloriecounter.voice.utils as utils
+from caloriecounter.food.request_cache import request_cache
+from .executor import nlp_executor
+from .matcher_registry import matchers
 from .models import VoiceSession, VoiceSessionItem
+from .models_registry import get_language_model
 
-from django.conf import settings
 
-nlp = settings.LANGUAGE_MODELS['en']
+def get_batch_size():
+    return getattr(settings, 'VOICE_BATCH_SIZE', 64)
 
 
-def process_session(session : VoiceSession):
+def process_session(session : VoiceSession, item=None):
+    """
+    Process a user input of a session, by default its last one.
+    """
+    if item is None:
+        result = process_sessions([session])[0]
+    else:
+        item.session = session
+        result = process_inputs([item])[0]
 
-    try:
-        # Get last item from VoiceSession, this is the users last query.
-        last_item = session.items.last()
-        text = last_item.text
-        doc = nlp(text)
+    if isinstance(result, Exception):
+        raise result
+
+    # Return the updated session.
+    return result
+
+
+def get_last_inputs(sessions):
+    """
+    Return the last user input of every session (the users last query), by session pk, with a single query.
+    """
+    items = VoiceSessionItem.objects.filter(session__in=[session.pk for session in sessions], type='user_input') \
+        .order_by('session_id', '-created_on', '-pk').distinct('session_id')
+
+    return {item.session_id: item for item in items}
+
+
+def parse_texts(texts, batch_size=None, n_process=1):
+    """
+    Parse texts with nlp.pipe, in batches of batch_size (by default the VOICE_BATCH_SIZE setting),
+    optionally in n_process processes, and extract their intents.
+
+    Returns, for every text, either the name of the module of its intent and the data the intent extracted
+    from it (plain, serializable values, so texts can be parsed in other processes, see executor.py),
+    or the exception that failed it.
+    """
+    nlp = get_language_model('en')
+
+    results = []
+    for doc in nlp.pipe(texts, batch_size=batch_size or get_batch_size(), n_process=n_process):
+        try:
+            # Match all patterns in a single pass, for both the intent and the action.
+            matches = matchers.match(doc)
+            intent = utils.get_probable_intent(doc, matches)
+            results.append((intent.__name__, intent.extract(doc, matches)))
+        except Exception as e:
+            results.append(e)
+
+    return results
+
+
+def process_sessions(sessions, batch_size=None, n_process=1, dry_run=False):
+    """
+    Process the last user input of a number of sessions at once, see process_inputs.
+
+    Returns, for every session, either the session, or the exception that failed it,
+    in which case an error item is added to that session.
+    """
+    last_inputs = get_last_inputs(sessions)
 
-        # Extract the intent from the text, and perform the action that is linked to this intent.
-        intent = utils.get_probable_intent(doc)
+    # A session without user input fails like an empty input.
+    inputs = []
+    for session in sessions:
+        item = last_inputs.get(session.pk) or VoiceSessionItem(type='user_input', text=None)
+        item.session = session
+        inputs.append(item)
 
-        items = intent.perform(doc, session)
+    return process_inputs(inputs, batch_size, n_process, dry_run)
 
-        # Save all voice session items from the conversation.
-        for item in items:
-            item.save()
 
-        # Return the updated session.
-        return session
+def get_error_item(session, exception):
+    return VoiceSessionItem(text="Uh oh! Something went wrong. Could you try that again?",
+                            session=session,
+                            type='feedback',
+                            user_created=False,
+                            data={
+                                'exception': str(exception)
+                            })
 
+
+def process_inputs(inputs, batch_size=None, n_process=1, dry_run=False):
+    """
+    Process a number of user inputs (VoiceSessionItems, with their sessions) at once.
+
+    The texts are parsed together (see parse_texts), in the pool of the NLP executor if it is enabled.
+    Every intent then performs the requests of all inputs at once, with perform_extracted,
+    and the VoiceSessionItems of all sessions are written with a single bulk_create.
+
+    With dry_run, the intents do not change anything but the VoiceSessionItems, see perform.
+
+    Returns, for every input, either its session, or the exception that failed it,
+    in which case an error item is added to its session.
+    """
+    inputs = list(inputs)
+    sessions = [item.session for item in inputs]
+    results = [None] * len(inputs)
+
+    texts = []
+    indexes = []
+    for index, item in enumerate(inputs):
+        if not item.text:
+            results[index] = ValueError('The session has no user input.')
+            continue
+
+        texts.append(item.text)
+        indexes.append(index)
+
+    try:
+        if nlp_executor.enabled and n_process == 1:
+            parsed = nlp_executor.parse(texts, batch_size)
+        else:
+            parsed = parse_texts(texts, batch_size, n_process)
     except Exception as e:
-        VoiceSessionItem(text="Uh oh! Something went wrong. Could you try that again?",
-                         session=session,
-                         type='feedback',
-                         user_created=False,
-                         data={
-                             'exception': str(e)
-                         }).save()
+        # i.e. the executor is busy, see ExecutorBusy.
+        parsed = [e] * len(texts)
+
+    # Group the requests by the action that is linked to their intent.
+    requests = OrderedDict()
+    for index, result in zip(indexes, parsed):
+        if isinstance(result, Exception):
+            results[index] = result
+            continue
 
-        raise e
+        intent, data = result
+        requests.setdefault(intent, []).append((index, (data, sessions[index])))
 
+    items = []
+
+    with request_cache.scope():
+        for intent, intent_requests in requests.items():
+            for (index, request), result in zip(intent_requests, perform(intent, [request for index, request
+                                                                                  in intent_requests], dry_run)):
+                if isinstance(result, Exception):
+                    results[index] = result
+                else:
+                    items.extend(result)
+                    results[index] = sessions[index]
+
+    for session, result in zip(sessions, results):
+        if isinstance(result, Exception):
+            items.append(get_error_item(session, result))
+
+    # Save all voice session items from the conversations.
+    VoiceSessionItem.objects.bulk_create(items)
+
+    return results
+
+
+def perform(intent, requests, dry_run=False):
+    """
+    Perform an intent, by the name of its module, for a list of (data, session) requests,
+    and return the items (or the exception) of every request.
+    With dry_run, the intent only returns the items, without performing its action (i.e. creating diary entries).
+    """
+    try:
+        return import_module(intent).perform_extracted(requests, dry_run=dry_run)
+    except Exception as e:
+        return [e] * len(requests)
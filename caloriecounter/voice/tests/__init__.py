@@ -1 +1,7 @@
-from .intents import *
\ No newline at end of file
+from .intents import *
+from .executor import *
+from .intent_registry import *
+from .jobs import *
+from .matcher_registry import *
+from .models_registry import *
+from .pipeline import *
@@ -0,0 +1,116 @@
+import datetime
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from caloriecounter.diary.models import DiaryEntry
+from caloriecounter.diary.tests import DiaryEntryBaseTest
+from caloriecounter.food.models import FoodProductCommonName
+from caloriecounter.voice.executor import ExecutorBusy, NLPExecutor, parse_in_worker
+from caloriecounter.voice.models import VoiceSession, VoiceSessionItem
+from caloriecounter.voice.models_registry import language_models
+from caloriecounter.voice.pipeline import process_sessions
+from caloriecounter.voice.tests.pipeline import TaggingModel
+
+
+class ThreadNLPExecutor(NLPExecutor):
+    """
+    An NLPExecutor with a pool of threads, which share the (mocked) language model of the test.
+    """
+    def create_pool(self):
+        return ThreadPoolExecutor(max_workers=self.get_pool_size())
+
+
+@override_settings(VOICE_NLP_POOL_SIZE=1, VOICE_NLP_QUEUE_SIZE=1, VOICE_NLP_QUEUE_TIMEOUT=0.01)
+class NLPExecutorTest(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on parsing voice sessions with the NLP executor.
+    """
+
+    def setUp(self):
+        super().setUp()
+        FoodProductCommonName.objects.create(text='mushroom', food_product=self.product)
+
+        patcher = mock.patch.object(language_models, 'get', return_value=TaggingModel())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.executor = ThreadNLPExecutor()
+        self.addCleanup(self.executor.shutdown)
+
+        for target in ['caloriecounter.voice.pipeline.nlp_executor', 'caloriecounter.voice.api.views.nlp_executor']:
+            patcher = mock.patch(target, self.executor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_session(self, text):
+        session = VoiceSession.objects.create(user=self.user, user_date=datetime.date(2020, 1, 1),
+                                              user_time=datetime.time(12))
+        VoiceSessionItem.objects.create(session=session, type='user_input', text=text)
+        return session
+
+    def test_parse(self):
+        """
+        Assert:
+        1. The pool sends back the intent and the food items of every text, as plain values.
+        2. Sessions are processed with the results of the pool.
+        """
+        # Assert 1.
+        results = parse_in_worker(['I ate 20 g of mushrooms'])
+        self.assertEqual(pickle.loads(pickle.dumps(results)), results)
+        self.assertEqual(results[0][0], 'caloriecounter.voice.intents.create_diary_entry.action')
+        self.assertEqual([(item['quantity'], item['unit'], item['name']) for item in results[0][1]],
+                         [('20', 'g', 'mushroom')])
+
+        # Assert 2.
+        with mock.patch('caloriecounter.voice.executor.is_ready', return_value=True):
+            self.assertTrue(self.executor.start())
+        entries = DiaryEntry.objects.count()
+        session = self.create_session('I ate 20 g of mushrooms')
+        self.assertEqual(process_sessions([session]), [session])
+        self.assertEqual(DiaryEntry.objects.count(), entries + 1)
+
+    def test_backpressure(self):
+        """
+        Assert:
+        1. An ExecutorBusy is raised when the queue is full.
+        2. The voice_session-list view responds with 503, and a Retry-After, when the queue is full,
+           without creating a session.
+        3. A slot is only released once its task is done, also when the caller stopped waiting for it.
+        """
+        self.executor.get_pool()
+        self.executor._slots.acquire()
+
+        # Assert 1.
+        with self.assertRaises(ExecutorBusy):
+            self.executor.parse(['I ate 20 g of mushrooms'])
+
+        # Assert 2.
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+        response = client.post(reverse('voice_session-list'), {
+            'user_date': '2020-01-01', 'user_time': '12:00', 'items': [{'text': 'I ate 20 g of mushrooms'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(VoiceSession.objects.filter(user=self.user).exists())
+        self.executor._slots.release()
+
+        # Assert 3.
+        done = threading.Event()
+        with override_settings(VOICE_NLP_TIMEOUT=0.01), \
+                mock.patch('caloriecounter.voice.executor.parse_in_worker', side_effect=lambda *args: done.wait(5)):
+            with self.assertRaises(TimeoutError):
+                self.executor.parse(['I ate 20 g of mushrooms'])
+            with self.assertRaises(ExecutorBusy):
+                self.executor.parse(['I ate 20 g of mushrooms'])
+
+        done.set()
+        self.executor.shutdown()
+        self.assertTrue(self.executor._slots.acquire(timeout=1))
+        self.executor._slots.release()
@@ -0,0 +1,61 @@
+from unittest import mock
+
+import numpy as np
+import spacy
+from django.test import TestCase
+
+from caloriecounter.voice.intent_registry import IntentRegistry
+
+
+class IntentRegistryTest(TestCase):
+    """
+    A TestCase that performs tests on the intent registry of the voice app.
+    """
+
+    def setUp(self):
+        self.nlp = spacy.blank('en')
+        for word, vector in [('ate', [1, 0, 0]), ('log', [0.8, 0.6, 0]), ('is', [0, 1, 0]),
+                             ('eat', [0.9, 0, 0.1]), ('are', [0, 0.9, 0.1])]:
+            self.nlp.vocab.set_vector(word, np.array(vector, dtype=np.float32))
+
+        self.registry = IntentRegistry()
+        self.registry.register('caloriecounter.voice.intents.create_diary_entry.action', ['ate', 'log'])
+        self.registry.register('caloriecounter.voice.intents', ['is'])
+
+    def test_score(self):
+        """
+        Assert:
+        1. Every intent is scored by the cosine similarity of the tokens to its closest keyword.
+        2. The scores of several tokens are multiplied.
+        3. The keywords are only embedded once per model.
+        """
+        # Assert 1.
+        doc = self.nlp('eat are')
+        np.testing.assert_allclose(self.registry.score(self.nlp, [doc[0]]),
+                                   [0.9 / np.linalg.norm([0.9, 0, 0.1]), 0], atol=1e-6)
+
+        # Assert 2.
+        np.testing.assert_allclose(self.registry.score(self.nlp, [doc[0], doc[1]]),
+                                   self.registry.score(self.nlp, [doc[0]]) * self.registry.score(self.nlp, [doc[1]]),
+                                   atol=1e-6)
+
+        # Assert 3.
+        with mock.patch.object(self.nlp, 'pipe', side_effect=AssertionError('Keywords embedded again')):
+            self.registry.score(self.nlp, [doc[1]])
+
+    def test_get_probable_intent(self):
+        """
+        Assert:
+        1. The intent with the highest score is returned.
+        2. The first registered intent is returned for an utterance without verbs.
+        """
+        from caloriecounter.voice import intents
+        from caloriecounter.voice.intents.create_diary_entry import action
+
+        # Assert 1.
+        doc = self.nlp('eat are')
+        self.assertIs(self.registry.get_probable_intent(self.nlp, [doc[0]]), action)
+        self.assertIs(self.registry.get_probable_intent(self.nlp, [doc[1]]), intents)
+
+        # Assert 2.
+        self.assertIs(self.registry.get_probable_intent(self.nlp, []), action)
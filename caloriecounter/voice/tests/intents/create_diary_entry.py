@@ -1,11 +1,10 @@
 import json
 from unittest import TestCase
 
-from django.conf import settings
-
 from rest_framework.reverse import reverse
 
 from caloriecounter.voice.intents.create_diary_entry import utils
+from caloriecounter.voice.models_registry import get_language_model
 
 
 class CreateDiaryEntryIntentTest(TestCase):
@@ -19,7 +18,7 @@ class CreateDiaryEntryIntentTest(TestCase):
         1. For each command in the provided JSON file, the automatically extracted data matches the hand-curated data.
         """
 
-        nlp = settings.LANGUAGE_MODELS['en']
+        nlp = get_language_model('en')
 
         errors = []
 
@@ -0,0 +1,112 @@
+import datetime
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from caloriecounter.diary.tests import DiaryEntryBaseTest
+from caloriecounter.food.models import FoodProductCommonName
+from caloriecounter.voice.jobs import enqueue, process_jobs
+from caloriecounter.voice.models import VoiceSession, VoiceSessionItem, VoiceSessionJob
+from caloriecounter.voice.models_registry import language_models
+from caloriecounter.voice.tests.pipeline import TaggingModel
+
+
+class VoiceSessionJobTest(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on processing voice sessions asynchronously, with a job queue.
+    """
+
+    def setUp(self):
+        super().setUp()
+        FoodProductCommonName.objects.create(text='mushroom', food_product=self.product)
+
+        patcher = mock.patch.object(language_models, 'get', return_value=TaggingModel())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user_client = APIClient()
+        self.user_client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+
+    def create_input(self, text, session=None):
+        if session is None:
+            session = VoiceSession.objects.create(user=self.user, user_date=datetime.date(2020, 1, 1),
+                                                  user_time=datetime.time(12))
+        return VoiceSessionItem.objects.create(session=session, type='user_input', text=text)
+
+    def test_process_jobs(self):
+        """
+        Assert:
+        1. All pending jobs are processed in a batch, and marked done or failed.
+        2. Nothing is processed when the queue is empty.
+        3. Jobs whose batch fails as a whole stay queued, until they have been attempted VOICE_JOB_MAX_ATTEMPTS times.
+        4. Every job processes its own input, also when a session is updated twice within a batch.
+        """
+        job = enqueue(self.create_input('I ate 20 g of mushrooms'))
+        failed_job = enqueue(self.create_input('I ate 3 g of unicorns'))
+
+        # Assert 1.
+        self.assertEqual(process_jobs(), 2)
+        job.refresh_from_db()
+        failed_job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), ('done', 1))
+        self.assertEqual(failed_job.state, 'failed')
+        self.assertTrue(job.session.items.filter(type='objects_created').exists())
+
+        # Assert 2.
+        self.assertEqual(process_jobs(), 0)
+
+        # Assert 3.
+        job = enqueue(self.create_input('I ate 20 g of mushrooms'))
+        with override_settings(VOICE_JOB_MAX_ATTEMPTS=2), \
+                mock.patch('caloriecounter.voice.jobs.process_inputs', side_effect=RuntimeError('Out of memory')):
+            self.assertEqual(process_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.state, job.attempts, job.error), ('pending', 1, 'Out of memory'))
+
+            self.assertEqual(process_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.state, job.attempts), ('failed', 2))
+
+        # Assert 4.
+        first = self.create_input('I ate 20 g of mushrooms')
+        second = self.create_input('I ate 30 g of mushrooms', session=first.session)
+        enqueue(first)
+        enqueue(second)
+        self.assertEqual(process_jobs(), 2)
+        self.assertEqual(first.session.items.filter(type='objects_created').count(), 2)
+        self.assertEqual(sorted(entry['quantity'] for item in first.session.items.filter(type='objects_created')
+                                for entry in item.data), [20, 30])
+
+    @override_settings(VOICE_ASYNC=True, VOICE_INLINE_BUDGET=0)
+    def test_voice_session_async(self):
+        """
+        Assert:
+        1. With VOICE_ASYNC, creating a session queues a job, and responds with 202 and the URL of the result.
+        2. The voice_session-result view responds with 202 while the job is pending.
+        3. The voice_session-result view responds with the processed session once the job is done.
+        4. The voice_session-result view rejects an invalid ?wait=.
+        """
+        response = self.user_client.post(reverse('voice_session-list'), {
+            'user_date': '2020-01-01', 'user_time': '12:00', 'items': [{'text': 'I ate 20 g of mushrooms'}]
+        }, format='json')
+
+        # Assert 1.
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([item['type'] for item in response.data['items']], ['user_input'])
+        self.assertEqual(VoiceSessionJob.objects.filter(session=response.data['pk'], state='pending').count(), 1)
+
+        # Assert 2.
+        url = response['Location']
+        self.assertEqual(self.user_client.get(url, {'wait': 0}).status_code, 202)
+
+        # Assert 3.
+        process_jobs()
+        response = self.user_client.get(url, {'wait': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['type'] for item in response.data['items']],
+                         ['user_input', 'feedback', 'objects_created'])
+
+        # Assert 4.
+        self.assertEqual(self.user_client.get(url, {'wait': 'soon'}).status_code, 400)
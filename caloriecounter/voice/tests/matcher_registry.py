@@ -0,0 +1,39 @@
+from unittest import mock
+
+import spacy
+from django.test import TestCase
+
+from caloriecounter.voice.matcher_registry import MatcherRegistry
+
+
+class MatcherRegistryTest(TestCase):
+    """
+    A TestCase that performs tests on the pattern matcher registry of the voice app.
+    """
+
+    def setUp(self):
+        self.nlp = spacy.blank('en')
+
+        self.registry = MatcherRegistry()
+        self.registry.register('food', [[{"LOWER": "pizza"}], [{"LOWER": "slice"}, {"LOWER": "of"}, {"LOWER": "pizza"}]])
+        self.registry.register('verb', [[{"LOWER": "ate"}]])
+
+    def test_match(self):
+        """
+        Assert:
+        1. The matches of all patterns are returned by pattern name.
+        2. Patterns without matches have no matches.
+        3. The matcher is compiled once per vocabulary.
+        """
+        # Assert 1.
+        doc = self.nlp('I ate a slice of pizza')
+        matches = self.registry.match(doc)
+        self.assertEqual([(start, end) for match_id, start, end in matches['verb']], [(1, 2)])
+        self.assertEqual(sorted((start, end) for match_id, start, end in matches['food']), [(3, 6), (5, 6)])
+
+        # Assert 2.
+        self.assertEqual(self.registry.match(self.nlp('I drank water')), {'food': [], 'verb': []})
+
+        # Assert 3.
+        with mock.patch('caloriecounter.voice.matcher_registry.Matcher', side_effect=AssertionError('Compiled again')):
+            self.registry.match(doc)
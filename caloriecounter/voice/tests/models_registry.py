@@ -0,0 +1,87 @@
+from unittest import mock
+
+import spacy
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from caloriecounter.voice.models_registry import LanguageModelRegistry
+
+
+@override_settings(VOICE_LANGUAGE_MODELS={'en': 'en_test_model'})
+class LanguageModelRegistryTest(TestCase):
+    """
+    A TestCase that performs tests on the registry of spaCy models of the voice app.
+    """
+
+    def setUp(self):
+        self.registry = LanguageModelRegistry()
+        self.loads = []
+
+        def load_model(name):
+            self.loads.append(name)
+            return spacy.blank('en')
+
+        patcher = mock.patch.object(self.registry, 'load_model', side_effect=load_model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lazy_loading(self):
+        """
+        Assert:
+        1. Models are not loaded before they are used.
+        2. A model is loaded once, on first use, and then shared.
+        3. A language without a model raises a LookupError.
+        """
+        # Assert 1.
+        self.assertEqual(self.loads, [])
+        self.assertFalse(self.registry.ready)
+        self.assertEqual(self.registry.status(), {'en': {'model': 'en_test_model', 'state': 'not_loaded'}})
+
+        # Assert 2.
+        nlp = self.registry.get('en')
+        self.assertIs(self.registry.get('en'), nlp)
+        self.assertEqual(self.loads, ['en_test_model'])
+        self.assertEqual(self.registry.status()['en']['state'], 'loaded')
+
+        # Assert 3.
+        with self.assertRaises(LookupError):
+            self.registry.get('nl')
+
+    def test_warmup(self):
+        """
+        Assert:
+        1. warmup loads all configured models.
+        2. A model that fails to load is reported, without raising.
+        """
+        # Assert 1.
+        self.assertTrue(self.registry.warmup())
+        self.assertEqual(self.loads, ['en_test_model'])
+
+        # Assert 2.
+        self.registry.clear()
+        self.registry.load_model.side_effect = OSError('Model not installed')
+        self.assertFalse(self.registry.warmup())
+        self.assertEqual(self.registry.status()['en'], {'model': 'en_test_model', 'state': 'failed',
+                                                        'error': 'Model not installed'})
+
+    def test_voice_models_status(self):
+        """
+        Assert:
+        1. The voice_models view responds with 503 while the models are not loaded.
+        2. The voice_models view responds with 200 once the models are loaded.
+        """
+        url = reverse('voice_models-list')
+        client = APIClient()
+
+        with mock.patch('caloriecounter.voice.api.views.language_models', self.registry):
+            # Assert 1.
+            response = client.get(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.data['ready'], False)
+
+            # Assert 2.
+            self.registry.warmup()
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['models']['en']['state'], 'loaded')
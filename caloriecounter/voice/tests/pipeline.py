@@ -0,0 +1,131 @@
+import datetime
+from unittest import mock
+
+import spacy
+from django.core.management import call_command
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from caloriecounter.diary.models import DiaryEntry
+from caloriecounter.diary.tests import DiaryEntryBaseTest
+from caloriecounter.food.models import FoodProductCommonName
+from caloriecounter.voice.models import VoiceSession, VoiceSessionItem
+from caloriecounter.voice.models_registry import language_models
+from caloriecounter.voice.pipeline import process_sessions
+
+
+class TaggingModel:
+    """
+    A stand-in for a spaCy model, that tags the words of the test utterances.
+    """
+    tags = {'i': 'PRON', 'ate': 'VERB', 'of': 'ADP', 'g': 'NOUN', 'mushrooms': 'NOUN', 'unicorns': 'NOUN'}
+
+    def __init__(self):
+        self.nlp = spacy.blank('en')
+        self.texts = []
+
+    def tag(self, doc):
+        for token in doc:
+            token.pos_ = 'NUM' if token.like_num else self.tags.get(token.lower_, 'X')
+            token.lemma_ = token.lower_.rstrip('s')
+        return doc
+
+    def pipe(self, texts, **kwargs):
+        texts = list(texts)
+        self.texts.append(texts)
+        return (self.tag(self.nlp.make_doc(text)) for text in texts)
+
+    def __call__(self, text):
+        return next(self.pipe([text]))
+
+
+class VoicePipelineTest(DiaryEntryBaseTest):
+    """
+    A TestCase that performs tests on processing voice sessions in batches.
+    """
+
+    def setUp(self):
+        super().setUp()
+        FoodProductCommonName.objects.create(text='mushroom', food_product=self.product)
+
+        self.model = TaggingModel()
+        patcher = mock.patch.object(language_models, 'get', return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_session(self, text):
+        session = VoiceSession.objects.create(user=self.user, user_date=datetime.date(2020, 1, 1),
+                                              user_time=datetime.time(12))
+        VoiceSessionItem.objects.create(session=session, type='user_input', text=text)
+        return session
+
+    def test_process_sessions(self):
+        """
+        Assert:
+        1. All utterances are parsed in a single batch.
+        2. A diary entry is created for every utterance with a known product, dated by the session.
+        3. A session whose utterance can not be performed fails on its own, with an error item.
+        """
+        sessions = [self.create_session('I ate 20 g of mushrooms'),
+                    self.create_session('I ate 3 g of unicorns'),
+                    self.create_session('I ate 40 g of mushrooms')]
+        entries = DiaryEntry.objects.count()
+
+        results = process_sessions(sessions)
+
+        # Assert 1.
+        self.assertIn(['I ate 20 g of mushrooms', 'I ate 3 g of unicorns', 'I ate 40 g of mushrooms'],
+                      self.model.texts)
+
+        # Assert 2.
+        self.assertEqual(results[0], sessions[0])
+        self.assertEqual(results[2], sessions[2])
+        self.assertEqual(DiaryEntry.objects.count(), entries + 2)
+        created = sessions[2].items.get(type='objects_created')
+        self.assertEqual([(entry['product'], entry['quantity']) for entry in created.data], [(self.product.pk, 40)])
+        self.assertEqual(set(DiaryEntry.objects.filter(pk=created.data[0]['pk']).values_list('date', 'time')),
+                         {(datetime.date(2020, 1, 1), datetime.time(12))})
+
+        # Assert 3.
+        self.assertIsInstance(results[1], Exception)
+        self.assertEqual(list(sessions[1].items.values_list('type', 'user_created')),
+                         [('user_input', True), ('feedback', False)])
+
+    def test_voice_session_batch(self):
+        """
+        Assert:
+        1. The voice_session-batch view creates and processes all sessions, in order.
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.user_token.key)
+
+        response = client.post(reverse('voice_session-batch'), [
+            {'user_date': '2020-01-01', 'user_time': '12:00', 'items': [{'text': 'I ate 20 g of mushrooms'}]},
+            {'user_date': '2020-01-01', 'user_time': '13:00', 'items': [{'text': 'I ate 40 g of mushrooms'}]},
+        ], format='json')
+
+        # Assert 1.
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([session['user_time'] for session in response.data], ['12:00:00', '13:00:00'])
+        self.assertEqual([[item['type'] for item in session['items']] for session in response.data],
+                         [['user_input', 'feedback', 'objects_created']] * 2)
+
+    def test_reprocess(self):
+        """
+        Assert:
+        1. Reprocessing sessions replaces their responses.
+        2. Reprocessing sessions does not create their diary entries again.
+        """
+        session = self.create_session('I ate 20 g of mushrooms')
+        process_sessions([session])
+        entries = DiaryEntry.objects.count()
+
+        call_command('process_voice_utterances', reprocess=True, stdout=mock.MagicMock())
+
+        # Assert 1.
+        self.assertEqual(list(session.items.values_list('type', flat=True)),
+                         ['user_input', 'feedback', 'objects_created'])
+        self.assertEqual([entry['quantity'] for entry in session.items.get(type='objects_created').data], [20])
+
+        # Assert 2.
+        self.assertEqual(DiaryEntry.objects.count(), entries)
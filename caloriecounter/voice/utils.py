@@ -1,49 +1,23 @@
-from operator import itemgetter
-import functools
+from caloriecounter.voice.intent_registry import intents
+from caloriecounter.voice.matcher_registry import matchers
+from caloriecounter.voice.models_registry import get_language_model
 
-from spacy.matcher import Matcher
 
-from django.conf import settings
+def get_matches_for_subject_and_main_verb(doc, matches=None):
+    """
+    Return the matches of the main verbs in a Doc, from the matches of matchers.match(doc), if given.
+    """
+    if matches is None:
+        matches = matchers.match(doc)
 
-nlp = settings.LANGUAGE_MODELS['en']
+    return matches['subject-and-main-verb']
 
 
-def get_matches_for_subject_and_main_verb(doc):
-    matcher = Matcher(nlp.vocab)
-    # Add match ID "HelloWorld" with no callback and one pattern
-    patterns = []
-    # patterns.append([{"POS": "PRON"}, {"IS_STOP" : True, "OP" : "?"} ,{"POS": "VERB"}])
-    patterns.append([{"POS": "VERB"}])
-    matcher.add("i-ate", None, *patterns)
-    return matcher(doc)
+def get_probable_intent(doc, matches=None):
+    """
+    Return the intent (see intent_registry.py) that the verbs of an utterance most probably express.
+    """
+    tokens = [token for span_id, start, end in get_matches_for_subject_and_main_verb(doc, matches)
+              for token in doc[start:end] if token.pos_ == "VERB"]
 
-
-def get_probable_intent(doc):
-    from caloriecounter.voice.intents import create_diary_entry
-
-    list_of_spans = get_matches_for_subject_and_main_verb(doc)
-
-    if len(list_of_spans) == 0:
-        return create_diary_entry
-    intents = {
-        create_diary_entry : ['ate', 'log', 'register', 'write'],
-        #'query': ['are', 'is'],
-        #'recommend': ['should', 'recommend', 'can', 'eat', 'could'],
-    }
-
-    new_dict = {}
-
-    for (key, value) in intents.items():
-        for span_id, start, end in list_of_spans:
-            similarities = [0]
-            for token in filter(lambda x: x.pos_ == "VERB", doc[start:end]):
-                max_similarity = 0
-                for comparison_token_str in value:
-                    comparison_token = nlp(comparison_token_str)[0]
-                    similarity = token.similarity(comparison_token)
-                    max_similarity = max(similarity, max_similarity)
-                similarities.append(max_similarity)
-
-        new_dict[key] = functools.reduce(lambda x, y: x * y, similarities, 1)
-
-    return max(new_dict.items(), key=itemgetter(1))[0]
\ No newline at end of file
+    return intents.get_probable_intent(get_language_model(doc.lang_), tokens)
@@ -0,0 +1,72 @@
+# Gunicorn configuration: gunicorn -c gunicorn.conf.py caloriecounter.wsgi
+import os
+
+
+# With preload_app, the application is loaded once in the master, before the workers are forked,
+# so the spaCy models of the voice pipeline are loaded once and shared by all workers (copy-on-write).
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    from caloriecounter.voice.executor import nlp_executor
+
+    if server.cfg.preload_app and not nlp_executor.enabled:
+        from caloriecounter.voice.models_registry import warmup
+        warmup()
+
+
+# Without preload_app, every worker loads the models once it has loaded the application, before it accepts requests.
+# (This is post_worker_init rather than post_fork, since Django is not set up yet when a worker has just been forked.)
+# With the NLP executor (VOICE_NLP_POOL_SIZE), every worker starts its pool of processes instead, which load the models.
+def post_worker_init(worker):
+    from caloriecounter.voice.executor import nlp_executor
+
+    if nlp_executor.enabled:
+        nlp_executor.start()
+    elif not worker.cfg.preload_app:
+        from caloriecounter.voice.models_registry import warmup
+        warmup()
+
+    build_autocomplete_index(worker)
+    warm_search_cache(worker)
+
+
+# Every worker builds the autocomplete index before it accepts requests, so no request waits for it.
+# When this fails (i.e. the database is unavailable), the index is built on first use instead.
+def build_autocomplete_index(worker):
+    from django.db import connection
+    from caloriecounter.food.autocomplete import autocomplete_index
+
+    try:
+        autocomplete_index.build()
+    except Exception:
+        worker.log.exception('Failed to build the autocomplete index.')
+    finally:
+        connection.close()
+
+
+# A search result cache that is local to every worker (see FOOD_SEARCH_CACHE) is warmed by every worker when it starts,
+# with the FOOD_SEARCH_CACHE_WARM_TOP most popular searches. A shared cache is warmed on deploy instead,
+# with the warm_search_cache command.
+def warm_search_cache(worker):
+    from django.conf import settings
+    from django.core.cache.backends.locmem import LocMemCache
+    from django.db import connection
+    from rest_framework.settings import api_settings
+    from caloriecounter.food.search_cache import search_cache, warm_search_results
+
+    if not isinstance(search_cache.get_cache(), LocMemCache):
+        return
+
+    try:
+        warm_search_results(getattr(settings, 'FOOD_SEARCH_CACHE_WARM_TOP', 100), api_settings.PAGE_SIZE)
+    except Exception:
+        worker.log.exception('Failed to warm the search result cache.')
+    finally:
+        connection.close()
+
+
+def worker_exit(server, worker):
+    from caloriecounter.voice.executor import nlp_executor
+    nlp_executor.shutdown(wait=False)
+